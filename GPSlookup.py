@@ -2,6 +2,7 @@
 """
 import requests
 import logging
+import exifinfo
 
 def reverse_lookup(lat, lon):
   url = 'https://nominatim.openstreetmap.org/reverse'
@@ -20,23 +21,12 @@ def reverse_lookup(lat, lon):
 
   return ret
 
-def latlon2dec(direction, degrees, minutes, seconds):
-  # GPS info can be decimal or tuples
-  if isinstance(degrees, tuple): 
-    degrees = degrees[0] / degrees[1]
-  if isinstance(minutes, tuple): 
-    minutes = minutes[0] / minutes[1]
-  if isinstance(seconds, tuple): 
-    seconds = seconds[0] / seconds[1]
-  dec = float(degrees) + float(minutes)/60 + float(seconds)/(60*60)
-  if direction == 'S' or direction == 'W':
-    dec *= -1
-  return dec  
+latlon2dec = exifinfo.latlon2dec
 
+# gps_info: (lat, lon) as cached or GPSInfo IFD dict
 def lookup( gps_info ):
   try:
-    lat = latlon2dec( gps_info[1], gps_info[2][0], gps_info[2][1], gps_info[2][2] )
-    lon = latlon2dec( gps_info[3], gps_info[4][0], gps_info[4][1], gps_info[4][2] )  
+    lat, lon = exifinfo.gps_latlon( gps_info )
 
     json = reverse_lookup(lat, lon)  
     if json != 'ERROR':
@@ -61,3 +51,5 @@ if __name__ == "__main__":
 
   gps_info = { 1: 'N', 2: (48, 7, 1, 3.162), 3: 'E', 4: (11, 21, 5.236 ) } 
   print( lookup(gps_info) )
+
+  print( lookup( (48.13, 11.36) ) )
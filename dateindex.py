@@ -0,0 +1,120 @@
+#!/usr/bin/python
+''' Date index for the directory cache: vectorized (NumPy) selection of files by date
+'''
+import numpy as np
+from filecolumns import FileColumns
+
+SECS_PER_DAY = 3600*24
+
+class DateIndex:
+  ''' Keeps the file date (EXIF date, fallback: file changed date) of all cached files in one NumPy array.
+  The sorted view of this array allows to select all files by date with a few vectorized operations:
+  - files within [dt_from, dt_to] are always selected
+  - files within PROP_SLOPE days outside of the range are selected with linearly decreasing propability
+  - all other files are selected with the constant propability OUTDATED_FILE_PROP
+  '''
+  def __init__(self, dir_cache):
+    self.dirs = []        # [path, files] per directory
+    self.dir_range = {}   # path -> (start, end) within the index arrays
+    self.names = []       # filenames
+    chunks = []
+    sizes = []
+    for path, val in dir_cache.get('dir', {}).items():
+      files = val['files']
+      start = len(self.names)
+      self.names.extend(files.keys())
+      self.dir_range[path] = (start, len(self.names))
+      self.dirs.append( [path, files] )
+      chunks.append( self._dir_ftime(files) )
+      sizes.append( len(files) )
+    self.ftime = np.concatenate(chunks) if chunks else np.zeros(0)
+    self.dir_idx = np.repeat( np.arange(len(self.dirs), dtype=np.int32), sizes )
+    self.order = None # sorted view - gets created on demand
+    self.rng = np.random.default_rng()
+
+  def _dir_ftime(self, files):
+    if isinstance(files, FileColumns): # columns can be copied directly
+      dt = np.array(files.dt, dtype=np.float64)
+      return np.where( np.isnan(dt), np.array(files.mtime, dtype=np.float64), dt )
+    return np.fromiter( (attr[2] if attr[2] != None else attr[1] for attr in files.values()), dtype=np.float64, count=len(files) )
+
+  # re-read the file dates of a directory (e.g. after EXIF info was updated); returns False if index needs to be rebuilt
+  def update_dir(self, path, files):
+    rng = self.dir_range.get(path)
+    if rng is None or rng[1] - rng[0] != len(files):
+      return False
+    self.ftime[rng[0]:rng[1]] = self._dir_ftime(files)
+    self.order = None
+    return True
+
+  def _sorted(self):
+    if self.order is None:
+      self.order = np.argsort(self.ftime, kind='stable')
+      self.sorted_t = self.ftime[self.order]
+    return self.order, self.sorted_t
+
+  # Bernoulli sampling of index positions [lo, hi) of the sorted view with constant propability
+  def _sample_const(self, lo, hi, prop):
+    n = hi - lo
+    if n <= 0 or prop <= 0:
+      return np.zeros(0, dtype=np.int64)
+    if prop >= 1:
+      return np.arange(lo, hi)
+    k = self.rng.binomial(n, prop) # same distribution as n independent random draws
+    return lo + self.rng.choice(n, size=k, replace=False)
+
+  # Bernoulli sampling of index positions [lo, hi) of the sorted view with distance based propability
+  def _sample_slope(self, lo, hi, distance, slope, outdated):
+    if hi <= lo:
+      return np.zeros(0, dtype=np.int64)
+    prop = 1 - distance / slope
+    if outdated:
+      prop = np.maximum(outdated, prop)
+    return lo + np.flatnonzero( self.rng.random(hi - lo) <= prop )
+
+  # date propability of all files (same rules as select()) multiplied with a recency boost; returns array aligned with names / dir_idx
+  def weights(self, dt_from, dt_to, slope, outdated, now, recency=0, halflife=30):
+    t = self.ftime
+    distance = np.zeros_like(t)
+    if dt_from is not None:
+      distance = np.maximum(distance, dt_from - t)
+    if dt_to is not None:
+      distance = np.maximum(distance, t - dt_to)
+    if slope and slope > 0:
+      prop = 1 - distance / (slope * SECS_PER_DAY)
+    else:
+      prop = np.zeros_like(t)
+    if outdated:
+      prop = np.maximum(outdated, prop)
+    prop = np.maximum(prop, 0)
+    if recency:
+      prop = prop * (1 + recency * 0.5 ** ( np.maximum(0, now - t) / (halflife * SECS_PER_DAY) ))
+    return prop
+
+  # returns list of selected [path, files, filename]
+  def select(self, dt_from, dt_to, slope, outdated, path_restrict=False):
+    order, sorted_t = self._sorted()
+    n = len(sorted_t)
+    if dt_from is not None and dt_to is not None and dt_from > dt_to: # inverted range: no file within - distance per file like get_file_list always did
+      pos = np.flatnonzero( self.rng.random(n) <= self.weights(dt_from, dt_to, slope, outdated, 0)[order] )
+    elif slope and slope > 0:
+      window = slope * SECS_PER_DAY
+      lo = np.searchsorted(sorted_t, dt_from, 'left') if dt_from is not None else 0
+      hi = np.searchsorted(sorted_t, dt_to, 'right') if dt_to is not None else n
+      hi = max(lo, hi)
+      lo_slope = np.searchsorted(sorted_t, dt_from - window, 'left') if dt_from is not None else 0
+      hi_slope = np.searchsorted(sorted_t, dt_to + window, 'right') if dt_to is not None else n
+      parts = [
+        np.arange(lo, hi), # within range
+        self._sample_slope(lo_slope, lo, (dt_from - sorted_t[lo_slope:lo]) / SECS_PER_DAY, slope, outdated) if dt_from is not None else None,
+        self._sample_slope(hi, hi_slope, (sorted_t[hi:hi_slope] - dt_to) / SECS_PER_DAY, slope, outdated) if dt_to is not None else None,
+        self._sample_const(0, lo_slope, outdated or 0),
+        self._sample_const(hi_slope, n, outdated or 0) ]
+      pos = np.concatenate( [ p for p in parts if p is not None ] )
+    else: # without slope: all files get the same propability
+      pos = self._sample_const(0, n, outdated or 0)
+    idx = order[pos]
+    if path_restrict:
+      dir_ok = np.array( [ path.startswith(path_restrict) for path, _ in self.dirs ], dtype=bool )
+      idx = idx[ dir_ok[self.dir_idx[idx]] ]
+    return [ (self.dirs[d][0], self.dirs[d][1], self.names[i]) for i, d in zip(idx.tolist(), self.dir_idx[idx].tolist()) ]
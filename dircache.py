@@ -3,24 +3,102 @@
 '''  
 
 import os
-import fnmatch
+import concurrent.futures
 import datetime
 import time
 import random
+import threading
 import logging
 import pickle  
+import sqlite3
 import yaml
 from PIL import Image
 from config import cfg
-  
+from filecolumns import FileColumns, FileRef, convert_layout
+from yamlrules import FileRules, RuleMatcher
+from scanprofile import ScanProfile
+from playlist import Playlist
+import exifreader
+import exifinfo
+import iobudget
+
+try:
+  import dateindex # requires numpy
+except Exception as e:
+  dateindex = None
+  logging.warning("Couldn't initialize date index - using slower file selection: {}".format(e))
+
+NO_EXIF = 0 # orientation value which marks a file as "checked, but contains no usable EXIF info"
+
+# read EXIF info of an image; returns (orientation, dt, exif_info) - orientation and dt are None if they couldn't be read
+# raises OSError if the file itself can't be read (e.g. NAS not mounted) - that says nothing about its EXIF info
+def extract_exif(file_path_name, im=None):
+  exif_info = {}
+  dt = None
+  orientation = None
+  try:
+    exif_data = _read_exif_data(file_path_name, im)
+    dt = time.mktime(
+        time.strptime(exif_data[cfg['EXIF_DICT']['DateTimeOriginal']], '%Y:%m:%d %H:%M:%S'))
+    orientation = int(exif_data[cfg['EXIF_DICT']['Orientation']])
+    # assemble exif_info
+    for tag, val in cfg['EXIF_DICT'].items():
+      data = exif_data.get(val)
+      if data:
+        exif_info[tag] = data
+  except OSError as e:
+    if e.errno is not None: # I/O error - PIL reports unknown or truncated images without errno
+      raise
+    logging.debug('Exception while trying to read EXIF: {}'.format(str(e)) )
+  except Exception as e: # NB should really check error here but it's almost certainly due to lack of exif data
+    logging.debug('Exception while trying to read EXIF: {}'.format(str(e)) )
+  return (orientation, dt, exif_info)
+
+# EXIF tags of an image: JPEG files are parsed by the header-only reader (EXIF_READER "header"), everything else by PIL
+def _read_exif_data(file_path_name, im=None):
+  if im is None and cfg.get('EXIF_READER', 'header') == 'header':
+    try:
+      return exifreader.read_exif(file_path_name)
+    except exifreader.UnsupportedFormat as err:
+      logging.debug('Reading EXIF of {} with PIL: {}'.format(file_path_name, str(err)) )
+  if im is None:
+    with Image.open(file_path_name) as im: # lazy operation - doesn't decode the image
+      return im._getexif() # TODO check if/when this becomes proper function
+  return im._getexif()
+
 class DirCache:
   dir_cache = {}
   fname = ""
   dirty = False
+  scan_stats = {}
+  refresher = None
+  store = None
 
   # ------- private core functionalities -----------------
-  def __init__(self, fname=cfg['DIR_CACHE_FILE']):
+  def __init__(self, fname=cfg['DIR_CACHE_FILE'], pic_dir=None, check_tm=None):
     self.fname = fname
+    self.pic_dir = os.path.normpath( pic_dir or cfg['PIC_DIR'] )
+    self.check_tm = check_tm if check_tm is not None else cfg['CHECK_DIR_TM']
+    self.lock = threading.Lock()
+    self.changed = threading.Event()
+    self.dirty_dirs = set()     # changed directories - not yet written to store
+    self.deleted_dirs = set()   # deleted directories - not yet written to store 
+    self.dirty_files = set()    # (path, filename) with changed EXIF info - not yet written to store
+    self.pending_lock = threading.Lock()
+    self.compact = cfg.get('CACHE_LAYOUT', 'list') == 'compact'
+    self.generation = 0         # gets incremented whenever the directory structure changed
+    self.date_index = None
+    self.date_index_gen = -1
+    self.index_stale_dirs = set() # directories with changed EXIF dates - not yet updated in date_index
+    self.pending_changes = {}     # changed files since last get_changes()
+    self.yaml_rules = {}          # path -> (ytime, compiled FileRules)
+    self.profile = ScanProfile()
+    self.dup_index = None
+    if cfg.get('DEDUP', False):
+      import dupindex
+      self.dup_index = dupindex.DupIndex( os.path.splitext(fname)[0] + ".dup" )
+    if cfg.get('DIR_CACHE_BACKEND', 'pickle') == 'sqlite':
+      self.store = DirCacheDB( os.path.splitext(fname)[0] + ".db" )
     self._read_dir_cache()
 
   def _parse_yaml_file(self, filepath):
@@ -32,149 +110,439 @@ class DirCache:
       logging.error("Couldn't read .INFOTAINMENT yaml file: {} - {}".format(filepath, err) )
       return None
 
-  def _yaml_permits(self, yaml_cfg, filename):
-    permitted = True 
-    if yaml_cfg:
-      exclude = yaml_cfg.get("exclude")
-      include = yaml_cfg.get("include")
-      if exclude:
-        for ex_pattern in exclude:
-          if fnmatch.fnmatch( filename, ex_pattern ):
-            permitted = False 
-            if include:
-              for in_pattern in include:
-                if fnmatch.fnmatch( filename, in_pattern ):
-                  permitted = True    
-                  break
-            break
-    return permitted
-
-  def _update_dir_cache(self):
+  # effective rules of a directory; compiled rules are cached as long as the YAML file's mtime (ytime) doesn't change
+  def _get_rules(self, root, ytime, inherited=None):
+    rules = None
+    if ytime > 0:
+      cached = self.yaml_rules.get(root)
+      if cached is not None and cached[0] == ytime:
+        rules = cached[1]
+      else:
+        with self.profile.phase('yaml'):
+          rules = FileRules( self._parse_yaml_file( os.path.join(root, ".INFOTAINMENT.yaml") ) )
+        self.yaml_rules[root] = (ytime, rules)
+    else:
+      self.yaml_rules.pop(root, None)
+    if rules is None and inherited is None:
+      return None
+    return RuleMatcher(rules, ytime, inherited)
+
+  # rules inherited from the parent directories of root (up to pic_dir)
+  def _inherited_rules(self, root):
+    picture_dir = self.pic_dir
+    parents = []
+    path = root
+    while path != picture_dir and path.startswith(os.path.join(picture_dir, '')):
+      path = os.path.dirname(path)
+      parents.append(path)
+    inherited = None
+    for path in reversed(parents):
+      yaml_fname = os.path.join(path, ".INFOTAINMENT.yaml")
+      ytime = os.stat(yaml_fname).st_mtime if os.path.isfile(yaml_fname) else 0.0
+      rules = self._get_rules(path, ytime, inherited)
+      inherited = rules.inherited() if rules else None
+    return inherited
+
+  def _is_picture(self, rules, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return ext in cfg['PIC_EXT'] and not filename.startswith('.') and (rules is None or rules.permits(filename))
+
+  # store scan result of a single directory; returns True if cache got changed
+  def _store_dir(self, cache, root, ctime, mtime, ytime, files, force=False):
+    old_files = {}
+    if root in cache['dir']: # directory is already known
+      cache['dir'][root]['meta'][3] = True # mark directory as existing  
+      old_files = cache['dir'][root]['files']
+      if not force and cache['dir'][root]['meta'][1] == mtime and cache['dir'][root]['meta'][2] == ytime: # check if directory changed since last scan
+        logging.debug(' - {}: unchanged'.format(root) )
+        return False
+      logging.info(' - {}: directory changed ({} - {})'.format(root, cache['dir'][root]['meta'][1], mtime ) )  
+    cache['dir'][root] = {} # always create a new entry - previous cache generation might still be in use
+    self.dirty_dirs.add(root)
+    # [file_create_date, file_changed_date, yuml_date, exif_info]
+    cache['dir'][root]['meta'] = [ ctime, mtime, ytime, True ]
+    cache['dir'][root]['files'] = FileColumns(root) if self.compact else {}
+
+    logging.info(' - {}: Scanning files'.format(root) )
+    changes = { 'added': set(), 'removed': {}, 'modified': {} }
+    for filename, fmtime in files():
+      old = old_files.get(filename)
+      if old is not None and old[1] == fmtime: # unchanged file - keep EXIF info
+        cache['dir'][root]['files'][filename] = [old[0], old[1], old[2], old[3]]
+        continue
+      if old is None:
+        changes['added'].add(filename)
+      else:
+        changes['modified'][filename] = old[1]
+      orientation = 1 # this is default - unrotated
+      dt = None # EXIF create date  - used for checking in tex_load
+      exif_info = {}
+      # [orientation, file_changed_date, exif_date, exif_info] 
+      cache['dir'][root]['files'][filename] = [orientation, fmtime, dt, exif_info] 
+    for filename, attr in old_files.items():
+      if filename not in cache['dir'][root]['files']:
+        changes['removed'][filename] = attr[1]
+    self._add_changes(root, changes)
+    return True
+
+  # merge changes of a directory into pending change set
+  def _add_changes(self, root, changes):
+    with self.pending_lock:
+      pending = self.pending_changes.setdefault(root, { 'added': set(), 'removed': {}, 'modified': {} })
+      for filename, mtime in changes['removed'].items():
+        if filename in pending['added']: # added and removed again -> no change at all
+          pending['added'].discard(filename)
+        else:  
+          pending['removed'][filename] = pending['modified'].pop(filename, mtime)
+      for filename, mtime in changes['modified'].items():
+        if filename not in pending['added']:
+          pending['modified'].setdefault(filename, mtime)
+      for filename in changes['added']:
+        if filename in pending['removed']: # removed and added again -> modified
+          pending['modified'][filename] = pending['removed'].pop(filename)
+        else:
+          pending['added'].add(filename)
+
+  # returns changes since last call: { path: {'added': set(filename), 'removed': {filename: old_mtime}, 'modified': {filename: old_mtime}} }
+  def get_changes(self):
+    with self.pending_lock:
+      changes, self.pending_changes = self.pending_changes, {}
+    return changes
+
+  # create file list entries for the added and modified files of a change set
+  def get_changed_file_list(self, changes, dt_from=None, dt_to=None):
+    dt_from, dt_to, path_restrict = self._file_list_filter(dt_from, dt_to)
+    file_list = []
+    for path, change in changes.items():
+      val = self.dir_cache['dir'].get(path)
+      if val is None or (path_restrict and not path.startswith( path_restrict )):
+        continue
+      for item in change['added'] | set(change['modified']):
+        attr = val['files'].get(item)
+        if attr is not None and random.random() <= self._propability(attr, dt_from, dt_to):
+          file_list.append( self._file_list_entry(path, val['files'], item) )
+    return file_list
+
+  # classic scanner: serial os.walk 
+  def _scan_dirs_walk(self, cache, picture_dir, budget=None):
+    updated = False
+    inherited = {} # path -> rules inherited by its subdirectories
+    profile = self.profile
+    tm_next = time.perf_counter()
+    for root, subdirs, filenames in os.walk(picture_dir, topdown=True):
+      tm_dir, tm = tm_next, time.perf_counter()
+      profile.add_time('walk', tm - tm_dir) # os.walk reads the listing of root before yielding it
+      subdirs[:] = [d for d in subdirs if d not in cfg['IGNORE_DIRS']] # prune irrelevant subdirs
+      mtime = os.stat(root).st_mtime 
+      ctime = os.stat(root).st_ctime
+      yaml_fname = os.path.join(root, ".INFOTAINMENT.yaml")
+      ytime = 0.0
+      syscalls = 4 # scandir(root), 2x stat(root), isfile(yaml)
+      if os.path.isfile( yaml_fname ):
+        ytime = os.stat(yaml_fname).st_mtime           
+        syscalls += 1
+      profile.add_time('stat', time.perf_counter() - tm)
+      if budget is not None:
+        profile.add_time('throttle', budget.acquire(syscalls))
+      rules = self._get_rules(root, ytime, inherited.get(os.path.dirname(root)) if root != picture_dir else None)
+      if rules:
+        ytime = rules.ytime # changed rules of a parent directory require a rescan as well
+        if rules.excludes_all():
+          subdirs[:] = [] # whole subtree is excluded
+        elif rules.inherited():
+          inherited[root] = rules.inherited()
+
+      stat_calls = [0]
+      def files(root=root, filenames=filenames, rules=rules, stat_calls=stat_calls):
+        for filename in filenames:
+          if self._is_picture(rules, filename):
+            stat_calls[0] += 1
+            if budget is not None:
+              profile.add_time('throttle', budget.acquire())
+            try:
+              yield filename, os.path.getmtime(os.path.join(root, filename))
+            except OSError as err: # e.g. broken symlink - skip the file, not the directory
+              logging.warning("Couldn't stat file: {}".format(str(err)))
+
+      tm_files = time.perf_counter()
+      if self._store_dir(cache, root, ctime, mtime, ytime, files):
+        updated = True
+      tm_next = time.perf_counter()
+      profile.add_time('enumerate', tm_next - tm_files)
+      profile.add_dir(root, tm_next - tm_dir, syscalls + stat_calls[0])
+    return updated
+
+  # read a single directory via os.scandir - runs within scanner thread pool
+  def _scan_one_dir(self, root, root_stat, known_meta, inherited=None, budget=None):
+    profile = self.profile
+    if budget is not None:
+      profile.add_time('throttle', budget.acquire(2)) # stat(root), scandir(root)
+    tm_dir = time.perf_counter()
+    stat_calls = 1 # stat of root itself (done by caller) 
+    subdirs = []
+    candidates = []
+    yaml_entry = None
+    with os.scandir(root) as it:
+      for entry in it:
+        if entry.is_dir(): # uses d_type - no extra syscall on most filesystems
+          if not entry.is_symlink() and entry.name not in cfg['IGNORE_DIRS']: # os.walk doesn't follow symlinks either
+            subdirs.append(entry)
+        elif entry.name == ".INFOTAINMENT.yaml":
+          yaml_entry = entry
+        else:
+          candidates.append(entry)
+    tm = time.perf_counter()
+    profile.add_time('walk', tm - tm_dir)
+    ytime = 0.0
+    if yaml_entry is not None:
+      if budget is not None:
+        profile.add_time('throttle', budget.acquire())
+      try:
+        ytime = yaml_entry.stat().st_mtime
+      except OSError: # broken symlink - os.path.isfile() of the walk scanner is False as well
+        pass
+      stat_calls += 1
+      profile.add_time('stat', time.perf_counter() - tm)
+    rules = self._get_rules(root, ytime, inherited)
+    if rules:
+      ytime = rules.ytime # changed rules of a parent directory require a rescan as well
+      if rules.excludes_all():
+        subdirs = [] # whole subtree is excluded
+    files = None
+    if known_meta != (root_stat.st_mtime, ytime): # directory new or changed -> enumerate files
+      tm = time.perf_counter()
+      pictures = [ entry for entry in candidates if self._is_picture(rules, entry.name) ]
+      waited = budget.acquire(len(pictures)) if budget is not None else 0.0
+      files = []
+      for entry in pictures:
+        try:
+          files.append( (entry.name, entry.stat().st_mtime) )
+        except OSError as err: # e.g. broken symlink - skip the file, not the directory
+          logging.warning("Couldn't stat file: {}".format(str(err)))
+      stat_calls += len(pictures)
+      profile.add_time('throttle', waited)
+      profile.add_time('enumerate', time.perf_counter() - tm - waited)
+    # stat calls the os.walk scanner needs for the same work: 2x stat(root), isfile(yaml), stat(yaml), getmtime(file)  
+    walk_calls = 3 + (1 if yaml_entry is not None else 0) + (len(files) if files is not None else 0)
+    if os.name == 'nt': # Windows delivers stat data with the directory listing
+      stat_calls = 1 
+    profile.add_dir(root, time.perf_counter() - tm_dir, stat_calls + 1) # incl. scandir(root)
+    return root, root_stat, ytime, subdirs, files, walk_calls - stat_calls, rules.inherited() if rules else None
+
+  # scandir based scanner: fans out directories across a bounded thread pool 
+  def _scan_dirs_parallel(self, cache, picture_dir, budget=None):
+    updated = False
+    self.scan_stats = { 'dirs': 0, 'stat_saved': 0 }
+    if not os.path.isdir(picture_dir): # like os.walk: nothing to scan
+      logging.warning("Image directory {} not accessible".format(picture_dir))
+      return updated
+    known = { root: (val['meta'][1], val['meta'][2]) for root, val in cache['dir'].items() }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=cfg.get('SCAN_THREADS', 8)) as executor:
+      pending = { executor.submit(self._scan_one_dir, picture_dir, os.stat(picture_dir), known.get(picture_dir), None, budget) }
+      while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          try:
+            root, root_stat, ytime, subdirs, files, saved, inherited = future.result()
+          except OSError as err:
+            logging.warning("Couldn't scan directory: {}".format(str(err)))
+            continue
+          with self.profile.phase('stat'):
+            for entry in subdirs:
+              try:
+                pending.add( executor.submit(self._scan_one_dir, entry.path, entry.stat(), known.get(entry.path), inherited, budget) )
+              except OSError as err:
+                logging.warning("Couldn't stat directory: {}".format(str(err)))
+          self.scan_stats['dirs'] += 1
+          self.scan_stats['stat_saved'] += saved
+          if files is None: # unchanged since last scan
+            cache['dir'][root]['meta'][3] = True # mark directory as existing  
+            logging.debug(' - {}: unchanged'.format(root) )
+            continue
+          if self._store_dir(cache, root, root_stat.st_ctime, root_stat.st_mtime, ytime, lambda files=files: files):
+            updated = True
+    logging.info('Scanned {} directories - saved {} stat calls'.format(self.scan_stats['dirs'], self.scan_stats['stat_saved']))
+    return updated
+
+  # budget: IOBudget for background scans - None: scan at full speed
+  def _update_dir_cache(self, cache, force=False, budget=None):
     tm = datetime.datetime.now()
     updated = False
-    picture_dir = os.path.normpath( cfg['PIC_DIR'] )
+    picture_dir = self.pic_dir
+    if not os.path.isdir(picture_dir): # e.g. NAS not mounted - keep the cached content
+      logging.warning("Image directory {} not accessible - directory cache not refreshed".format(picture_dir))
+      return False
 
-    if len(self.dir_cache) < 2: # invalid - create new one
+    if len(cache) < 2: # invalid - create new one
       logging.info('Refreshing directory cache. No valid pickle file found - creating new one')
-      self.dir_cache.clear()
-      self.dir_cache['dir'] = {}
-      self.dir_cache['statistics'] = {}
-      self.dir_cache['statistics']['path'] = picture_dir 
-      self.dir_cache['statistics']['created'] = tm
-      self.dir_cache['statistics']['checked'] = tm
+      cache.clear()
+      cache['dir'] = {}
+      cache['statistics'] = {}
+      cache['statistics']['path'] = picture_dir 
+      cache['statistics']['created'] = tm
+      cache['statistics']['checked'] = tm
     else:  
-      if not self.dir_cache['statistics'].get('path'):
-        self.dir_cache['statistics']['path'] = picture_dir # migration only - TODO: remove
-      if self.dir_cache['statistics']['path'] == picture_dir:  
-        if tm < self.dir_cache['statistics']['checked'] + datetime.timedelta(seconds=cfg['CHECK_DIR_TM']):  
-          logging.info('Refresh of directory cache not necessary: Last check: {}'.format(str(self.dir_cache['statistics']['checked'])))
+      if not cache['statistics'].get('path'):
+        cache['statistics']['path'] = picture_dir # migration only - TODO: remove
+      if cache['statistics']['path'] == picture_dir:  
+        if not force and tm < cache['statistics']['checked'] + datetime.timedelta(seconds=self.check_tm):  
+          logging.info('Refresh of directory cache not necessary: Last check: {}'.format(str(cache['statistics']['checked'])))
           return False
         else:
-          logging.info('Refreshing directory cache. Last check: {}'.format(str(self.dir_cache['statistics']['checked'])))
+          logging.info('Refreshing directory cache. Last check: {}'.format(str(cache['statistics']['checked'])))
       else:
           logging.info('Refreshing directory cache. Image directory changed.')
-          self.dir_cache['statistics']['path'] = picture_dir 
+          cache['statistics']['path'] = picture_dir 
           updated = True
           
     # mark all directories in cache
-    for dir_item, val in self.dir_cache['dir'].items():
+    for dir_item, val in cache['dir'].items():
       val['meta'][3] = False    
 
-    for root, subdirs, filenames in os.walk(picture_dir, topdown=True):
-      subdirs[:] = [d for d in subdirs if d not in cfg['IGNORE_DIRS']] # prune irrelevant subdirs
-      mtime = os.stat(root).st_mtime 
-      ctime = os.stat(root).st_ctime
-      yaml_fname = os.path.join(root, ".INFOTAINMENT.yaml")
-      ytime = 0.0
-      if os.path.isfile( yaml_fname ):
-        ytime = os.stat(yaml_fname).st_mtime           
-      if root in self.dir_cache['dir']: # directory is already known
-        self.dir_cache['dir'][root]['meta'][3] = True # mark directory as existing  
-        if self.dir_cache['dir'][root]['meta'][1] == mtime and self.dir_cache['dir'][root]['meta'][2] == ytime: # check if directory changed since last scan
-          logging.debug(' - {}: unchanged'.format(root) )
-          continue
-        else: # dir changed
-          logging.info(' - {}: directory changed ({} - {})'.format(root, self.dir_cache['dir'][root]['meta'][1], mtime ) )  
-          self.dir_cache['dir'][root]['meta'] = [ ctime, mtime, ytime, True ]   
-          self.dir_cache['dir'][root]['files'].clear()
-      else: 
-        self.dir_cache['dir'][root] = {}
-        # [file_create_date, file_changed_date, yuml_date, exif_info] 
-        self.dir_cache['dir'][root]['meta'] = [ ctime, mtime, ytime, True ]   
-        self.dir_cache['dir'][root]['files'] = {} 
+    self.profile.reset()
+    tm_scan = time.perf_counter()
 
-      updated = True
-      logging.info(' - {}: Scanning files'.format(root) )
-      yaml_cfg = None
-      if ytime > 0:
-        yaml_cfg = self._parse_yaml_file( os.path.join(root, yaml_fname) )
-      for filename in filenames:
-        ext = os.path.splitext(filename)[1].lower()
-        if ext in cfg['PIC_EXT'] and not filename.startswith('.') and self._yaml_permits(yaml_cfg, filename):
-          file_path_name = os.path.join(root, filename)
-          mtime = os.path.getmtime(file_path_name)        
-          orientation = 1 # this is default - unrotated
-          dt = None # EXIF create date  - used for checking in tex_load
-          exif_info = {}
-          # [orientation, file_changed_date, exif_date, exif_info] 
-          self.dir_cache['dir'][root]['files'][filename] = [orientation, mtime, dt, exif_info] 
+    if cfg.get('SCAN_MODE', 'walk') == 'scandir':
+      if self._scan_dirs_parallel(cache, picture_dir, budget):
+        updated = True
+    else:
+      if self._scan_dirs_walk(cache, picture_dir, budget):
+        updated = True
 
     # cleanup cache
+    tm_cleanup = time.perf_counter()
     delete_list = []
-    for dir_item, val in self.dir_cache['dir'].items():
+    for dir_item, val in cache['dir'].items():
       if val['meta'][3] == False: # directory not existing any more     
         delete_list.append(dir_item)    
     if len(delete_list) > 0:
       updated = True
       for i in delete_list:
-        del self.dir_cache['dir'][i]
+        self._add_changes(i, { 'added': set(), 'removed': { name: attr[1] for name, attr in cache['dir'][i]['files'].items() }, 'modified': {} })
+        del cache['dir'][i]
+        self.deleted_dirs.add(i)
         logging.info('Deleting dir from cache: {}'.format(i) )
+    self.profile.add_time('cleanup', time.perf_counter() - tm_cleanup)
+    self.profile.duration = time.perf_counter() - tm_scan
 
-    self.dir_cache['statistics']['checked'] = tm
+    cache['statistics']['checked'] = tm
     if updated:
-      self.dir_cache['statistics']['created'] = tm
-      logging.info('Directory cache refreshed: {} directories'.format( len(self.dir_cache['dir'] )))
+      cache['statistics']['created'] = tm
+      logging.info('Directory cache refreshed: {} directories'.format( len(cache['dir'] )))
     else:  
       logging.info('Directory cache: No changes')
     return updated
 
   def _save_dir_cache(self):
+    with self.profile.phase('save'):
+      self._write_dir_cache()
+
+  def _write_dir_cache(self):
+    if self.store is not None:
+      self._save_dir_cache_db()
+      return
     try:
+      with self.pending_lock: # snapshot - set_exif_info() waits meanwhile; later changes set dirty again
+        self.dirty = False
+        data = pickle.dumps(self.dir_cache)
       with open(self.fname+".tmp", 'wb') as myfile:
-        pickle.dump(self.dir_cache, myfile)
+        myfile.write(data)
       os.replace(self.fname+".tmp", self.fname)  
       logging.info('Saved directory cache to pickle file {}'.format(self.fname))
-    except OSError as err:
+    except (OSError, RuntimeError, pickle.PicklingError) as err:
+      self.dirty = True
       logging.info("Couldn't write directory cache to pickle file: {}".format(str(err)))
 
+  def _save_dir_cache_db(self):
+    # take over pending changes - new ones might get added by other threads meanwhile 
+    with self.pending_lock:
+      dirs, self.dirty_dirs = self.dirty_dirs, set()
+      deleted_dirs, self.deleted_dirs = self.deleted_dirs, set()
+      files, self.dirty_files = self.dirty_files, set()
+      self.dirty = False # later changes set it again
+    try:
+      self.store.save(self.dir_cache, dirs, deleted_dirs, files)
+      logging.info('Saved directory cache to database {}: {} dirs, {} files changed'.format(self.store.fname, len(dirs)+len(deleted_dirs), len(files)))
+    except sqlite3.Error as err:
+      with self.pending_lock:
+        self.dirty = True
+        self.dirty_dirs |= dirs
+        self.deleted_dirs |= deleted_dirs
+        self.dirty_files |= files
+      logging.info("Couldn't write directory cache to database: {}".format(str(err)))
+
   def _read_dir_cache(self):
+    if self.store is not None:
+      self._read_dir_cache_db()
+      return
     logging.info('Reading directory cache from pickle file {}'.format(self.fname))
     try:
-      with open(self.fname, 'rb') as myfile:
-        self.dir_cache = pickle.load( myfile )
+      with self.profile.phase('load'):
+        with open(self.fname, 'rb') as myfile:
+          self.dir_cache = pickle.load( myfile )
+        convert_layout(self.dir_cache, 'compact' if self.compact else 'list')
+      self._compact_exif()
     except OSError as err:
       logging.info("Couldn't read directory cache from pickle file: {}".format(str(err)))
       self.dir_cache = {}
-      self.refresh_cache()
-  
+      self._refresh_generation()
+
+  def _read_dir_cache_db(self):
+    try:
+      if self.store.is_empty() and os.path.isfile(self.fname): # one-time migration from pickle file
+        logging.info('Migrating directory cache from pickle file {} to database {}'.format(self.fname, self.store.fname))
+        with open(self.fname, 'rb') as myfile:
+          self.dir_cache = pickle.load( myfile )
+        convert_layout(self.dir_cache, 'compact' if self.compact else 'list')
+        self._compact_exif()
+        if len(self.dir_cache) >= 2:
+          self.dirty_dirs.update( self.dir_cache['dir'].keys() )
+          self._save_dir_cache()
+        return
+      logging.info('Reading directory cache from database {}'.format(self.store.fname))
+      if not self.store.is_empty():
+        with self.profile.phase('load'):
+          self.dir_cache = self.store.load()
+          convert_layout(self.dir_cache, 'compact' if self.compact else 'list')
+        self._compact_exif()
+        return
+    except (OSError, pickle.UnpicklingError, sqlite3.Error) as err:
+      logging.info("Couldn't read directory cache: {}".format(str(err)))
+    self.dir_cache = {}
+    self._refresh_generation()
+
+  # one-time migration of EXIF infos cached by older versions to the compact representation
+  def _compact_exif(self):
+    if len(self.dir_cache) < 2 or self.dir_cache['statistics'].get('exif_compact'):
+      return
+    changed = exifinfo.compact_all(self.dir_cache)
+    self.dir_cache['statistics']['exif_compact'] = True
+    with self.pending_lock:
+      self.dirty_files |= changed
+    self.dirty = True
+
   # ----------- public functions --------------------
   # update cache: set exif data for given file
   def set_exif_info( self, file_path_name, orientation, dt, exif_info ):
     file_path_name = os.path.normpath( file_path_name )
     path, fname = os.path.split( file_path_name )
     try:
-      self.dir_cache['dir'][path]['files'][fname][0] = orientation
-      self.dir_cache['dir'][path]['files'][fname][2] = dt
-      self.dir_cache['dir'][path]['files'][fname][3] = exif_info
-      self.dirty = True
+      exif_info = exifinfo.compact(exif_info)
+      with self.pending_lock: # not while _write_dir_cache() takes its snapshot
+        self.dir_cache['dir'][path]['files'][fname][0] = orientation
+        self.dir_cache['dir'][path]['files'][fname][2] = dt
+        self.dir_cache['dir'][path]['files'][fname][3] = exif_info
+        self.dirty_files.add( (path, fname) )
+        self.dirty = True
+      self.index_stale_dirs.add(path)
     except Exception as err:
       logging.error("Couldn't update EXIF info for: {} - {}".format(file_path_name, str(err)))
 
   def get_exif_info(self, file_path_name):
     exif_data = {}
     file_path_name = os.path.normpath( file_path_name )
-    if not file_path_name.startswith(cfg['PIC_DIR']):
-      file_path_name = os.path.join(cfg['PIC_DIR'], file_path_name)
+    if not file_path_name.startswith(self.pic_dir):
+      file_path_name = os.path.join(self.pic_dir, file_path_name)
     path, fname = os.path.split( file_path_name )
     exif_data['path'] = path
     exif_data['file'] = fname
@@ -187,42 +555,142 @@ class DirCache:
     return exif_data  
 
   def read_exif_info(self, file_path_name, im=None):
-    exif_info = {}
-    dt = None
-    orientation = None
     try:
-      if im is None:
-        im = Image.open(file_path_name) # lazy operation so shouldn't load (better test though)
-      exif_data = im._getexif() # TODO check if/when this becomes proper function
-      dt = time.mktime(
-          time.strptime(exif_data[cfg['EXIF_DICT']['DateTimeOriginal']], '%Y:%m:%d %H:%M:%S'))
-      orientation = int(exif_data[cfg['EXIF_DICT']['Orientation']])
-      # assemble exif_info
-      for tag, val in cfg['EXIF_DICT'].items():
-        data = exif_data.get(val)
-        if data:
-          exif_info[tag] = data
+      (orientation, dt, exif_info) = extract_exif(file_path_name, im)
+    except OSError as err: # not cached - read again next time
+      logging.debug("Couldn't read EXIF of {}: {}".format(file_path_name, str(err)))
+      (orientation, dt, exif_info) = (None, None, {})
+    exif_info = exifinfo.compact(exif_info)
+    if orientation != None:
       self.set_exif_info( file_path_name, orientation, dt, exif_info ) # write back to cache
-    except Exception as e: # NB should really check error here but it's almost certainly due to lack of exif data
-      logging.debug('Exception while trying to read EXIF: {}'.format(str(e)) )
+    else: 
       if dt == None:
         dt = os.path.getmtime(file_path_name) # so use file last modified date
-      if orientation == None:
-        orientation = 1
+      orientation = 1
     return (orientation, dt, exif_info)
 
+  # mark file as checked by the EXIF harvester, but it doesn't contain usable EXIF info
+  def set_no_exif(self, file_path_name):
+    self.set_exif_info( file_path_name, NO_EXIF, None, {} )
+
+  # iterate over all files which still need to be checked for EXIF info
+  def iter_exif_todo(self):
+    for path, val in list(self.dir_cache.get('dir', {}).items()):
+      for fname, attr in list(val['files'].items()):
+        if attr[2] == None and attr[0] != NO_EXIF:
+          yield os.path.join(path, fname)
+
+  # save cache if it got changed - can be used as checkpoint by background workers  
+  # skipped while a refresh holds the lock (e.g. a throttled background scan) - it saves the changes when done 
+  def save_cache(self):
+    if not self.lock.acquire(blocking=False):
+      logging.debug('Directory cache busy - save skipped')
+      return
+    try:
+      if self.dirty:
+        self._save_dir_cache()
+    finally:
+      self.lock.release()
 
   # refreshes the cache, if needed
-  def refresh_cache(self):
-    updated = self._update_dir_cache()
-    if updated or self.dirty:
-      self._save_dir_cache()
+  def refresh_cache(self, force=False):
+    if self.refresher is not None: # background refresher is in charge - just trigger it 
+      self.refresher.trigger()
+      return False
+    return self._refresh_generation(force)
+
+  # rescan given directories only (e.g. reported by DirWatcher); unknown subdirectories get scanned recursively 
+  def refresh_dirs(self, paths, budget=None):
+    picture_dir = self.pic_dir
+    with self.lock:
+      if len(self.dir_cache) < 2:
+        return False
+      generation = { 'dir': dict(self.dir_cache['dir']), 'statistics': dict(self.dir_cache['statistics']) }
+      updated = False
+      todo = [ (os.path.normpath(path), False) for path in paths ] # False: inherited rules not known yet
+      while todo:
+        root, inherited = todo.pop()
+        if root != picture_dir and not root.startswith(os.path.join(picture_dir, '')): # not within picture tree
+          continue
+        if any( d in cfg['IGNORE_DIRS'] for d in root[len(picture_dir):].split(os.sep) ):
+          continue
+        try:
+          if inherited is False:
+            inherited = self._inherited_rules(root)
+          root, root_stat, ytime, subdirs, files, _, inherited = self._scan_one_dir(root, os.stat(root), None, inherited, budget)
+        except OSError: # directory doesn't exist any more -> remove it incl. all subdirectories
+          for path in [ p for p in generation['dir'] if p == root or p.startswith(os.path.join(root, '')) ]:
+            self._add_changes(path, { 'added': set(), 'removed': { name: attr[1] for name, attr in generation['dir'][path]['files'].items() }, 'modified': {} })
+            del generation['dir'][path]
+            self.deleted_dirs.add(path)
+            logging.info('Deleting dir from cache: {}'.format(path) )
+            updated = True
+          continue
+        rules_changed = root in generation['dir'] and generation['dir'][root]['meta'][2] != ytime
+        if self._store_dir(generation, root, root_stat.st_ctime, root_stat.st_mtime, ytime, lambda files=files: files, force=True):
+          updated = True
+        if rules_changed: # inherited rules might have changed -> rescan subdirectories as well
+          todo.extend( (entry.path, inherited) for entry in subdirs )
+        else:
+          todo.extend( (entry.path, inherited) for entry in subdirs if entry.path not in generation['dir'] )
+      if updated:
+        self.dir_cache = generation # atomic swap
+        self.generation += 1
+        self._save_dir_cache()
+        self.changed.set()
+      elif self.dirty: # e.g. EXIF infos of a skipped checkpoint
+        self._save_dir_cache()
     return updated
 
-  # create a filtered file list
-  def get_file_list( self, dt_from=None, dt_to=None, refresh=True ):
-    if refresh:  
-      self.refresh_cache()
+  # build a new cache generation and swap it in
+  def _refresh_generation(self, force=False, budget=None):
+    with self.lock: # only one refresh at a time
+      generation = {}
+      if len(self.dir_cache) >= 2: # shallow copy: unchanged directories are shared with the current generation
+        generation['dir'] = dict(self.dir_cache['dir'])
+        generation['statistics'] = dict(self.dir_cache['statistics'])
+      updated = self._update_dir_cache(generation, force, budget)
+      self.dir_cache = generation # atomic swap 
+      if updated:
+        self.generation += 1
+      if updated or self.dirty:
+        self._save_dir_cache()
+    return updated
+
+  # start background refresher thread; changes get signaled via cache_changed()
+  def start_refresher(self):
+    if self.refresher is None:
+      self.refresher = DirCacheRefresher(self)
+      self.refresher.start()
+
+  def stop_refresher(self):
+    if self.refresher is not None:
+      self.refresher.stop()
+      self.refresher = None
+
+  # returns True (once) if the background refresher swapped in a changed cache generation
+  def cache_changed(self):
+    if self.changed.is_set():
+      self.changed.clear()
+      return True
+    return False
+
+  # get up-to-date date index of the current cache generation
+  def _get_date_index(self):
+    if self.date_index is None or self.date_index_gen != self.generation:
+      self.index_stale_dirs.clear()
+      self.date_index_gen = self.generation
+      self.date_index = dateindex.DateIndex(self.dir_cache)
+    while self.index_stale_dirs: # EXIF dates changed meanwhile
+      path = self.index_stale_dirs.pop()
+      val = self.dir_cache['dir'].get(path)
+      if val and not self.date_index.update_dir(path, val['files']):
+        self.date_index = dateindex.DateIndex(self.dir_cache)
+        self.index_stale_dirs.clear()
+    return self.date_index
+
+  # normalize date range and get path restriction for file list creation 
+  def _file_list_filter(self, dt_from, dt_to):
     # dt_from and dt_to are either None or tuples (2016,12,25)
     if isinstance(dt_from, tuple):  
       dt_from = time.mktime(dt_from + (0, 0, 0, 0, 0, 0))
@@ -230,28 +698,51 @@ class DirCache:
       dt_to = time.mktime(dt_to + (0, 0, 0, 0, 0, 0))
     path_restrict = False  
     if cfg['SUBDIRECTORY'] and cfg['SUBDIRECTORY'] != "": 
-      path_restrict = os.path.normpath( os.path.join( cfg['PIC_DIR'], cfg['SUBDIRECTORY'] ) )
+      path_restrict = os.path.normpath( os.path.join( self.pic_dir, cfg['SUBDIRECTORY'] ) )
+    return dt_from, dt_to, path_restrict
+
+  # propability to select a file for the file list
+  def _propability(self, attr, dt_from, dt_to):
+    ftime = attr[2] if attr[2] != None else attr[1] # preferably use EXIF date, fallback is mdate 
+    distance_from = max(0, dt_from-ftime) if dt_from is not None else 0
+    distance_to = max(0, ftime-dt_to) if dt_to is not None else 0
+    distance = max(distance_from, distance_to) / (3600*24) # days
+    if cfg['PROP_SLOPE'] and cfg['PROP_SLOPE'] > 0:
+      propability = 1 - (distance * 1/cfg['PROP_SLOPE'])
+    else:
+      propability = 0     
+    if cfg['OUTDATED_FILE_PROP']:  
+      propability = max( cfg['OUTDATED_FILE_PROP'], propability ) # set minimum to config value 
+    return propability
+
+  def _file_list_entry(self, path, files, item):
+    if self.compact:
+      return FileRef(files, item) # behaves like the list below
+    attr = files[item]
+    # [file_path, orientation, file_changed_date, exif_date, exif_info]
+    return [ os.path.join(path, item), attr[0], attr[1], attr[2], attr[3] ]
+
+  # create a filtered file list
+  def get_file_list( self, dt_from=None, dt_to=None, refresh=True ):
+    if refresh:  
+      self.refresh_cache()
+    self.get_changes() # file list gets created from scratch - pending changes are included
+    dt_from, dt_to, path_restrict = self._file_list_filter(dt_from, dt_to)
  
     # create file_list
     file_list=[]
-    if self.dir_cache.get('dir'):
+    if dateindex is not None and self.dir_cache.get('dir'):
+      index = self._get_date_index()
+      for path, files, item in index.select(dt_from, dt_to, cfg['PROP_SLOPE'], cfg['OUTDATED_FILE_PROP'], path_restrict):
+        file_list.append( self._file_list_entry(path, files, item) )
+    elif self.dir_cache.get('dir'):
       for path, val in self.dir_cache['dir'].items():
         if not path_restrict or path.startswith( path_restrict ): # if either no restriction or path matches restriction 
           for item, attr in val['files'].items():
-            ftime = attr[2] if attr[2] != None else attr[1] # preferably use EXIF date, fallback is mdate 
-            distance_from = max(0, dt_from-ftime) if dt_from is not None else 0
-            distance_to = max(0, ftime-dt_to) if dt_to is not None else 0
-            distance = max(distance_from, distance_to) / (3600*24) # days
-            if cfg['PROP_SLOPE'] and cfg['PROP_SLOPE'] > 0:
-              propability = 1 - (distance * 1/cfg['PROP_SLOPE'])
-            else:
-              propability = 0     
-            if cfg['OUTDATED_FILE_PROP']:  
-              propability = max( cfg['OUTDATED_FILE_PROP'], propability ) # set minimum to config value 
-            if random.random() <= propability:
-              fpath = os.path.join(path, item)
-              # [file_path, orientation, file_changed_date, exif_date, exif_info]
-              file_list.append( [ fpath, attr[0], attr[1], attr[2], attr[3] ] ) 
+            if random.random() <= self._propability(attr, dt_from, dt_to):
+              file_list.append( self._file_list_entry(path, val['files'], item) )
+    if self.dup_index is not None: # show only one file of each duplicate group
+      file_list = self.dup_index.collapse(file_list)
 
     if cfg['SHUFFLE']:
       if cfg['RECENT_N'] == 0:
@@ -269,6 +760,91 @@ class DirCache:
     logging.info("New file list created: {} images".format(len(file_list)))
     return file_list
 
+  # weight of a file for the playlist sampler: date propability x recency x rating
+  def _playlist_weight(self, attr, dt_from, dt_to, now):
+    weight = self._propability(attr, dt_from, dt_to)
+    if weight <= 0:
+      return 0
+    recency = cfg.get('RECENCY_WEIGHT', 0)
+    if recency:
+      ftime = attr[2] if attr[2] != None else attr[1]
+      weight *= 1 + recency * 0.5 ** ( max(0, now-ftime) / (cfg.get('RECENCY_HALFLIFE', 30) * 3600*24) )
+    return weight * self._rating_factor(attr[3])
+
+  # weight factor for the EXIF Rating (0-5, -1: rejected)
+  def _rating_factor(self, exif_info):
+    rating = exif_info.get('Rating') if exif_info else None
+    if rating is None:
+      return 1
+    try:
+      rating = int(rating)
+    except (TypeError, ValueError):
+      return 1
+    if rating < 0: # rejected
+      return 0
+    rating_weights = cfg.get('RATING_WEIGHTS', [1.0, 0.5, 0.75, 1.0, 1.5, 2.0])
+    return rating_weights[ min(rating, len(rating_weights)-1) ]
+
+  # vectorized version of get_playlist_candidates for all files
+  def _playlist_candidates_indexed(self, dt_from, dt_to, path_restrict):
+    index = self._get_date_index()
+    weights = index.weights(dt_from, dt_to, cfg['PROP_SLOPE'], cfg['OUTDATED_FILE_PROP'], time.time(),
+      cfg.get('RECENCY_WEIGHT', 0), cfg.get('RECENCY_HALFLIFE', 30))
+    for path, files in index.dirs:
+      start, end = index.dir_range[path]
+      if path_restrict and not path.startswith( path_restrict ):
+        weights[start:end] = 0
+        continue
+      if isinstance(files, FileColumns): # EXIF infos are stored sparse
+        exif_rows = files.exif.items()
+      else:
+        exif_rows = ( (row, attr[3]) for row, attr in enumerate(files.values()) if attr[3] )
+      for row, exif_info in exif_rows:
+        if 'Rating' in exif_info:
+          weights[start+row] *= self._rating_factor(exif_info)
+    selected = weights.nonzero()[0]
+    return IndexedCandidates(index, selected), weights[selected]
+
+  # returns ([ (path, files, filename) ], [weight]) of all files or - if given - the added and modified files of a change set 
+  def get_playlist_candidates(self, dt_from=None, dt_to=None, changes=None):
+    dt_from, dt_to, path_restrict = self._file_list_filter(dt_from, dt_to)
+    now = time.time()
+    candidates = []
+    weights = []
+    dirs = self.dir_cache.get('dir', {})
+    if changes is None and dateindex is not None and dirs:
+      candidates, weights = self._playlist_candidates_indexed(dt_from, dt_to, path_restrict)
+      items = ()
+    elif changes is None:
+      items = ( (path, val['files'], val['files'].keys()) for path, val in dirs.items() )
+    else:
+      items = ( (path, dirs[path]['files'], change['added'] | set(change['modified'])) for path, change in changes.items() if path in dirs )
+    for path, files, names in items:
+      if path_restrict and not path.startswith( path_restrict ):
+        continue
+      for item in names:
+        attr = files.get(item)
+        if attr is None:
+          continue
+        weight = self._playlist_weight(attr, dt_from, dt_to, now)
+        if weight > 0:
+          candidates.append( (path, files, item) )
+          weights.append(weight)
+    if self.dup_index is not None and changes is None: # only one file of each duplicate group
+      pairs = self.dup_index.collapse( list(zip(candidates, list(weights))), key=lambda pair: (pair[0][0], pair[0][2]) )
+      candidates = [ c for c, _ in pairs ]
+      weights = [ w for _, w in pairs ]
+    return candidates, weights
+
+  # weighted playlist - alternative to get_file_list which draws pictures on demand instead of shuffling all of them
+  def get_playlist( self, dt_from=None, dt_to=None, refresh=True ):
+    if refresh:  
+      self.refresh_cache()
+    self.get_changes() # playlist gets created from scratch - pending changes are included
+    candidates, weights = self.get_playlist_candidates(dt_from, dt_to)
+    logging.info("New playlist created: {} images".format(len(candidates)))
+    return Playlist(candidates, weights, lambda c: self._file_list_entry(*c), cfg.get('NO_REPEAT_N', 0))
+
   # ------- maintenance functionalities -----------------
   def get_cache_create_date(self):
     date=None
@@ -316,6 +892,8 @@ class DirCache:
     return dirlist
 
   def get_filecount(self):
+    if self.store is not None and not self.dirty:
+      return self.store.get_filecount()
     count=0
     if len(self.dir_cache) > 0:
       for _, val in self.dir_cache['dir'].items():
@@ -323,6 +901,8 @@ class DirCache:
     return count
 
   def get_exifcount(self):
+    if self.store is not None and not self.dirty:
+      return self.store.get_exifcount()
     count=0
     if len(self.dir_cache) > 0:
       for _, val in self.dir_cache['dir'].items():
@@ -331,6 +911,11 @@ class DirCache:
             count += 1 
     return count
 
+  # timings of the last scan: { 'duration', 'phases': {phase: seconds}, 'dirs', 'syscalls', 'slowest': [(path, seconds, syscalls)] }
+  def get_profile(self, count=10):
+    return self.profile.as_dict(count)
+
+  # returns number of cleared files - incl. the ones marked as without EXIF info, so that they get read again
   def clear_exif(self):
     count=0
     if len(self.dir_cache) > 0:
@@ -340,8 +925,129 @@ class DirCache:
             attr[2] = None
             attr[3] = {}
             count += 1 
+          elif attr[0] == NO_EXIF:
+            attr[0] = 1 # default - unrotated
+            count += 1
+      self.dirty_dirs.update( self.dir_cache['dir'].keys() )
+      self.generation += 1
+      self.dirty = True
     return count
 
+#-----------------------------------------
+class DirCacheDB:
+  ''' SQLite storage backend for DirCache: directories and files are stored as rows, 
+  so that only changed directories / files need to be written 
+  '''
+  def __init__(self, fname):
+    self.fname = fname
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(fname, check_same_thread=False) # access is serialized by self.lock 
+    self.db.executescript('''
+      CREATE TABLE IF NOT EXISTS statistics (key TEXT PRIMARY KEY, value BLOB);
+      CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, ctime REAL, mtime REAL, ytime REAL);
+      CREATE TABLE IF NOT EXISTS files (path TEXT, name TEXT, orientation INTEGER, mtime REAL, dt REAL, exif BLOB, PRIMARY KEY (path, name));
+      CREATE INDEX IF NOT EXISTS files_dt ON files (dt);
+    ''')
+
+  def is_empty(self):
+    with self.lock:
+      return self.db.execute("SELECT count(*) FROM statistics").fetchone()[0] == 0
+
+  def load(self):
+    dir_cache = {'dir': {}, 'statistics': {}}
+    with self.lock:
+      for key, value in self.db.execute("SELECT key, value FROM statistics"):
+        dir_cache['statistics'][key] = pickle.loads(value)
+      for path, ctime, mtime, ytime in self.db.execute("SELECT path, ctime, mtime, ytime FROM dirs"):
+        dir_cache['dir'][path] = { 'meta': [ctime, mtime, ytime, True], 'files': {} }
+      compact = exifinfo.compact if dir_cache['statistics'].get('exif_compact') else dict # old EXIF infos get migrated by DirCache
+      for path, name, orientation, mtime, dt, exif in self.db.execute("SELECT path, name, orientation, mtime, dt, exif FROM files"):
+        dir_cache['dir'][path]['files'][name] = [orientation, mtime, dt, compact( pickle.loads(exif) )] # compact() shares strings and values across rows
+    return dir_cache
+
+  # write statistics, changed directories (incl. their files), deleted directories and changed files 
+  def save(self, dir_cache, dirs, deleted_dirs, files):
+    with self.lock, self.db:
+      self.db.executemany("INSERT OR REPLACE INTO statistics (key, value) VALUES (?, ?)", 
+        [ (key, pickle.dumps(value)) for key, value in dir_cache['statistics'].items() ])
+      for path in deleted_dirs:
+        self.db.execute("DELETE FROM dirs WHERE path=?", (path,))
+        self.db.execute("DELETE FROM files WHERE path=?", (path,))
+      for path in dirs:
+        val = dir_cache['dir'].get(path)
+        if val is None: # got deleted meanwhile
+          continue
+        self.db.execute("INSERT OR REPLACE INTO dirs (path, ctime, mtime, ytime) VALUES (?, ?, ?, ?)", (path, *val['meta'][0:3]))
+        self.db.execute("DELETE FROM files WHERE path=?", (path,))
+        self.db.executemany("INSERT INTO files (path, name, orientation, mtime, dt, exif) VALUES (?, ?, ?, ?, ?, ?)",
+          [ (path, name, attr[0], attr[1], attr[2], pickle.dumps(attr[3])) for name, attr in val['files'].items() ])
+      for path, name in files:
+        attr = dir_cache['dir'].get(path, {}).get('files', {}).get(name)
+        if attr is not None and path not in dirs:
+          self.db.execute("UPDATE files SET orientation=?, dt=?, exif=? WHERE path=? AND name=?", (attr[0], attr[2], pickle.dumps(attr[3]), path, name))
+
+  def get_filecount(self):
+    with self.lock:
+      return self.db.execute("SELECT count(*) FROM files").fetchone()[0]
+
+  def get_exifcount(self):
+    with self.lock:
+      return self.db.execute("SELECT count(*) FROM files WHERE dt IS NOT NULL").fetchone()[0]
+
+#-----------------------------------------
+class IndexedCandidates:
+  ''' Playlist candidates selected from a DateIndex: (path, files, filename) tuples get created on access only
+  '''
+  __slots__ = ('index', 'selected')
+
+  def __init__(self, index, selected):
+    self.index = index
+    self.selected = selected
+
+  def __len__(self):
+    return len(self.selected)
+
+  def __getitem__(self, i):
+    row = int(self.selected[i])
+    path, files = self.index.dirs[ self.index.dir_idx[row] ]
+    return (path, files, self.index.names[row])
+
+  def __iter__(self):
+    return ( self[i] for i in range(len(self)) )
+
+#-----------------------------------------
+class DirCacheRefresher(threading.Thread):
+  ''' Refreshes the directory cache in background every CHECK_DIR_TM seconds (or check_tm of the cache)
+  Scans draw from the shared background I/O budget and only start within the IO_SCHEDULE windows.
+  '''
+  def __init__(self, cache):
+    super().__init__(name="DirCacheRefresher", daemon=True)
+    self.cache = cache
+    self.wakeup = threading.Event()
+    self.stopped = False
+
+  def trigger(self):
+    self.wakeup.set()
+
+  def stop(self):
+    self.stopped = True
+    self.wakeup.set()
+
+  def run(self):
+    logging.info('Directory cache refresher started: {}'.format(self.cache.pic_dir))
+    budget = iobudget.get_budget()
+    while not self.stopped:
+      triggered = self.wakeup.wait(self.cache.check_tm)
+      self.wakeup.clear()
+      if self.stopped or (budget is not None and not budget.wait_window(abort=lambda: self.stopped)):
+        break
+      try:
+        if self.cache._refresh_generation(force=not triggered, budget=budget): # triggered refreshes respect CHECK_DIR_TM
+          self.cache.changed.set()
+      except Exception as err:
+        logging.error("Error while refreshing directory cache: {}".format(str(err)))
+    logging.info('Directory cache refresher stopped')
+
 #-----------------------------------------
 if __name__ == '__main__':
   # some test / demo code
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+''' Benchmark suite for DirCache based on a synthetic picture library
+'''
+import os
+import time
+import json
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+import logging
+import dircache
+from config import cfg
+
+SECS_PER_YEAR = 3600*24*365
+
+# create a synthetic picture tree: <dirs> directories (2 levels) with <files> empty pictures each
+def create_library(base, dirs=200, files=100, yaml_density=0.05, seed=1):
+  rnd = random.Random(seed)
+  now = time.time()
+  for d in range(dirs):
+    path = os.path.join(base, "y{:02d}".format(d % 20), "d{:04d}".format(d))
+    os.makedirs(path)
+    for f in range(files):
+      fname = os.path.join(path, "IMG_{:05d}.jpg".format(f))
+      open(fname, 'w').close()
+      mtime = now - rnd.random() * 10 * SECS_PER_YEAR
+      os.utime(fname, (mtime, mtime))
+    if rnd.random() < yaml_density:
+      with open(os.path.join(path, ".INFOTAINMENT.yaml"), 'w') as yaml_file:
+        yaml_file.write('exclude:\n  - "IMG_000*.jpg"\ninclude:\n  - "IMG_0000*.jpg"\n')
+
+# fake EXIF info for a fraction of the cached files - the synthetic pictures don't contain real EXIF data
+def add_exif(cache, exif_fraction=0.5, seed=1):
+  rnd = random.Random(seed)
+  now = time.time()
+  for path, val in list(cache.dir_cache['dir'].items()):
+    for fname in list(val['files']):
+      if rnd.random() < exif_fraction:
+        cache.set_exif_info( os.path.join(path, fname), 1, now - rnd.random() * 10 * SECS_PER_YEAR,
+          { 'Make': 'Synthetic', 'Model': 'Bench', 'DateTimeOriginal': '2020:01:01 12:00:00' } )
+
+def _timed(func):
+  tm = time.perf_counter()
+  func()
+  return time.perf_counter() - tm
+
+def _summary(runs):
+  return { 'median': statistics.median(runs), 'min': min(runs), 'max': max(runs), 'runs': runs }
+
+# runs the benchmark; returns dict of results which can be stored as JSON
+def run_benchmark(dirs=200, files=100, yaml_density=0.05, exif_fraction=0.5, repeat=5, workdir=None):
+  base = tempfile.mkdtemp(prefix="dircachebench-", dir=workdir)
+  saved_cfg = { key: cfg.get(key) for key in ('PIC_DIR', 'SUBDIRECTORY', 'CHECK_DIR_TM') }
+  timings = {}
+  try:
+    pic_dir = os.path.join(base, "pics")
+    cache_file = os.path.join(base, "dir_cache.p")
+    cfg['PIC_DIR'] = pic_dir
+    cfg['SUBDIRECTORY'] = ""
+    cfg['CHECK_DIR_TM'] = 0
+    tm = time.perf_counter()
+    create_library(pic_dir, dirs, files, yaml_density)
+    logging.info('Synthetic library created: {} dirs, {} files per dir ({:.1f} s)'.format(dirs, files, time.perf_counter()-tm))
+
+    # cold: no cache file yet - DirCache scans the whole tree and saves the cache
+    runs = []
+    for i in range(repeat):
+      for fname in (cache_file, os.path.splitext(cache_file)[0] + ".db"):
+        if os.path.exists(fname):
+          os.remove(fname)
+      runs.append( _timed(lambda: dircache.DirCache(cache_file)) )
+    timings['refresh_cold'] = _summary(runs)
+    cache = dircache.DirCache(cache_file)
+    add_exif(cache, exif_fraction)
+    cache.save_cache()
+
+    runs = { 'refresh_warm': [], 'refresh_one_dir_changed': [], 'file_list': [], 'file_list_date_range': [], 'save': [], 'read': [] }
+    dirlist = sorted(cache.dir_cache['dir'])
+    now = time.localtime()
+    dt_from = (now.tm_year-3, 1, 1)
+    dt_to = (now.tm_year-2, 12, 31)
+    for i in range(repeat):
+      runs['refresh_warm'].append( _timed(lambda: cache.refresh_cache(force=True)) )
+      open(os.path.join(dirlist[i % len(dirlist)], "NEW_{:05d}.jpg".format(i)), 'w').close()
+      runs['refresh_one_dir_changed'].append( _timed(lambda: cache.refresh_cache(force=True)) )
+      runs['file_list'].append( _timed(lambda: cache.get_file_list(refresh=False)) )
+      runs['file_list_date_range'].append( _timed(lambda: cache.get_file_list(dt_from, dt_to, refresh=False)) )
+      cache.dirty_dirs.update(cache.dir_cache['dir']) # full save
+      runs['save'].append( _timed(cache._save_dir_cache) )
+      runs['read'].append( _timed(cache._read_dir_cache) )
+    for name, values in runs.items():
+      timings[name] = _summary(values)
+
+    return {
+      'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'shape': { 'dirs': dirs, 'files_per_dir': files, 'yaml_density': yaml_density, 'exif_fraction': exif_fraction, 'repeat': repeat },
+      'config': { key: cfg.get(key) for key in ('SCAN_MODE', 'SCAN_THREADS', 'CACHE_LAYOUT', 'DIR_CACHE_BACKEND') },
+      'files': cache.get_filecount(),
+      'exif_files': cache.get_exifcount(),
+      'date_index': dircache.dateindex is not None,
+      'timings': timings,
+    }
+  finally:
+    cfg.update(saved_cfg)
+    shutil.rmtree(base, ignore_errors=True)
+
+def print_results(result):
+  print( "#Files:           {:d} ({:d} with EXIF)".format( result['files'], result['exif_files'] ))
+  print( "{:26s} {:>10s} {:>10s}".format( "Benchmark", "median", "min" ))
+  for name, timing in result['timings'].items():
+    print( "{:26s} {:8.1f}ms {:8.1f}ms".format( name, timing['median']*1000, timing['min']*1000 ))
+
+def write_results(result, fname):
+  with open(fname, 'w') as outfile:
+    json.dump(result, outfile, indent=2)
+
+#-----------------------------
+def parse_options():
+  parser = argparse.ArgumentParser(description='PI Infotainment dircache benchmark')
+  parser.add_argument('--dirs', type=int, default=200, help='number of directories')
+  parser.add_argument('--files', type=int, default=100, help='files per directory')
+  parser.add_argument('--yaml', type=float, default=0.05, help='fraction of directories with .INFOTAINMENT.yaml')
+  parser.add_argument('--exif', type=float, default=0.5, help='fraction of files with EXIF info')
+  parser.add_argument('--repeat', type=int, default=5, help='number of runs per benchmark')
+  parser.add_argument('--workdir', default=None, help='directory for the synthetic library (default: system temp dir)')
+  parser.add_argument('--output', '-o', default='dircache-bench.json', help='JSON result file')
+  return parser.parse_args()
+
+def main():
+  args = parse_options()
+  logging.disable(logging.INFO)
+  result = run_benchmark(args.dirs, args.files, args.yaml, args.exif, args.repeat, args.workdir)
+  print_results(result)
+  write_results(result, args.output)
+  print( "Results written to {:s}".format(args.output) )
+
+#-------------------------------
+if __name__ == '__main__':
+  main()
@@ -5,9 +5,21 @@ import argparse
 import datetime
 import logging
 import os
+import time
+import signal
+import multiprocessing
 import dircache
+import exifharvester
+import exifinfo
 import GPSlookup
 import displaymsg
+import filecolumns
+import dircachebench
+import dircacheshards
+import dupindex
+import imagecache
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 from config import cfg
 
 #-----------------------------
@@ -30,7 +42,7 @@ def do_list(cache, args):
     print( "{:s}: {:d} files".format(dir_item[0], dir_item[1]) )
 
 def do_list_long(cache, args):
-  path_trunc = len(cfg['PIC_DIR']) + 1
+  path_trunc = len(cache.pic_dir) + 1
   do_summary(cache, args)
   dirlist = cache.get_dirlist_full()
   for dir_item in dirlist:
@@ -58,12 +70,66 @@ def do_refresh(cache, args):
   print("Refreshing cache...")
   cache.refresh_cache()
   do_summary(cache, args)
+  if cache.scan_stats:
+    print( "#Scanned dirs:    {:d} ({:d} stat calls saved)".format( cache.scan_stats['dirs'], cache.scan_stats['stat_saved']) )
+
+def do_profile(cache, args):
+  count = int(args.param) if args.param else 10
+  print("Refreshing cache (full scan)...")
+  cache.refresh_cache(force=True)
+  profile = cache.get_profile(count)
+  print( "Scan duration:    {:.3f} s".format( profile['duration'] ))
+  print( "#Scanned dirs:    {:d}".format( profile['dirs'] ))
+  print( "#Syscalls:        {:d}".format( profile['syscalls'] ))
+  print( "Phases:" )
+  for phase, seconds in profile['phases'].items():
+    print( "  {:12s} {:9.3f} s".format( phase, seconds ))
+  print( "Slowest directories:" )
+  for path, seconds, syscalls in profile['slowest']:
+    print( "  {:9.3f} s {:6d} syscalls  {:s}".format( seconds, syscalls, path ))
+
+def do_bench(cache, args):
+  fname = args.param or "dircache-bench.json"
+  print("Running benchmark on synthetic picture library...")
+  result = dircachebench.run_benchmark()
+  dircachebench.print_results(result)
+  dircachebench.write_results(result, fname)
+  print( "Results written to {:s}".format(fname) )
+
+# worker processes of the commands: spawned like the pools of the slideshow; they ignore SIGINT,
+# so Ctrl-C only interrupts this process (no BrokenProcessPool) and the results so far get saved
+def _worker_init():
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def process_pool(workers):
+  return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_worker_init, mp_context=multiprocessing.get_context('spawn'))
+
+def do_duplicates(cache, args):
+  if cache.dup_index is None:
+    cache.dup_index = dupindex.DupIndex( os.path.splitext(cache.fname)[0] + ".dup" )
+  hasher = dupindex.DupHasher(cache, workers=os.cpu_count())
+  print("Hashing new or changed files...")
+  try:
+    with process_pool(hasher.workers) as pool:
+      count = hasher.hash_pending(pool, progress=lambda count: print( "  {:d} files".format(count), end="\r" ))
+  except (KeyboardInterrupt, BrokenProcessPool): # keep the hashes calculated so far
+    hasher.stopped = True
+    hasher.index.save()
+    print( "\nInterrupted - run duplicates again to continue" )
+    return
+  print( "Hashed files:     {:d}".format( count ))
+  groups = cache.dup_index.list_groups()
+  for files in groups:
+    print( "-"*60 )
+    for file_path_name, size in files:
+      print( "  {:10d} {:s}".format( size, file_path_name ))
+  print( "#Duplicate groups: {:d} ({:d} redundant files)".format( len(groups), sum( len(files)-1 for files in groups ) ))
 
 def do_clear_exif(cache, args):
   yn = input("Do you really want to clear all cached EXIF info from cache? (y/N)")
   if yn == "y" or yn == "Y": 
     print("Clearing EXIF info...")
-    cache.clear_exif()
+    print("Cleared EXIF info of {:d} files".format( cache.clear_exif() ))
     cache._save_dir_cache()
     do_summary(cache, args)
   else:
@@ -83,22 +149,110 @@ def do_get_exif(cache, args):
       print( "  {:25s}: {:s}".format( key, str(val) ) )
 
 def do_refresh_exif(cache, args):
-  do_refresh(cache, args)
-  print("Refreshing cached EXIF info...")
-  filecount = cache.get_filecount()
-  curfile = 0
-  dirname = None
-  dirlist = cache.get_dirlist_full()
-  for dir_item in dirlist:
-    if dir_item[0] == "d": # file
-      dirname = dir_item[1]
-      print( "{:3.0f}% - scanning files in directory: {:s}".format( curfile/filecount*100, dirname) )  
-    else:
-      fname = os.path.join(dirname, dir_item[1])
-      cache.read_exif_info(fname)
-      curfile += 1
+  do_refresh(cache, args) # changed files lose their cached EXIF info here
+  if args.param == "all": # incl. files marked as without EXIF info
+    print("Clearing EXIF info...")
+    print("Cleared EXIF info of {:d} files".format( cache.clear_exif() ))
+    cache._save_dir_cache()
+  todo = sum( 1 for _ in cache.iter_exif_todo() )
+  print( "Reading EXIF info of {:d} files ({:d} already cached)...".format( todo, cache.get_filecount() - todo ))
+  harvester = exifharvester.ExifHarvester(cache, workers=os.cpu_count(), checkpoint=cfg.get('EXIF_REFRESH_CHECKPOINT', 60))
+  start_tm = time.time()
+  def progress(count):
+    rate = count / max(time.time() - start_tm, 1e-3)
+    eta = (todo - count) / rate if rate > 0 else 0
+    print( "  {:d}/{:d} files - {:.1f} files/s - ETA {:s}   ".format( count, todo, rate, str(datetime.timedelta(seconds=int(eta))) ), end="\r" )
+  try:
+    with process_pool(harvester.workers) as pool:
+      count = harvester.harvest(pool, progress)
+  except (KeyboardInterrupt, BrokenProcessPool): # keep the EXIF infos read so far
+    harvester.stopped = True
+    cache.save_cache()
+    print( "\nInterrupted - {:d} files processed; run refresh_exif again to continue".format( harvester.stats['files'] ))
+    return
+  duration = time.time() - start_tm
+  print( "\nProcessed files:  {:d} in {:.0f} s ({:.1f} files/s; {:d} with EXIF, {:d} without, {:d} not readable)".format( 
+    count, duration, count / max(duration, 1e-3), harvester.stats['exif'], harvester.stats['no_exif'], harvester.stats['errors'] ))
   do_summary(cache, args)
 
+# date range of the slideshow (DATE_FROM, DATE_TO, RECENT_DAYS)
+def get_date_range():
+  date_from = tuple(cfg['DATE_FROM']) if cfg['DATE_FROM'] and len(cfg['DATE_FROM']) == 3 else None
+  date_to = tuple(cfg['DATE_TO']) if cfg['DATE_TO'] and len(cfg['DATE_TO']) == 3 else None
+  if cfg['RECENT_DAYS'] and cfg['RECENT_DAYS'] > 0 and date_from is None:
+    dfrom = datetime.datetime.now() - datetime.timedelta(cfg['RECENT_DAYS'])
+    date_from = (dfrom.year, dfrom.month, dfrom.day)
+  return date_from, date_to
+
+def do_prewarm(cache, args):
+  image_cache = imagecache.get_image_cache()
+  if image_cache is None:
+    print( "No image cache configured (IMAGE_CACHE_DIR)" )
+    return
+  size = tuple( int(x) for x in args.param.split('x') ) if args.param else image_cache.get_display_size()
+  if not size or len(size) != 2:
+    print( "Display size unknown - start the slideshow once or pass it as <width>x<height>" )
+    return
+  date_from, date_to = get_date_range()
+  file_list = cache.get_file_list(date_from, date_to, refresh=False)
+  file_list.sort(key=lambda entry: entry[3] if entry[3] is not None else entry[2], reverse=True) # newest first
+  limit = image_cache.max_bytes * 0.95 # don't evict what was just prepared
+  print( "Preparing pictures for {:d}x{:d} ({:d} candidates, cache: {:.1f} of {:.1f} MB)...".format( size[0], size[1], len(file_list), 
+    image_cache.total/2**20, image_cache.max_bytes/2**20 ))
+  workers = os.cpu_count()
+  todo = iter(file_list)
+  pending = set()
+  count = 0
+  skipped = 0
+  written = 0
+  avg_size = 0
+  start_tm = time.time()
+  try:
+    with process_pool(workers) as pool:
+      while True:
+        while len(pending) < 4 * workers and image_cache.total + len(pending) * avg_size < limit: # reserve room for pictures in flight
+          entry = next(todo, None)
+          if entry is None:
+            break
+          orientation = entry[1] if entry[3] is not None else None # None: EXIF not read yet - the worker reads it
+          if orientation is not None and imagecache.cache_key(entry[0], entry[2], size, orientation) in image_cache:
+            skipped += 1
+            continue
+          pending.add( pool.submit(imagecache.prewarm_one, image_cache.dir, entry[0], entry[2], orientation, size, image_cache.quality) )
+        if not pending:
+          break
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          result = future.result()
+          if result is not None:
+            image_cache.add(*result)
+            written += result[2]
+        count += len(done)
+        avg_size = written / count
+        print( "  {:d} pictures - {:.1f} pictures/s - {:.1f} MB   ".format( count, count / max(time.time() - start_tm, 1e-3), image_cache.total/2**20 ), end="\r" )
+  except (KeyboardInterrupt, BrokenProcessPool):
+    print( "\nInterrupted" )
+  print( "\nPrepared pictures: {:d} ({:d} already cached); cache: {:d} pictures, {:.1f} MB".format( count, skipped, 
+    len(image_cache.entries), image_cache.total/2**20 ))
+
+def do_memory(cache, args):
+  print("Measuring memory usage of cache layouts...")
+  report = filecolumns.memory_report(cache.dir_cache)
+  print( "#Files:                 {:d}".format( report['files'] ))
+  print( "Layout                  {:>12s} {:>12s}".format( "list", "compact" ))
+  print( "Directory cache:        {:9.1f} MB {:9.1f} MB".format( report['list_cache']/2**20, report['compact_cache']/2**20 ))
+  print( "Full file list:         {:9.1f} MB {:9.1f} MB".format( report['list_filelist']/2**20, report['compact_filelist']/2**20 ))
+  if report['files'] > 0:
+    print( "Per file:               {:9.0f} B  {:9.0f} B".format( (report['list_cache']+report['list_filelist'])/report['files'], 
+      (report['compact_cache']+report['compact_filelist'])/report['files'] ))
+  exif_infos = [ attr[3] for val in cache.dir_cache.get('dir', {}).values() for attr in val['files'].values() if attr[3] ]
+  if exif_infos:
+    current = exifinfo.size_report(exif_infos)
+    compacted = exifinfo.size_report([ exifinfo.compact(exif_info) for exif_info in exif_infos ])
+    print( "EXIF infos              {:>12s} {:>12s}".format( "current", "compacted" ))
+    print( "  pickled ({:d} files): {:9.1f} KB {:9.1f} KB".format( current['files'], current['pickled']/1024, compacted['pickled']/1024 ))
+    print( "  resident:             {:9.1f} KB {:9.1f} KB".format( current['resident']/1024, compacted['resident']/1024 ))
+
 #-----------------------------
 def parse_options():
   epilog = """commands:
@@ -106,19 +260,36 @@ def parse_options():
   list:                 List all directories plus the no. of files. 
   list_long:            List all directories and all files. 
   refresh:              Refreshe the directory cache.
-  refresh_exif:         Refresh EXIF infos. 
+  refresh_exif [all]:   Read missing EXIF infos of new or changed files with all CPU cores - can be interrupted and continued; "all" re-reads all files.
   get_exif <filepath>:  Show cached EXIF info for given <filepath>.
   clear_exif:           Clear all cached EXIF infos(!) from cache. 
+  memory:               Compare memory usage of the "list" and "compact" cache layouts.
+  profile [<count>]:    Full rescan showing phase timings and the <count> slowest directories.
+  duplicates:           Hash new or changed files and list groups of duplicate images.
+  prewarm [<w>x<h>]:    Fill the image cache with display sized pictures of the current date range (newest first) with all CPU cores.
+  bench [<outfile>]:    Benchmark the cache with a synthetic picture library; results get written as JSON to <outfile>.
   """
   parser = argparse.ArgumentParser(description='PI Infotainment dircache manager utility', epilog=epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
-  parser.add_argument('--file', '-f', default=cfg['DIR_CACHE_FILE'], help='cache file')
-  parser.add_argument('command', choices=["summary", "list", "list_long", "refresh", "clear_exif", "get_exif", "refresh_exif"], nargs='?', default="summary" )
+  parser.add_argument('--file', '-f', default=None, help='cache file')
+  parser.add_argument('--root', '-r', default=None, help='picture root (see PIC_ROOTS) - default: first root')
+  parser.add_argument('command', choices=["summary", "list", "list_long", "refresh", "clear_exif", "get_exif", "refresh_exif", "memory", "profile", "bench", "duplicates", "prewarm"], nargs='?', default="summary" )
   parser.add_argument('param', nargs='?', help="parameter" )
   return parser.parse_args()
 
 def main():
   args = parse_options()
-  cache = dircache.DirCache(args.file)
+  if args.command == "bench": # doesn't use the real cache
+    do_bench(None, args)
+    return
+  roots = dircacheshards.get_roots()
+  root = roots[0]
+  if args.root:
+    root = dircacheshards.get_root( os.path.normpath(args.root) )
+    if root is None:
+      print( "Unknown picture root: {:s} - configured roots: {:s}".format( args.root, ", ".join( r['path'] for r in roots ) ))
+      return
+  args.file = args.file or root['cache']
+  cache = dircache.DirCache(args.file, root['path'], root['check_tm'])
   if args.command == "summary": 
     do_summary(cache, args)
   elif args.command == "refresh": 
@@ -133,6 +304,14 @@ def main():
     do_list_long(cache, args)
   elif args.command == "refresh_exif": 
     do_refresh_exif(cache, args)
+  elif args.command == "memory": 
+    do_memory(cache, args)
+  elif args.command == "profile": 
+    do_profile(cache, args)
+  elif args.command == "duplicates": 
+    do_duplicates(cache, args)
+  elif args.command == "prewarm": 
+    do_prewarm(cache, args)
 
 #-------------------------------
 if __name__ == '__main__':
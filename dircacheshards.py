@@ -0,0 +1,252 @@
+#!/usr/bin/python
+''' Several picture roots (PIC_ROOTS), each with its own directory cache shard
+'''
+import os
+import re
+import time
+import random
+import threading
+import itertools
+import logging
+import dircache
+import exifinfo
+from playlist import Playlist
+from config import cfg
+
+# configured picture roots: [ {'path', 'weight', 'cache', 'check_tm'} ] - falls back to PIC_DIR / DIR_CACHE_FILE
+def get_roots():
+  roots = []
+  for root in cfg.get('PIC_ROOTS') or []:
+    if isinstance(root, str):
+      root = { 'path': root }
+    path = os.path.normpath( root['path'] )
+    cache_file = root.get('cache')
+    if not cache_file: # e.g. /mnt/photo -> .dir_cache_mnt_photo.p
+      base, ext = os.path.splitext( cfg['DIR_CACHE_FILE'] )
+      cache_file = "{}_{}{}".format( base, re.sub(r'\W+', '_', path).strip('_'), ext )
+    roots.append( { 'path': path, 'weight': root.get('weight', 1), 'cache': cache_file, 'check_tm': root.get('check_tm', cfg['CHECK_DIR_TM']) } )
+  if not roots:
+    roots.append( { 'path': os.path.normpath( cfg['PIC_DIR'] ), 'weight': 1, 'cache': cfg['DIR_CACHE_FILE'], 'check_tm': cfg['CHECK_DIR_TM'] } )
+  return roots
+
+# returns the root of the given picture path (longest matching root)
+def get_root(file_path_name):
+  best = None
+  for root in get_roots():
+    if file_path_name == root['path'] or file_path_name.startswith( os.path.join(root['path'], '') ):
+      if best is None or len(root['path']) > len(best['path']):
+        best = root
+  return best
+
+# path relative to its picture root (e.g. for display)
+def relative_path(file_path_name):
+  root = get_root(file_path_name)
+  if root is None:
+    return file_path_name
+  return file_path_name[len(root['path'])+1:]
+
+# creates a plain DirCache for a single root, and a ShardedDirCache for several roots
+def create_cache():
+  roots = get_roots()
+  if len(roots) == 1:
+    return dircache.DirCache( roots[0]['cache'], roots[0]['path'], roots[0]['check_tm'] )
+  return ShardedDirCache(roots)
+
+# merge file lists so that each list gets a share of the slides according to its weight (smooth weighted round robin)
+# lists which are exhausted before the longest one (relative to its weight) start over again
+def interleave(lists, weights):
+  parts = [ (file_list, weight) for file_list, weight in zip(lists, weights) if file_list and weight > 0 ]
+  if not parts:
+    return []
+  total = sum( weight for _, weight in parts )
+  length = int( max( len(file_list) * total / weight for file_list, weight in parts ) )
+  credit = [0.0] * len(parts)
+  pos = [0] * len(parts)
+  merged = []
+  for _ in range(length):
+    for i, (_, weight) in enumerate(parts):
+      credit[i] += weight
+    i = max( range(len(parts)), key=lambda j: credit[j] )
+    credit[i] -= total
+    file_list = parts[i][0]
+    if pos[i] == len(file_list): # start over again
+      pos[i] = 0
+      if cfg['SHUFFLE']:
+        file_list = list(file_list)
+        random.shuffle(file_list)
+        parts[i] = (file_list, parts[i][1])
+    merged.append( file_list[pos[i]] )
+    pos[i] += 1
+  return merged
+
+class ShardedDirCache:
+  ''' Offers the DirCache interface used by the slideshow across several picture roots.
+  Each root has its own cache shard (file), which gets loaded, refreshed (every check_tm seconds) and saved independently.
+  Shards which can't be loaded within PIC_ROOT_TIMEOUT seconds (e.g. unreachable NAS) are skipped and added as soon as they are ready.
+  '''
+  def __init__(self, roots):
+    self.roots = roots
+    self.shards = [None] * len(roots)
+    self.changed = threading.Event()
+    self.refreshing = False
+    self.ready = False
+    self.playlist_scale = {} # pic_dir -> weight scale factor of last playlist
+    self.lock = threading.Lock()
+    self.shard_callbacks = [] # see for_each_shard()
+    loaders = [ threading.Thread(target=self._load_shard, args=(i,), name="DirCacheLoader-{}".format(i), daemon=True) for i in range(len(roots)) ]
+    for loader in loaders:
+      loader.start()
+    deadline = time.time() + cfg.get('PIC_ROOT_TIMEOUT', 10)
+    for loader in loaders:
+      loader.join( max(0, deadline - time.time()) )
+    self.ready = True
+    for root, shard in zip(self.roots, self.shards):
+      if shard is None:
+        logging.warning("Picture root {} not ready yet - continuing without it".format(root['path']))
+
+  def _load_shard(self, i):
+    root = self.roots[i]
+    try:
+      shard = dircache.DirCache( root['cache'], root['path'], root['check_tm'] )
+    except Exception as err:
+      logging.error("Couldn't load directory cache for {}: {}".format(root['path'], str(err)))
+      return
+    with self.lock:
+      self.shards[i] = shard
+      callbacks = list(self.shard_callbacks)
+    if self.refreshing:
+      shard.start_refresher()
+    for callback in callbacks: # e.g. directory watcher, duplicate hasher
+      callback(shard)
+    if self.ready: # loaded late -> report all its files as added, so they get spliced into the file list
+      logging.info("Picture root {} is ready now".format(root['path']))
+      for path, val in list(shard.dir_cache.get('dir', {}).items()):
+        shard._add_changes(path, { 'added': set(val['files']), 'removed': {}, 'modified': {} })
+      self.changed.set()
+
+  # loaded shards with their weight
+  def loaded(self):
+    return [ (shard, root['weight']) for shard, root in zip(self.shards, self.roots) if shard is not None ]
+
+  # callback(shard) for all loaded shards - now and for shards which get loaded later
+  def for_each_shard(self, callback):
+    with self.lock:
+      self.shard_callbacks.append(callback)
+      shards = [ shard for shard, _ in self.loaded() ]
+    for shard in shards:
+      callback(shard)
+
+  # shard of a file or directory
+  def _shard(self, file_path_name):
+    file_path_name = os.path.normpath( file_path_name )
+    for shard, _ in sorted( self.loaded(), key=lambda item: len(item[0].pic_dir), reverse=True ):
+      if file_path_name == shard.pic_dir or file_path_name.startswith( os.path.join(shard.pic_dir, '') ):
+        return shard
+    return None
+
+  # file list entry of a playlist candidate (path, files, filename) - by the shard it belongs to
+  def _file_list_entry(self, path, files, item):
+    return self._shard(path)._file_list_entry(path, files, item)
+
+  def get_file_list( self, dt_from=None, dt_to=None, refresh=True ):
+    if refresh:
+      self.refresh_cache()
+    shards = self.loaded()
+    file_list = interleave( [ shard.get_file_list(dt_from, dt_to, refresh=False) for shard, _ in shards ], [ weight for _, weight in shards ] )
+    logging.info("File list merged from {} picture roots: {} images".format(len(shards), len(file_list)))
+    return file_list
+
+  # candidates of all shards - weights scaled so that each root gets the share of its weight
+  def get_playlist_candidates(self, dt_from=None, dt_to=None, changes=None):
+    candidates = []
+    weights = []
+    for shard, root_weight in self.loaded():
+      shard_candidates, shard_weights = shard.get_playlist_candidates(dt_from, dt_to, changes)
+      if changes is None:
+        total = sum(shard_weights)
+        self.playlist_scale[shard.pic_dir] = root_weight / total if total > 0 else 0
+      scale = self.playlist_scale.get(shard.pic_dir, 0)
+      candidates.extend(shard_candidates)
+      weights.extend( w * scale for w in shard_weights )
+    return candidates, weights
+
+  def get_playlist( self, dt_from=None, dt_to=None, refresh=True ):
+    if refresh:
+      self.refresh_cache()
+    self.get_changes()
+    shards = self.loaded()
+    candidates, weights = self.get_playlist_candidates(dt_from, dt_to)
+    logging.info("New playlist created from {} picture roots: {} images".format(len(shards), len(candidates)))
+    return Playlist(candidates, weights, lambda c: self._file_list_entry(*c), cfg.get('NO_REPEAT_N', 0))
+
+  def refresh_cache(self, force=False):
+    return any( [ shard.refresh_cache(force) for shard, _ in self.loaded() ] )
+
+  def start_refresher(self):
+    self.refreshing = True
+    for shard, _ in self.loaded():
+      shard.start_refresher()
+
+  def stop_refresher(self):
+    self.refreshing = False
+    for shard, _ in self.loaded():
+      shard.stop_refresher()
+
+  def cache_changed(self):
+    changed = self.changed.is_set()
+    self.changed.clear()
+    return any( [ shard.cache_changed() for shard, _ in self.loaded() ] ) or changed
+
+  def get_changes(self):
+    changes = {}
+    for shard, _ in self.loaded():
+      changes.update( shard.get_changes() )
+    return changes
+
+  def get_changed_file_list(self, changes, dt_from=None, dt_to=None):
+    return list( itertools.chain.from_iterable( shard.get_changed_file_list(changes, dt_from, dt_to) for shard, _ in self.loaded() ) )
+
+  def get_cache_check_date(self):
+    dates = [ shard.get_cache_check_date() for shard, _ in self.loaded() ]
+    dates = [ dt for dt in dates if dt is not None ]
+    return min(dates) if dates else None
+
+  def read_exif_info(self, file_path_name, im=None):
+    shard = self._shard(file_path_name)
+    if shard is not None:
+      return shard.read_exif_info(file_path_name, im)
+    try:
+      (orientation, dt, exif_info) = dircache.extract_exif(file_path_name, im) # root not loaded yet - don't cache
+    except OSError as err:
+      logging.debug("Couldn't read EXIF of {}: {}".format(file_path_name, str(err)))
+      (orientation, dt, exif_info) = (None, None, {})
+    exif_info = exifinfo.compact(exif_info)
+    if orientation == None:
+      orientation = 1
+      if dt == None:
+        dt = os.path.getmtime(file_path_name)
+    return (orientation, dt, exif_info)
+
+  def set_exif_info( self, file_path_name, orientation, dt, exif_info ):
+    shard = self._shard(file_path_name)
+    if shard is not None:
+      shard.set_exif_info( file_path_name, orientation, dt, exif_info )
+
+  def set_no_exif(self, file_path_name):
+    shard = self._shard(file_path_name)
+    if shard is not None:
+      shard.set_no_exif(file_path_name)
+
+  def get_exif_info(self, file_path_name):
+    shard = self._shard(file_path_name)
+    return shard.get_exif_info(file_path_name) if shard is not None else {}
+
+  # files without EXIF info of all currently accessible roots
+  def iter_exif_todo(self):
+    for shard, _ in self.loaded():
+      if os.path.isdir(shard.pic_dir):
+        yield from shard.iter_exif_todo()
+
+  def save_cache(self):
+    for shard, _ in self.loaded():
+      shard.save_cache()
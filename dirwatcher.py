@@ -0,0 +1,127 @@
+#!/usr/bin/python
+''' Change detection for the picture directory via Linux inotify events
+'''
+import os
+import time
+import select
+import struct
+import threading
+import logging
+import ctypes
+import ctypes.util
+import iobudget
+from config import cfg
+
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_ISDIR        = 0x40000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+class DirWatcher(threading.Thread):
+  ''' Watches all directories of the picture tree (except IGNORE_DIRS) and lets DirCache rescan only the changed ones.
+  Events are collected for WATCH_DELAY seconds, so that e.g. a bulk upload results in a single rescan.
+  Polling every CHECK_DIR_TM seconds stays active as fallback e.g. for CIFS mounts which don't deliver events.
+  '''
+  def __init__(self, cache):
+    super().__init__(name="DirWatcher", daemon=True)
+    self.cache = cache
+    self.picture_dir = cache.pic_dir
+    self.delay = cfg.get('WATCH_DELAY', 2.0)
+    self.stopped = False
+    self.watches = {} # wd -> path
+    self.watched = {} # path -> wd
+    self.dirty = set()
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    self._add_watch = libc.inotify_add_watch
+    self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "Couldn't initialize inotify")
+
+  def stop(self):
+    self.stopped = True
+
+  def _watch(self, path):
+    if path in self.watched:
+      return
+    wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+    if wd < 0:
+      logging.warning("Couldn't watch directory {}: {}".format(path, os.strerror(ctypes.get_errno())))
+      return
+    self.watches[wd] = path
+    self.watched[path] = wd
+
+  def _watch_tree(self, root):
+    for path, subdirs, _ in os.walk(root, topdown=True):
+      subdirs[:] = [d for d in subdirs if d not in cfg['IGNORE_DIRS']] # prune irrelevant subdirs
+      self._watch(path)
+
+  def _handle_event(self, wd, mask, name):
+    if mask & IN_Q_OVERFLOW: # events got lost -> full rescan
+      logging.warning('Directory watcher: event queue overflow - triggering full rescan')
+      if self.cache._refresh_generation(force=True):
+        self.cache.changed.set()
+      return
+    path = self.watches.get(wd)
+    if path is None:
+      return
+    if mask & IN_IGNORED: # watch got removed (e.g. directory deleted)
+      del self.watches[wd]
+      self.watched.pop(path, None)
+      return
+    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+      self.dirty.add(path)
+      return
+    if name == "" or (mask & IN_ISDIR and name in cfg['IGNORE_DIRS']):
+      return
+    self.dirty.add(path)
+    if mask & IN_ISDIR:
+      child = os.path.join(path, name)
+      self.dirty.add(child)
+      if mask & (IN_CREATE | IN_MOVED_TO):
+        self._watch_tree(child)
+
+  def _read_events(self):
+    try:
+      data = os.read(self.fd, 64*1024)
+    except BlockingIOError:
+      return
+    pos = 0
+    while pos + EVENT_HEADER.size <= len(data):
+      wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+      pos += EVENT_HEADER.size
+      name = os.fsdecode(data[pos:pos+length].rstrip(b'\0'))
+      pos += length
+      self._handle_event(wd, mask, name)
+
+  def run(self):
+    logging.info('Directory watcher started: {}'.format(self.picture_dir))
+    self._watch_tree(self.picture_dir)
+    logging.info('Directory watcher: watching {} directories'.format(len(self.watched)))
+    flush_tm = None
+    while not self.stopped:
+      ready, _, _ = select.select([self.fd], [], [], 1.0)
+      if ready:
+        self._read_events()
+        if self.dirty and flush_tm is None:
+          flush_tm = time.time() + self.delay
+      if flush_tm is not None and time.time() >= flush_tm:
+        dirty, self.dirty = self.dirty, set()
+        flush_tm = None
+        logging.info('Directory watcher: rescanning {} changed directories'.format(len(dirty)))
+        try:
+          self.cache.refresh_dirs(dirty, iobudget.get_budget())
+        except Exception as err:
+          logging.error("Error while refreshing changed directories: {}".format(str(err)))
+    os.close(self.fd)
+    logging.info('Directory watcher stopped')
@@ -6,20 +6,23 @@ import time
 import datetime
 import os
 import GPSlookup
+import dircacheshards
 from config import cfg
 
 def item2str(item, prefix='', postfix=''):
   if item == None:
     return ''
-  if isinstance(item, tuple):
-    val = int(item[0]) / int(item[1])
-    if val > 1:
+  if isinstance(item, (tuple, float)): # rational: (numerator, denominator) or float
+    val = int(item[0]) / int(item[1]) if isinstance(item, tuple) else item
+    if val != val: # NaN - e.g. denominator 0
+      return ''
+    if val > 1 or val <= 0:
       if val == int(val):
         val = str(int(val)) # display as integer 
       else:
         val = str(val)  # display as decimal number
     else:
-      val = '1/' + str(int(item[1] / item[0])) # display as fracture    
+      val = '1/' + str(round(1 / val)) # display as fracture    
   else:
     val = str(item)
   val = prefix + val + postfix    
@@ -36,7 +39,7 @@ def format_text(iFiles, pic_num):
     fname = os.path.normpath(iFiles[pic_num][0])
     filename = os.path.basename(fname)
     pathname = os.path.dirname(fname)
-    pathname = pathname[len(cfg['PIC_DIR'])+1:]
+    pathname = dircacheshards.relative_path(pathname)
     dt_str = '-'
     if iFiles[pic_num][3]:
       dt_str = datetime.datetime.fromtimestamp(iFiles[pic_num][3]).strftime("%d.%m.%Y")
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+''' Duplicate image index: content fingerprint + perceptual hash of all cached files
+'''
+import os
+import time
+import pickle
+import hashlib
+import threading
+import logging
+import multiprocessing
+import concurrent.futures
+from PIL import Image, ImageOps
+from config import cfg
+import exifharvester
+import iobudget
+
+CHUNK_SIZE = 64*1024
+
+# cheap content fingerprint: file size + hash of the first and last 64KB
+def fingerprint(file_path_name):
+  size = os.path.getsize(file_path_name)
+  digest = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=8)
+  with open(file_path_name, 'rb') as myfile:
+    digest.update( myfile.read(CHUNK_SIZE) )
+    if size > 2*CHUNK_SIZE:
+      myfile.seek(-CHUNK_SIZE, os.SEEK_END)
+      digest.update( myfile.read(CHUNK_SIZE) )
+  return size, int.from_bytes(digest.digest(), 'little')
+
+# 64 bit difference hash (dHash) of the upright image - survives resizing and re-compression
+def perceptual_hash(file_path_name):
+  with Image.open(file_path_name) as im:
+    im.draft('L', (64, 64)) # JPEG: decode with reduced resolution only
+    im = ImageOps.exif_transpose(im).convert('L').resize((9, 8), Image.BILINEAR)
+    px = list(im.getdata())
+  phash = 0
+  for row in range(8):
+    for col in range(8):
+      phash = (phash << 1) | (px[row*9+col] > px[row*9+col+1])
+  if phash in (0, 2**64-1): # uniform image - not meaningful
+    return None
+  return phash
+
+# runs within worker process; returns (file_path_name, mtime, size, fingerprint, phash)
+def hash_file(file_path_name):
+  try:
+    mtime = os.path.getmtime(file_path_name)
+    size, fprint = fingerprint(file_path_name)
+  except OSError as err:
+    logging.debug("Couldn't read {}: {}".format(file_path_name, str(err)))
+    return file_path_name, None, 0, None, None
+  try:
+    phash = perceptual_hash(file_path_name)
+  except Exception as err: # e.g. HEIF or broken image
+    logging.debug("Couldn't create perceptual hash of {}: {}".format(file_path_name, str(err)))
+    phash = None
+  return file_path_name, mtime, size, fprint, phash
+
+class DupIndex:
+  ''' Hashes of all cached files: { path: { filename: (mtime, size, fingerprint, phash) } }
+  Files with the same fingerprint or similar perceptual hashes (max. DEDUP_DISTANCE bits different) form a duplicate group.
+  The index is stored next to the directory cache (<DIR_CACHE_FILE>.dup).
+  '''
+  def __init__(self, fname):
+    self.fname = fname
+    self.lock = threading.Lock()
+    self.hashes = {}
+    self.dirty = False
+    self.groups = None # path -> { filename: group id } - only files which have duplicates; gets created on demand
+    self.groups_stale = False # new hashes since the groups were built - see update_groups()
+    self._read()
+
+  def _read(self):
+    try:
+      with open(self.fname, 'rb') as myfile:
+        self.hashes = pickle.load(myfile)
+    except (OSError, pickle.UnpicklingError, EOFError) as err:
+      logging.info("Couldn't read duplicate index {}: {}".format(self.fname, str(err)))
+      self.hashes = {}
+
+  def save(self):
+    with self.lock:
+      if not self.dirty:
+        return
+      try:
+        with open(self.fname+".tmp", 'wb') as myfile:
+          pickle.dump(self.hashes, myfile)
+        os.replace(self.fname+".tmp", self.fname)
+        self.dirty = False
+        logging.info('Saved duplicate index to {}'.format(self.fname))
+      except OSError as err:
+        logging.info("Couldn't write duplicate index: {}".format(str(err)))
+
+  def set_hash(self, file_path_name, mtime, size, fprint, phash):
+    path, fname = os.path.split(file_path_name)
+    with self.lock:
+      self.hashes.setdefault(path, {})[fname] = (mtime, size, fprint, phash)
+      self.dirty = True
+      self.groups_stale = True
+
+  # yields paths of cached files without (up-to-date) hashes
+  def iter_todo(self, dir_cache):
+    for path, val in list(dir_cache.get('dir', {}).items()):
+      known = self.hashes.get(path, {})
+      for fname, attr in list(val['files'].items()):
+        hashes = known.get(fname)
+        if hashes is None or hashes[0] != attr[1]:
+          yield os.path.join(path, fname)
+
+  # drop hashes of files which aren't cached any more
+  def prune(self, dir_cache):
+    dirs = dir_cache.get('dir', {})
+    with self.lock:
+      for path in list(self.hashes):
+        val = dirs.get(path)
+        if val is None:
+          del self.hashes[path]
+          self.dirty = True
+          continue
+        files = self.hashes[path]
+        for fname in [ fname for fname in files if fname not in val['files'] ]:
+          del files[fname]
+          self.dirty = True
+      if self.dirty:
+        self.groups = None
+
+  def _build_groups(self):
+    parent = {}
+    def find(key):
+      while parent[key] != key:
+        parent[key] = parent[parent[key]]
+        key = parent[key]
+      return key
+    # perceptual hashes within <distance> bits: split hash into distance+1 chunks - at least one of them is identical
+    distance = cfg.get('DEDUP_DISTANCE', 2)
+    bounds = [ 64 * i // (distance+1) for i in range(distance+2) ]
+    chunks = [ (lo, (1 << (hi-lo)) - 1) for lo, hi in zip(bounds, bounds[1:]) ]
+    first = {} # fingerprint -> first file with this value
+    buckets = {} # (chunk no, chunk value) -> [ (phash, file) ]
+    with self.lock:
+      for path, files in self.hashes.items():
+        for fname, (_, _, fprint, phash) in files.items():
+          key = (path, fname)
+          parent[key] = key
+          other = first.setdefault(fprint, key)
+          if other != key:
+            parent[find(key)] = find(other)
+          if phash is None:
+            continue
+          for i, (shift, mask) in enumerate(chunks):
+            bucket = buckets.setdefault( (i, (phash >> shift) & mask), [] )
+            for other_phash, other in bucket:
+              if bin(phash ^ other_phash).count('1') <= distance:
+                parent[find(key)] = find(other)
+            bucket.append( (phash, key) )
+    members = {}
+    for key in parent:
+      members.setdefault(find(key), []).append(key)
+    groups = {}
+    for gid, keys in enumerate( keys for keys in members.values() if len(keys) > 1 ):
+      for path, fname in keys:
+        groups.setdefault(path, {})[fname] = gid
+    return groups
+
+  # rebuild the groups after new hashes - called by the hasher per checkpoint, not per file,
+  # so that the slideshow doesn't rebuild them on the next file list
+  def update_groups(self):
+    if self.groups_stale:
+      self.groups_stale = False
+      self.groups = self._build_groups()
+
+  def get_groups(self):
+    groups = self.groups
+    if groups is None:
+      groups = self._build_groups()
+      self.groups = groups
+    return groups
+
+  # returns list of duplicate groups: [ [ (file_path_name, size), ... ] ] - biggest file first
+  def list_groups(self):
+    members = {}
+    for path, files in self.get_groups().items():
+      for fname, gid in files.items():
+        members.setdefault(gid, []).append( (os.path.join(path, fname), self.hashes[path][fname][1]) )
+    return [ sorted(files, key=lambda item: item[1], reverse=True) for files in members.values() ]
+
+  # keep one file per duplicate group (the biggest one - usually the original) within a file list
+  # key returns (path, filename) of a file list item
+  def collapse(self, file_list, key=lambda entry: os.path.split(entry[0])):
+    groups = self.get_groups()
+    if not groups:
+      return file_list
+    best = {} # group id -> (size, index within file_list)
+    entry_gid = []
+    for i, entry in enumerate(file_list):
+      path, fname = key(entry)
+      gid = groups.get(path, {}).get(fname)
+      entry_gid.append(gid)
+      if gid is not None:
+        size = self.hashes[path][fname][1]
+        if gid not in best or size > best[gid][0]:
+          best[gid] = (size, i)
+    keep = set( i for _, i in best.values() )
+    collapsed = [ entry for i, entry in enumerate(file_list) if entry_gid[i] is None or i in keep ]
+    logging.info("Duplicates removed from file list: {}".format(len(file_list) - len(collapsed)))
+    return collapsed
+
+class DupHasher(threading.Thread):
+  ''' Computes the hashes of all new or changed cached files within a pool of low priority worker processes.
+  Progress gets saved every DUP_HASH_CHECKPOINT seconds, so a restarted hasher continues where it stopped.
+  The duplicate groups get updated at these checkpoints as well.
+  '''
+  def __init__(self, cache, workers=None):
+    super().__init__(name="DupHasher", daemon=True)
+    self.cache = cache
+    self.index = cache.dup_index
+    self.workers = workers or cfg.get('DEDUP_WORKERS', 1)
+    self.batch_size = 8 * self.workers
+    self.wakeup = threading.Event()
+    self.stopped = False
+    self.stats = { 'files': 0 }
+    self.budget = None # background I/O budget - set when running as thread
+
+  def stop(self):
+    self.stopped = True
+    self.wakeup.set()
+
+  # hash all currently known files without up-to-date hashes; returns number of processed files
+  def hash_pending(self, pool, progress=None):
+    count = 0
+    checkpoint = cfg.get('DUP_HASH_CHECKPOINT', cfg.get('EXIF_HARVEST_CHECKPOINT', 300))
+    next_checkpoint = time.time() + checkpoint
+    self.index.prune(self.cache.dir_cache)
+    todo = self.index.iter_todo(self.cache.dir_cache)
+    while not self.stopped:
+      if self.budget is not None and not self.budget.in_window(): # continue within next window
+        break
+      batch = [ item for _, item in zip(range(self.batch_size), todo) ]
+      if not batch:
+        break
+      if self.budget is not None:
+        self.budget.acquire(len(batch), abort=lambda: self.stopped)
+      for file_path_name, mtime, size, fprint, phash in pool.map(hash_file, batch):
+        if mtime is not None:
+          self.index.set_hash(file_path_name, mtime, size, fprint, phash)
+          if self.budget is not None: # the perceptual hash reads the whole file - accounted afterwards
+            self.budget.acquire(0, size, abort=lambda: self.stopped)
+      count += len(batch)
+      self.stats['files'] += len(batch)
+      if progress:
+        progress(count)
+      if time.time() > next_checkpoint:
+        self.index.update_groups()
+        self.index.save()
+        next_checkpoint = time.time() + checkpoint
+    self.index.update_groups()
+    self.index.save()
+    return count
+
+  def run(self):
+    logging.info('Duplicate hasher started: {} workers'.format(self.workers))
+    self.budget = iobudget.get_budget()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=exifharvester._worker_init,
+                                                mp_context=multiprocessing.get_context('spawn')) as pool: # not forked - the slideshow runs threads
+      while not self.stopped:
+        if self.budget is not None and not self.budget.wait_window(abort=lambda: self.stopped):
+          break
+        try:
+          count = self.hash_pending(pool)
+          if count > 0:
+            logging.info('Duplicate hasher: {} files processed'.format(count))
+        except Exception as err:
+          logging.error("Error while hashing files: {}".format(str(err)))
+        self.wakeup.wait(self.cache.check_tm) # wait for new files
+    logging.info('Duplicate hasher stopped')
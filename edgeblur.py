@@ -0,0 +1,60 @@
+#!/usr/bin/python
+''' Blurred edges on the GPU (BLUR_MODE : "gpu"): the zoomed, blurred picture plus the fitted picture get rendered
+into an offscreen texture, which replaces the slide texture. Same result as the PIL version of slideimage.prepare,
+without resizing and blurring on the CPU.
+'''
+import os
+import math
+import pi3d
+import texturepool
+
+SHADER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shaders", "blur_edges")
+
+class EdgeBlur:
+  ''' Composes slide textures with blurred edges. Two offscreen textures are used alternately,
+  as the previous slide is still shown during the transition.
+  '''
+  def __init__(self, camera, size, amount=12.0, zoom=1.0, edge_alpha=0.3):
+    self.size = size
+    self.amount = amount
+    self.zoom = max(zoom, 1.0)
+    self.edge_alpha = edge_alpha
+    self.shader = pi3d.Shader(SHADER)
+    self.sprite = pi3d.Sprite(camera=camera, w=size[0], h=size[1], z=5.0)
+    self.targets = [ pi3d.OffScreenTexture("edgeblur{}".format(i)) for i in range(2) ]
+    for target in self.targets: # RGBA plus depth texture and depth buffer (16 bit each)
+      texturepool.memory.add(target, 'offscreen', texturepool.texture_bytes(target.ix, target.iy, channels=8, mipmap=False))
+    self.last = None
+
+  def _draw(self, tex, scale, uv_mult, uv_off, radius, bias, alpha):
+    self.sprite.scale(scale[0], scale[1], 1.0)
+    self.sprite.set_draw_details(self.shader, [tex], umult=uv_mult[0], vmult=uv_mult[1])
+    self.sprite.buf[0].set_offset(uv_off)
+    self.sprite.unif[48:51] = (radius[0], radius[1], bias)
+    self.sprite.set_alpha(alpha)
+    self.sprite.draw()
+
+  # returns an offscreen texture of display size with the picture and its blurred edges - or tex, if it fits the display anyway
+  def compose(self, tex):
+    (w, h) = self.size
+    (ix, iy) = texturepool.content_size(tex)
+    (fu, fv) = texturepool.content_uv(tex) # pooled textures: picture in the top left part only
+    wh_rat = (w * iy) / (h * ix)
+    if abs(wh_rat - 1.0) <= 0.01: # no edges
+      return tex
+    target = self.targets[1] if self.last is self.targets[0] else self.targets[0] # not the one of the previous slide
+    self.last = target
+    # background: picture cropped to cover the display, zoomed by BLUR_ZOOM
+    (u_range, v_range) = ( min(1.0, wh_rat), min(1.0, 1.0 / wh_rat) )
+    (u_range, v_range) = ( u_range / self.zoom, v_range / self.zoom )
+    spread = self.amount / (512 * 3.0) # like GaussianBlur(BLUR_AMOUNT) on a picture of 512 pixels width
+    radius = ( spread * u_range * fu, spread * w / h * v_range * fv )
+    bias = max( 0.0, math.log2(spread * w) ) # blur a lower mipmap level instead of the full resolution
+    fit = min( w / ix, h / iy )
+    # the vertex shader flips v: v_off = 1 - (upper end of the range)
+    target._start()
+    self._draw( tex, (1.0, 1.0), (u_range * fu, v_range * fv), ((1.0 - u_range) * 0.5 * fu, 1.0 - (1.0 + v_range) * 0.5 * fv), radius, bias, self.edge_alpha )
+    # foreground: picture fitted into the display
+    self._draw( tex, (ix * fit / w, iy * fit / h), (fu, fv), (0.0, 1.0 - fv), (0.0, 0.0), 0.0, 1.0 )
+    target._end()
+    return target
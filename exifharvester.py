@@ -0,0 +1,113 @@
+#!/usr/bin/python
+''' Background EXIF harvester: reads missing EXIF info of cached files within a pool of low priority worker processes
+'''
+import os
+import time
+import threading
+import logging
+import multiprocessing
+import concurrent.futures
+import dircache
+import exifreader
+import iobudget
+from config import cfg
+
+def _worker_init():
+  try:
+    os.nice(cfg.get('EXIF_HARVEST_NICE', 10)) # don't compete with the slideshow
+  except (AttributeError, OSError) as err: # os.nice isn't available on all platforms
+    logging.debug("Couldn't lower priority of EXIF worker: {}".format(str(err)))
+
+# runs within worker process; result None: file couldn't be read - it stays unmarked and gets retried
+def harvest_file(file_path_name):
+  try:
+    return file_path_name, dircache.extract_exif(file_path_name)
+  except OSError as err:
+    logging.debug("Couldn't read {}: {}".format(file_path_name, str(err)))
+    return file_path_name, None
+  except Exception as err:
+    logging.debug("Couldn't read EXIF of {}: {}".format(file_path_name, str(err)))
+    return file_path_name, (None, None, {})
+
+class ExifHarvester(threading.Thread):
+  ''' Walks through all cached files without EXIF info and writes the results back to the cache.
+  Progress is stored within the cache itself (checkpoint every EXIF_HARVEST_CHECKPOINT seconds),
+  so a restarted harvester continues where the previous one stopped.
+  As background thread, it draws from the shared I/O budget and only works within the IO_SCHEDULE windows.
+  '''
+  def __init__(self, cache, workers=None, checkpoint=None):
+    super().__init__(name="ExifHarvester", daemon=True)
+    self.cache = cache
+    self.workers = workers or cfg.get('EXIF_HARVEST_WORKERS', 2)
+    self.checkpoint = checkpoint or cfg.get('EXIF_HARVEST_CHECKPOINT', 300)
+    self.batch_size = 8 * self.workers
+    self.wakeup = threading.Event()
+    self.stopped = False
+    self.stats = { 'files': 0, 'exif': 0, 'no_exif': 0, 'errors': 0 }
+    self.budget = None # background I/O budget - set when running as thread
+
+  def stop(self):
+    self.stopped = True
+    self.wakeup.set()
+
+  def _apply(self, file_path_name, result):
+    if result is None: # I/O error - next harvest run tries again
+      self.stats['errors'] += 1
+      return
+    (orientation, dt, exif_info) = result
+    if orientation != None:
+      self.cache.set_exif_info( file_path_name, orientation, dt, exif_info )
+      self.stats['exif'] += 1
+    else:
+      self.cache.set_no_exif( file_path_name )
+      self.stats['no_exif'] += 1
+    self.stats['files'] += 1
+
+  # process all currently known files without EXIF info; returns number of processed files
+  # up to batch_size files are in flight, so a single slow file doesn't stall the other workers
+  def harvest(self, pool, progress=None):
+    count = 0
+    next_checkpoint = time.time() + self.checkpoint
+    todo = self.cache.iter_exif_todo()
+    pending = set()
+    while True:
+      while not self.stopped and len(pending) < self.batch_size:
+        if self.budget is not None and not self.budget.in_window(): # continue within next window
+          break
+        file_path_name = next(todo, None)
+        if file_path_name is None:
+          break
+        if self.budget is not None: # usually only the header gets read
+          self.budget.acquire(1, exifreader.HEADER_CHUNK, abort=lambda: self.stopped)
+        pending.add( pool.submit(harvest_file, file_path_name) )
+      if not pending:
+        break
+      done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        self._apply(*future.result())
+      count += len(done)
+      if progress:
+        progress(count)
+      if time.time() > next_checkpoint:
+        logging.info('EXIF harvester checkpoint: {} files processed'.format(self.stats['files']))
+        self.cache.save_cache()
+        next_checkpoint = time.time() + self.checkpoint
+    self.cache.save_cache()
+    return count
+
+  def run(self):
+    logging.info('EXIF harvester started: {} workers'.format(self.workers))
+    self.budget = iobudget.get_budget()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_worker_init,
+                                                mp_context=multiprocessing.get_context('spawn')) as pool: # the slideshow runs threads - forking it could deadlock the workers
+      while not self.stopped:
+        if self.budget is not None and not self.budget.wait_window(abort=lambda: self.stopped):
+          break
+        try:
+          count = self.harvest(pool)
+          if count > 0:
+            logging.info('EXIF harvester: {} files processed ({} with EXIF, {} without, {} not readable)'.format(self.stats['files'], self.stats['exif'], self.stats['no_exif'], self.stats['errors']))
+        except Exception as err:
+          logging.error("Error while harvesting EXIF info: {}".format(str(err)))
+        self.wakeup.wait(cfg['CHECK_DIR_TM']) # wait for new files
+    logging.info('EXIF harvester stopped')
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+''' Compact representation of cached EXIF infos: interned strings, rationals as floats and GPSInfo reduced to (lat, lon)
+'''
+import sys
+import math
+import numbers
+import pickle
+import tracemalloc
+import logging
+
+RATIONAL_TAGS = ('ExposureTime', 'FNumber', 'FocalLength') # stored as (numerator, denominator) by old PIL versions
+MAX_SHARED = 10000 # max. number of shared float values (exposure times, f-numbers, ...)
+
+_shared = {}
+
+def _share(val):
+  shared = _shared.get(val)
+  if shared is None:
+    if len(_shared) >= MAX_SHARED:
+      return val
+    _shared[val] = val
+    shared = val
+  return shared
+
+def _to_float(val):
+  if isinstance(val, tuple): # (numerator, denominator)
+    return val[0] / val[1] if val[1] else math.nan
+  return float(val)
+
+# GPS info can be decimal or tuples
+def latlon2dec(direction, degrees, minutes, seconds):
+  dec = _to_float(degrees) + _to_float(minutes)/60 + _to_float(seconds)/(60*60)
+  if direction == 'S' or direction == 'W':
+    dec *= -1
+  return dec
+
+# returns (lat, lon) of the GPSInfo IFD - or None if it doesn't contain a valid position; (lat, lon) is returned unchanged
+def gps_latlon(gps_info):
+  if isinstance(gps_info, tuple):
+    return gps_info
+  try:
+    lat = latlon2dec( gps_info[1], gps_info[2][0], gps_info[2][1], gps_info[2][2] )
+    lon = latlon2dec( gps_info[3], gps_info[4][0], gps_info[4][1], gps_info[4][2] )
+  except (KeyError, IndexError, TypeError, ValueError, ZeroDivisionError):
+    return None
+  if math.isnan(lat) or math.isnan(lon):
+    return None
+  return (lat, lon)
+
+def _compact_value(val):
+  if isinstance(val, str):
+    return sys.intern( val.rstrip('\x00 ') )
+  if isinstance(val, (int, bytes)):
+    return val
+  if isinstance(val, numbers.Real): # incl. PIL's IFDRational
+    return _share( float(val) )
+  if isinstance(val, tuple):
+    return tuple( _compact_value(v) for v in val )
+  return val
+
+# returns compacted copy of an exif_info dict (already compacted ones are returned with shared values)
+def compact(exif_info):
+  if not exif_info:
+    return exif_info
+  compacted = {}
+  for tag, val in exif_info.items():
+    cls = type(val)
+    if cls is str or cls is float or cls is int: # fast path, e.g. for already compacted infos
+      if cls is str:
+        val = sys.intern( val.rstrip('\x00 ') )
+        if not val:
+          continue
+      elif cls is float:
+        val = _share(val)
+      compacted[ sys.intern(tag) ] = val
+      continue
+    if tag == 'GPSInfo':
+      val = gps_latlon(val)
+    elif tag in RATIONAL_TAGS and isinstance(val, tuple) and len(val) == 2:
+      val = _share( _to_float(val) )
+    else:
+      val = _compact_value(val)
+    if val is not None and val != '':
+      compacted[ sys.intern(tag) ] = val
+  return compacted
+
+# pickled size and resident memory (after unpickling) of the given exif_info dicts
+def size_report(exif_infos):
+  blob = pickle.dumps(exif_infos)
+  tracemalloc.start()
+  start = tracemalloc.get_traced_memory()[0]
+  loaded = pickle.loads(blob)
+  resident = tracemalloc.get_traced_memory()[0] - start
+  tracemalloc.stop()
+  del loaded
+  return { 'files': len(exif_infos), 'pickled': len(blob), 'resident': resident }
+
+# compact the EXIF infos of all cached files; returns set of changed (path, filename) and logs the before/after size
+def compact_all(dir_cache):
+  changed = set()
+  before = []
+  after = []
+  for path, val in dir_cache.get('dir', {}).items():
+    for fname, attr in val['files'].items():
+      exif_info = attr[3]
+      if not exif_info:
+        continue
+      compacted = compact(exif_info)
+      before.append(exif_info)
+      after.append(compacted)
+      if compacted != exif_info or any( type(compacted[tag]) is not type(exif_info[tag]) for tag in compacted ):
+        attr[3] = compacted
+        changed.add( (path, fname) )
+  if changed: # resident memory isn't measured here - tracemalloc would slow down the migration considerably
+    logging.info('EXIF infos of {} files compacted: {:.1f} KB -> {:.1f} KB (pickled)'.format( len(changed),
+      len(pickle.dumps(before))/1024, len(pickle.dumps(after))/1024 ))
+  return changed
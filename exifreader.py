@@ -0,0 +1,238 @@
+#!/usr/bin/python
+''' Lightweight EXIF reader: parses the APP1 segment of JPEG files with bounded I/O instead of opening the image with PIL.
+Returns the same merged tag dict as PIL's _getexif() (IFD0 + Exif IFD + GPSInfo dict) for the tags of EXIF_DICT.
+'''
+import io
+import os
+import sys
+import time
+import struct
+import argparse
+from PIL import Image, TiffTags
+from PIL.TiffImagePlugin import IFDRational
+from config import cfg
+
+HEADER_CHUNK = 16*1024  # read size - usually covers SOI, APP0 and the complete APP1 segment (without thumbnail)
+MAX_HEADER = 256*1024   # never read more than this from the start of a file
+JPEG_EXT = ('.jpg', '.jpeg')
+
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
+# TIFF field type -> (struct format, unit size)
+TYPES = { 1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('L', 8), 6: ('b', 1), 7: ('s', 1), 8: ('h', 2),
+  9: ('l', 4), 10: ('l', 8), 11: ('f', 4), 12: ('d', 8), 13: ('L', 4), 16: ('Q', 8) }
+
+class UnsupportedFormat(Exception):
+  ''' File can't be parsed by the header reader - use PIL instead '''
+
+class _Header:
+  ''' Reads the start of a file (up to MAX_HEADER) through a window of at least HEADER_CHUNK bytes - one syscall per window '''
+  def __init__(self, myfile):
+    self.file = myfile
+    self.start = 0
+    self.buf = b''
+    self.bytes_read = 0
+
+  def read(self, pos, size):
+    if self.start <= pos and pos + size <= self.start + len(self.buf):
+      return self.buf[pos-self.start:pos-self.start+size]
+    if pos + size > MAX_HEADER:
+      raise UnsupportedFormat("EXIF data beyond {} bytes".format(MAX_HEADER))
+    end = self.start + len(self.buf)
+    if self.start <= pos <= end: # extend window
+      self.file.seek(end)
+      data = self.file.read( max(pos + size - end, HEADER_CHUNK) )
+      self.buf = self.buf[pos-self.start:] + data
+    else:
+      self.file.seek(pos)
+      data = self.file.read( max(size, HEADER_CHUNK) )
+      self.buf = data
+    self.start = pos
+    self.bytes_read += len(data)
+    if len(self.buf) < size:
+      raise UnsupportedFormat("truncated file")
+    return self.buf[:size]
+
+# returns the TIFF data of the first APP1 Exif segment or None, if the JPEG file doesn't contain one
+def _find_app1(header):
+  if header.read(0, 2) != b'\xff\xd8':
+    raise UnsupportedFormat("no JPEG file")
+  pos = 2
+  while True:
+    marker = header.read(pos, 2)
+    if marker[0] != 0xff:
+      raise UnsupportedFormat("no marker found at {}".format(pos))
+    if marker[1] == 0xff: # fill byte
+      pos += 1
+      continue
+    if marker[1] in (0xd9, 0xda): # EOI, SOS: no EXIF within header
+      return None
+    if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd7: # markers without length
+      pos += 2
+      continue
+    size = struct.unpack('>H', header.read(pos+2, 2))[0]
+    if size < 2:
+      raise UnsupportedFormat("invalid segment length")
+    if marker[1] == 0xe1 and size >= 8 and header.read(pos+4, 6) == b'Exif\x00\x00':
+      return header.read(pos+10, size-8)
+    pos += 2 + size
+
+# decode one IFD; only the given tags (None: all tags) - values are converted like PIL's ImageFileDirectory_v2 does
+def _read_ifd(tiff, endian, offset, group=None, tags=None):
+  if offset + 2 > len(tiff):
+    raise UnsupportedFormat("IFD offset beyond EXIF data")
+  count = struct.unpack(endian + 'H', tiff[offset:offset+2])[0]
+  if offset + 2 + count*12 > len(tiff):
+    raise UnsupportedFormat("truncated IFD")
+  values = {}
+  for pos in range(offset+2, offset+2+count*12, 12):
+    tag, typ, num = struct.unpack(endian + 'HHL', tiff[pos:pos+8])
+    if tags is not None and tag not in tags:
+      continue
+    if typ not in TYPES: # PIL skips unknown types as well
+      continue
+    fmt, unit = TYPES[typ]
+    size = num * unit
+    if size > 4:
+      data_offset = struct.unpack(endian + 'L', tiff[pos+8:pos+12])[0]
+      data = tiff[data_offset:data_offset+size]
+      if len(data) != size:
+        raise UnsupportedFormat("tag {} beyond EXIF data".format(tag))
+    else:
+      data = tiff[pos+8:pos+8+size]
+    if not data:
+      continue
+    if typ in (1, 7): # BYTE, UNDEFINED
+      values[tag] = data
+      continue
+    if typ == 2: # ASCII
+      if data.endswith(b'\x00'):
+        data = data[:-1]
+      values[tag] = data.decode('latin-1', 'replace')
+      continue
+    if typ in (5, 10): # (signed) rationals
+      ints = struct.unpack('{}{}{}'.format(endian, 2*num, fmt), data)
+      val = tuple( IFDRational(num, denom) for num, denom in zip(ints[::2], ints[1::2]) )
+    else:
+      val = struct.unpack('{}{}{}'.format(endian, num, fmt), data)
+    if len(val) == 1 or TiffTags.lookup(tag, group).length == 1:
+      val = val[0]
+    values[tag] = val
+  return values
+
+# parse TIFF structured EXIF data; returns merged dict like PIL's _getexif()
+def parse_tiff(tiff, tags=None):
+  if tiff[:4] == b'II*\x00':
+    endian = '<'
+  elif tiff[:4] == b'MM\x00*':
+    endian = '>'
+  else:
+    raise UnsupportedFormat("invalid TIFF header")
+  offset = struct.unpack(endian + 'L', tiff[4:8])[0]
+  wanted = None if tags is None else set(tags) | { EXIF_IFD, GPS_IFD }
+  merged = _read_ifd(tiff, endian, offset, tags=wanted)
+  for ifd in (EXIF_IFD, GPS_IFD):
+    if ifd in merged and not isinstance(merged[ifd], int):
+      raise UnsupportedFormat("invalid IFD pointer")
+  if EXIF_IFD in merged:
+    merged.update( _read_ifd(tiff, endian, merged[EXIF_IFD], EXIF_IFD, wanted) )
+  if GPS_IFD in merged:
+    merged[GPS_IFD] = _read_ifd(tiff, endian, merged[GPS_IFD], GPS_IFD)
+  return merged
+
+# returns the EXIF tags of EXIF_DICT (dict like PIL's _getexif()) or None if the file doesn't contain EXIF data
+# raises UnsupportedFormat for all files which need to be read by PIL
+def read_exif(file_path_name, stats=None):
+  if not file_path_name.lower().endswith(JPEG_EXT):
+    raise UnsupportedFormat("no JPEG file extension")
+  with open(file_path_name, 'rb', buffering=0) as myfile:
+    header = _Header(myfile)
+    try:
+      tiff = _find_app1(header)
+    finally:
+      if stats is not None:
+        stats['bytes'] = stats.get('bytes', 0) + header.bytes_read
+  if tiff is None:
+    return None
+  tags = cfg['EXIF_DICT']
+  try:
+    exif_data = parse_tiff(tiff, tags.values())
+  except struct.error as err:
+    raise UnsupportedFormat("invalid EXIF data: {}".format(str(err)))
+  if tags['Orientation'] not in exif_data and tags['DateTimeOriginal'] in exif_data: # PIL might find orientation within XMP data
+    raise UnsupportedFormat("orientation missing")
+  return exif_data
+
+#-----------------------------
+class _CountingFile(io.FileIO):
+  ''' Counts the bytes which PIL reads from disk '''
+  bytes_read = 0
+
+  def readinto(self, buf):
+    size = super().readinto(buf)
+    _CountingFile.bytes_read += size or 0
+    return size
+
+  def readall(self):
+    data = super().readall()
+    _CountingFile.bytes_read += len(data)
+    return data
+
+def _extract_pil(file_path_name):
+  import dircache
+  try:
+    with Image.open( io.BufferedReader(_CountingFile(file_path_name)) ) as im:
+      return dircache.extract_exif(file_path_name, im)
+  except OSError:
+    return (None, None, {})
+
+# compare the header reader with PIL on real files; returns dict of results
+def benchmark(files):
+  import dircache
+  result = { 'files': len(files) }
+  tm = time.perf_counter()
+  header_results = [ dircache.extract_exif(file_path_name) for file_path_name in files ] # incl. PIL fallback
+  result['header'] = { 'time': time.perf_counter() - tm }
+  stats = {}
+  fallback = 0
+  for file_path_name in files:
+    try:
+      read_exif(file_path_name, stats)
+    except (UnsupportedFormat, OSError):
+      fallback += 1
+  result['header']['bytes'] = stats.get('bytes', 0)
+  result['header']['fallback'] = fallback
+  _CountingFile.bytes_read = 0
+  tm = time.perf_counter()
+  pil_results = [ _extract_pil(file_path_name) for file_path_name in files ]
+  result['pil'] = { 'time': time.perf_counter() - tm, 'bytes': _CountingFile.bytes_read }
+  result['mismatches'] = [ fname for fname, a, b in zip(files, header_results, pil_results) if a != b ]
+  return result
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare the header-only EXIF reader with PIL')
+  parser.add_argument('path', nargs='?', default=cfg['PIC_DIR'], help='picture directory (default: PIC_DIR)')
+  parser.add_argument('--limit', type=int, default=2000, help='max. number of files')
+  args = parser.parse_args()
+  files = []
+  for root, dirs, fnames in os.walk(args.path):
+    files.extend( os.path.join(root, fname) for fname in sorted(fnames) if os.path.splitext(fname)[1].lower() in cfg['PIC_EXT'] )
+    if len(files) >= args.limit:
+      break
+  files = files[:args.limit]
+  if not files:
+    print( "No pictures found in {:s}".format(args.path) )
+    sys.exit(1)
+  result = benchmark(files)
+  print( "#Files:           {:d} ({:d} read by PIL fallback)".format( result['files'], result['header']['fallback'] ))
+  for name in ('header', 'pil'):
+    timing = result[name]
+    print( "{:8s} {:8.1f} files/s {:10.1f} KB read per file".format( name, result['files'] / max(timing['time'], 1e-6), timing['bytes'] / result['files'] / 1024 ))
+  print( "Different results: {:d}".format( len(result['mismatches']) ))
+  for fname in result['mismatches'][:10]:
+    print( "  {:s}".format(fname) )
+
+#-------------------------------
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+''' Compact columnar representation of the cached files of a directory
+'''
+import os
+import math
+import array
+import sys
+import collections.abc
+import tracemalloc
+
+class FileColumns(collections.abc.MutableMapping):
+  ''' Drop-in replacement for dir_cache['dir'][path]['files']
+  Instead of a 4-element list per file, the values are kept in array based columns:
+  orientation, file_changed_date and exif_date (NaN = None). EXIF infos are stored separately - only for files which have some.
+  Items are returned as FileRow proxies, which behave like [orientation, file_changed_date, exif_date, exif_info]
+  '''
+  __slots__ = ('path', 'names', 'index', 'orientation', 'mtime', 'dt', 'exif')
+
+  def __init__(self, path, files=None):
+    self.path = sys.intern(path)
+    self.names = []
+    self.index = {}
+    self.orientation = array.array('b')
+    self.mtime = array.array('d')
+    self.dt = array.array('d')
+    self.exif = {}
+    if files:
+      for name, attr in files.items():
+        self[name] = attr
+
+  def __getstate__(self):
+    return (self.path, self.names, self.orientation, self.mtime, self.dt, self.exif)
+
+  def __setstate__(self, state):
+    path, self.names, self.orientation, self.mtime, self.dt, self.exif = state
+    self.path = sys.intern(path)
+    self.index = { name: row for row, name in enumerate(self.names) }
+
+  def __len__(self):
+    return len(self.names)
+
+  def __iter__(self):
+    return iter(self.names)
+
+  def __contains__(self, name):
+    return name in self.index
+
+  def __getitem__(self, name):
+    return FileRow(self, self.index[name])
+
+  def __setitem__(self, name, attr):
+    row = self.index.get(name)
+    if row is None:
+      row = len(self.names)
+      self.index[name] = row
+      self.names.append(name)
+      self.orientation.append(0)
+      self.mtime.append(0.0)
+      self.dt.append(math.nan)
+    for i in range(4):
+      self.set_value(row, i, attr[i])
+
+  def __delitem__(self, name):
+    row = self.index.pop(name)
+    last = len(self.names) - 1
+    if row != last: # move last row into the gap
+      self.names[row] = self.names[last]
+      self.index[self.names[row]] = row
+      self.orientation[row] = self.orientation[last]
+      self.mtime[row] = self.mtime[last]
+      self.dt[row] = self.dt[last]
+      exif = self.exif.pop(last, None)
+      self.exif.pop(row, None)
+      if exif:
+        self.exif[row] = exif
+    else:
+      self.exif.pop(row, None)
+    del self.names[last]
+    del self.orientation[last]
+    del self.mtime[last]
+    del self.dt[last]
+
+  def clear(self):
+    self.__init__(self.path)
+
+  def get_value(self, row, i):
+    if i == 0:
+      return self.orientation[row]
+    elif i == 1:
+      return self.mtime[row]
+    elif i == 2:
+      dt = self.dt[row]
+      return None if math.isnan(dt) else dt
+    elif i == 3:
+      return self.exif.get(row, {})
+    raise IndexError('FileColumns index out of range')
+
+  def set_value(self, row, i, val):
+    if i == 0:
+      self.orientation[row] = val if val is not None else 1
+    elif i == 1:
+      self.mtime[row] = val
+    elif i == 2:
+      self.dt[row] = math.nan if val is None else val
+    elif i == 3:
+      if val:
+        self.exif[row] = val
+      else:
+        self.exif.pop(row, None)
+    else:
+      raise IndexError('FileColumns index out of range')
+
+class FileRow:
+  ''' Proxy for a single row of FileColumns: [orientation, file_changed_date, exif_date, exif_info]
+  '''
+  __slots__ = ('cols', 'row')
+
+  def __init__(self, cols, row):
+    self.cols = cols
+    self.row = row
+
+  def __len__(self):
+    return 4
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [ self.cols.get_value(self.row, j) for j in range(4)[i] ]
+    return self.cols.get_value(self.row, i)
+
+  def __setitem__(self, i, val):
+    self.cols.set_value(self.row, i, val)
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __repr__(self):
+    return repr(list(self))
+
+class FileRef:
+  ''' Compact file list item: [file_path, orientation, file_changed_date, exif_date, exif_info]
+  Refers to the directory's FileColumns (which acts as interned directory id) plus file name;
+  file_path gets created on demand and all other values are read from / written to the columns.
+  '''
+  __slots__ = ('cols', 'name')
+
+  def __init__(self, cols, name):
+    self.cols = cols
+    self.name = name
+
+  def __len__(self):
+    return 5
+
+  def __getitem__(self, i):
+    if i == 0:
+      return os.path.join(self.cols.path, self.name)
+    return self.cols.get_value(self.cols.index[self.name], i-1)
+
+  def __setitem__(self, i, val):
+    if i == 0:
+      raise IndexError('file_path of FileRef is read-only')
+    self.cols.set_value(self.cols.index[self.name], i-1, val)
+
+  def __lt__(self, other):
+    return self[0] < other[0]
+
+  def __repr__(self):
+    return repr([ self[i] for i in range(5) ])
+
+#---------------------------------------
+# convert the files of all directories of a dir_cache to the given layout ("list" or "compact")
+def convert_layout(dir_cache, layout):
+  for path, val in dir_cache.get('dir', {}).items():
+    files = val['files']
+    if layout == 'compact' and not isinstance(files, FileColumns):
+      val['files'] = FileColumns(path, files)
+    elif layout != 'compact' and isinstance(files, FileColumns):
+      val['files'] = { name: list(attr) for name, attr in files.items() }
+
+def _measure(create):
+  tracemalloc.start()
+  start = tracemalloc.get_traced_memory()[0]
+  obj = create()
+  size = tracemalloc.get_traced_memory()[0] - start
+  tracemalloc.stop()
+  return obj, size
+
+# compare resident memory of the list based and the compact layout incl. a full file list
+def memory_report(dir_cache):
+  dirs = dir_cache.get('dir', {})
+  report = {}
+  listdirs, report['list_cache'] = _measure( lambda: { path: { name: [attr[0], attr[1], attr[2], dict(attr[3])] for name, attr in val['files'].items() } for path, val in dirs.items() } )
+  _, report['list_filelist'] = _measure( lambda: [ [os.path.join(path, name), *attr] for path, files in listdirs.items() for name, attr in files.items() ] )
+  coldirs, report['compact_cache'] = _measure( lambda: { path: FileColumns(str(path), { name: attr[:3] + [dict(attr[3])] for name, attr in files.items() }) for path, files in listdirs.items() } )
+  _, report['compact_filelist'] = _measure( lambda: [ FileRef(cols, name) for cols in coldirs.values() for name in cols.names ] )
+  report['files'] = sum( len(files) for files in listdirs.values() )
+  return report
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+''' Persistent on-disk cache of prepared (display sized, rotated, optionally blurred) pictures with LRU eviction by size
+'''
+import os
+import json
+import time
+import hashlib
+import threading
+import collections
+import logging
+from PIL import Image, features
+import slideimage
+from config import cfg
+
+INFO_FILE = "imagecache.json"
+
+# name of the cache entry for a picture - without extension
+# orientation: the one the picture gets prepared with - a picture prepared before its EXIF info was known gets a new entry later
+def cache_key(file_path_name, mtime, size, orientation):
+  orientation = orientation if orientation in (2, 3, 4, 5, 6, 7, 8) else 1 # e.g. NO_EXIF
+  key = repr( (file_path_name, mtime, tuple(size), orientation, slideimage.settings()) )
+  return hashlib.sha1( key.encode('utf-8', 'surrogateescape') ).hexdigest()
+
+# write a prepared picture to the cache directory (atomic); returns (file name, size in bytes)
+# JPEG for pictures without alpha channel; pictures with alpha channel (e.g. blurred edges) as WebP - or PNG if not available
+def write_image(cache_dir, key, im, quality=90):
+  if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+    im = im.convert('RGBA')
+    if features.check('webp'):
+      fname, params = key + '.webp', { 'format': 'WEBP', 'quality': quality, 'method': 0 }
+    else:
+      fname, params = key + '.png', { 'format': 'PNG', 'compress_level': 1 }
+  else:
+    if im.mode not in ('RGB', 'L'):
+      im = im.convert('RGB')
+    fname, params = key + '.jpg', { 'format': 'JPEG', 'quality': quality }
+  file_path_name = os.path.join(cache_dir, fname)
+  tmp_name = '{}.{}.tmp'.format(file_path_name, os.getpid())
+  im.save(tmp_name, **params)
+  os.replace(tmp_name, file_path_name)
+  return fname, os.path.getsize(file_path_name)
+
+class ImageCache:
+  ''' Cache files are named by a hash of (file path, mtime, display size, preparation settings), so changed pictures or settings
+  simply lead to misses and old entries age out. The LRU order is the modification time of the cache files - every hit touches its file.
+  Several processes (slideshow, dircachemgr prewarm) can use the same directory; each of them evicts with its own view of the content.
+  '''
+  def __init__(self, cache_dir, max_bytes, quality=90):
+    self.dir = cache_dir
+    self.max_bytes = max_bytes
+    self.quality = quality
+    self.lock = threading.Lock()
+    self.entries = collections.OrderedDict() # key -> (file name, size), least recently used first
+    self.total = 0
+    self.stats = { 'hits': 0, 'misses': 0, 'written': 0, 'evicted': 0 }
+    os.makedirs(cache_dir, exist_ok=True)
+    self._scan()
+
+  def _scan(self):
+    found = []
+    with os.scandir(self.dir) as it:
+      for entry in it:
+        if entry.name == INFO_FILE or not entry.is_file():
+          continue
+        if entry.name.endswith('.tmp'): # left over by an interrupted write
+          if entry.stat().st_mtime < time.time() - 3600:
+            os.remove(entry.path)
+          continue
+        st = entry.stat()
+        found.append( (st.st_mtime, entry.name, st.st_size) )
+    for _, fname, size in sorted(found):
+      self.entries[ os.path.splitext(fname)[0] ] = (fname, size)
+      self.total += size
+    logging.info('Image cache {}: {} pictures, {:.1f} MB'.format(self.dir, len(self.entries), self.total/2**20))
+
+  # returns the cached picture (loaded PIL image) or None
+  def get(self, key):
+    with self.lock:
+      item = self.entries.get(key)
+      if item is None:
+        self.stats['misses'] += 1
+        return None
+      self.entries.move_to_end(key)
+    file_path_name = os.path.join(self.dir, item[0])
+    try:
+      im = Image.open(file_path_name)
+      im.load()
+      os.utime(file_path_name)
+    except OSError as e: # e.g. evicted by another process
+      logging.debug("Image cache: couldn't read {}: {}".format(item[0], e))
+      self._remove(key, delete=False)
+      self.stats['misses'] += 1
+      return None
+    self.stats['hits'] += 1
+    return im
+
+  def put(self, key, im):
+    try:
+      fname, size = write_image(self.dir, key, im, self.quality)
+    except OSError as e: # e.g. disk full - the slideshow continues without cache
+      logging.warning("Image cache: couldn't write {}: {}".format(key, e))
+      return
+    self.add(key, fname, size)
+
+  # register a file which was written to the cache directory (e.g. by a prewarm worker process) and evict if required
+  def add(self, key, fname, size):
+    evict = []
+    with self.lock:
+      old = self.entries.pop(key, None)
+      if old is not None:
+        self.total -= old[1]
+      self.entries[key] = (fname, size)
+      self.total += size
+      self.stats['written'] += 1
+      while self.total > self.max_bytes and len(self.entries) > 1:
+        old_key, (old_fname, old_size) = self.entries.popitem(last=False)
+        self.total -= old_size
+        evict.append(old_fname)
+    for old_fname in evict:
+      try:
+        os.remove( os.path.join(self.dir, old_fname) )
+      except OSError:
+        pass
+    self.stats['evicted'] += len(evict)
+
+  def _remove(self, key, delete=True):
+    with self.lock:
+      item = self.entries.pop(key, None)
+      if item is None:
+        return
+      self.total -= item[1]
+    if delete:
+      try:
+        os.remove( os.path.join(self.dir, item[0]) )
+      except OSError:
+        pass
+
+  def __contains__(self, key):
+    with self.lock:
+      return key in self.entries
+
+  # display size of the slideshow - remembered for dircachemgr prewarm
+  def set_display_size(self, size):
+    try:
+      with open(os.path.join(self.dir, INFO_FILE), 'w') as f:
+        json.dump({ 'display': list(size) }, f)
+    except OSError as e:
+      logging.warning("Image cache: couldn't write {}: {}".format(INFO_FILE, e))
+
+  def get_display_size(self):
+    try:
+      with open(os.path.join(self.dir, INFO_FILE)) as f:
+        return tuple( json.load(f)['display'] )
+    except (OSError, ValueError, KeyError):
+      return None
+
+_cache = None
+_cache_failed = False
+_cache_lock = threading.Lock()
+
+# the image cache of this process - None if IMAGE_CACHE_DIR isn't configured
+def get_image_cache():
+  global _cache, _cache_failed
+  with _cache_lock:
+    if _cache is None and cfg.get('IMAGE_CACHE_DIR') and not _cache_failed:
+      try:
+        _cache = ImageCache( os.path.expanduser(cfg['IMAGE_CACHE_DIR']), cfg.get('IMAGE_CACHE_SIZE', 1024) * 2**20, cfg.get('IMAGE_CACHE_QUALITY', 90) )
+      except OSError as e:
+        logging.warning("Couldn't open image cache {}: {}".format(cfg['IMAGE_CACHE_DIR'], e))
+        _cache_failed = True # don't try again
+    return _cache
+
+# prewarm worker (runs in a separate process): prepare a picture and write it to the cache; returns (key, file name, size) or None
+# orientation None: EXIF info not cached yet - read from the picture
+def prewarm_one(cache_dir, file_path_name, mtime, orientation, size, quality=90):
+  try:
+    im = slideimage.open_image(file_path_name)
+    if im is None:
+      return None
+    if orientation is None:
+      import dircache
+      orientation = dircache.extract_exif(file_path_name, im)[0] or 1
+    key = cache_key(file_path_name, mtime, size, orientation)
+    im = slideimage.fit_display( slideimage.prepare(im, orientation, size), size )
+    fname, nbytes = write_image(cache_dir, key, im, quality)
+  except Exception as e:
+    logging.warning("Couldn't prepare {}: {}".format(file_path_name, e))
+    return None
+  return key, fname, nbytes
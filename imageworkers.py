@@ -0,0 +1,168 @@
+#!/usr/bin/python
+''' Process pool for the picture preparation (decode, resize, rotation, blurred edges), so that all CPU cores can be used.
+Workers hand the prepared pictures back as RGBA frames in shared memory - only the name and shape of the frame get pickled.
+'''
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import slideimage
+import imagecache
+from config import cfg
+
+SETTINGS = ('AUTO_RESIZE', 'BLUR_EDGES', 'BLUR_ZOOM', 'BLUR_AMOUNT', 'EDGE_ALPHA', 'BLUR_MODE', 'DECODE_DRAFT', 'FIT', 'KENBURNS') # cfg values used by slideimage.prepare
+
+class SharedFrame:
+  ''' RGBA frame (numpy array of shape (h, w, 4)) in shared memory created by a worker process.
+  The receiver owns the shared memory: release() it as soon as the pixels aren't needed any more (e.g. after the texture upload).
+  '''
+  def __init__(self, name, shape):
+    self.shm = shared_memory.SharedMemory(name=name)
+    self.array = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf)
+    self.size = (shape[1], shape[0])
+
+  def release(self):
+    if self.shm is None:
+      return
+    self.array = None
+    self.shm.close()
+    try:
+      self.shm.unlink()
+    except FileNotFoundError:
+      pass
+    self.shm = None
+
+  def __del__(self): # last resort - don't leave frames in /dev/shm
+    try:
+      self.release()
+    except Exception:
+      pass
+
+def _create_shared(nbytes):
+  try:
+    return shared_memory.SharedMemory(create=True, size=nbytes, track=False) # python >= 3.13
+  except TypeError:
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    resource_tracker.unregister(shm._name, 'shared_memory') # the receiver unlinks it - not the tracker of this worker
+    return shm
+
+# worker: prepare a picture (display sized) and write it as RGBA frame to shared memory; returns ((name, shape), cached)
+# cached: (file name, size) if it was written to the image cache as well
+def prepare_frame(file_path_name, orientation, size, settings, cache_dir=None, key=None, quality=90):
+  cfg.update(settings)
+  im = slideimage.open_image(file_path_name)
+  if im is None:
+    raise ValueError("couldn't open {}".format(file_path_name))
+  im = slideimage.fit_display( slideimage.prepare(im, orientation, size), size )
+  cached = imagecache.write_image(cache_dir, key, im, quality) if cache_dir else None
+  if im.mode != 'RGBA':
+    im = im.convert('RGBA')
+  shape = (im.size[1], im.size[0], 4)
+  shm = _create_shared( shape[0] * shape[1] * 4 )
+  try:
+    np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)[:] = np.asarray(im)
+  except BaseException:
+    shm.close()
+    shm.unlink()
+    raise
+  shm.close()
+  return (shm.name, shape), cached
+
+class ImagePool:
+  ''' Process pool (spawned - the render process uses OpenGL and threads) which prepares pictures as SharedFrames.
+  prepare() blocks, so call it from several threads (see prefetch.Prefetcher) to keep all workers busy.
+  '''
+  def __init__(self, workers, image_cache=None):
+    self.workers = workers
+    self.image_cache = image_cache
+    self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    self.lock = threading.Lock()
+    self.futures = set() # submitted, result not taken yet - their frames get unlinked by shutdown()
+
+  def submit(self, file_path_name, orientation, size, key=None):
+    cache = self.image_cache if key is not None else None
+    future = self.pool.submit(prepare_frame, file_path_name, orientation, tuple(size), { name: cfg[name] for name in SETTINGS if name in cfg },
+      cache.dir if cache else None, key, cache.quality if cache else 90)
+    with self.lock:
+      self.futures.add(future)
+    return future
+
+  # returns the SharedFrame of a future returned by submit()
+  def result(self, future, key=None):
+    (name, shape), cached = future.result()
+    with self.lock:
+      if future not in self.futures: # shut down meanwhile - frame got unlinked
+        raise RuntimeError('image pool shut down')
+      self.futures.discard(future)
+    frame = SharedFrame(name, shape)
+    if cached is not None and self.image_cache is not None:
+      self.image_cache.add(key, *cached)
+    return frame
+
+  def prepare(self, file_path_name, orientation, size, key=None):
+    return self.result( self.submit(file_path_name, orientation, size, key), key )
+
+  def shutdown(self):
+    self.pool.shutdown(wait=True, cancel_futures=True)
+    with self.lock: # frames which were prepared, but never taken
+      futures, self.futures = self.futures, set()
+    for future in futures:
+      if future.cancelled() or future.exception() is not None:
+        continue
+      (name, shape), cached = future.result()
+      try:
+        SharedFrame(name, shape).release()
+      except FileNotFoundError:
+        pass
+
+#-----------------------------
+# prepare all files in the render process (workers=0) or with a pool of worker processes; returns images/s
+def benchmark(files, size, workers):
+  tm = time.perf_counter()
+  if workers == 0: # like the prefetch thread of the render process
+    for file_path_name in files:
+      im = slideimage.fit_display( slideimage.prepare(slideimage.open_image(file_path_name), 1, size), size )
+      if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+      np.asarray(im)
+  else:
+    pool = ImagePool(workers)
+    pool.prepare(files[0], 1, size).release() # start the worker processes outside the measurement
+    tm = time.perf_counter()
+    futures = [ pool.submit(file_path_name, 1, size) for file_path_name in files ]
+    for future in futures:
+      pool.result(future).release()
+    duration = time.perf_counter() - tm
+    pool.shutdown()
+    return len(files) / duration
+  return len(files) / (time.perf_counter() - tm)
+
+def main():
+  parser = argparse.ArgumentParser(description='Throughput of the picture preparation with worker processes')
+  parser.add_argument('path', nargs='?', default=cfg['PIC_DIR'], help='picture directory (default: PIC_DIR)')
+  parser.add_argument('--limit', type=int, default=40, help='max. number of files')
+  parser.add_argument('--size', default='1920x1080', help='display size <width>x<height>')
+  parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4], help='numbers of worker processes (0: render process)')
+  args = parser.parse_args()
+  size = tuple( int(x) for x in args.size.split('x') )
+  files = []
+  for root, dirs, fnames in os.walk(args.path):
+    files.extend( os.path.join(root, fname) for fname in sorted(fnames) if os.path.splitext(fname)[1].lower() in cfg['PIC_EXT'] )
+    if len(files) >= args.limit:
+      break
+  files = files[:args.limit]
+  if not files:
+    print( "No pictures found in {:s}".format(args.path) )
+    sys.exit(1)
+  print( "#Files: {:d}, display size: {:d}x{:d}, BLUR_EDGES: {}, CPU cores: {:d}".format( len(files), size[0], size[1], cfg['BLUR_EDGES'], os.cpu_count() ))
+  for workers in args.workers:
+    print( "{:12s} {:8.1f} images/s".format( "{:d} workers".format(workers) if workers else "in-process", benchmark(files, size, workers) ))
+
+#-------------------------------
+if __name__ == '__main__':
+  main()
@@ -12,13 +12,23 @@ import logging
 import time
 import datetime
 import math
+import random
 import subprocess
 import pi3d
-from pi3d.Texture import MAX_SIZE
-from PIL import Image, ImageFilter # these are needed for getting exif data from images
 
 from config import cfg
-import dircache
+import dircacheshards
+import exifharvester
+import dupindex
+import iobudget
+import playlist
+import prefetch
+import slideimage
+import imagecache
+import imageworkers
+import edgeblur
+import texturepool
+import dirwatcher
 import weatherscreen
 import PVscreen
 import displaymsg
@@ -46,6 +56,7 @@ nexttm = 0.0
 next_pic_num = 0
 iFiles = []
 nFi = 0
+dropped_files = set() # (file_path, file_changed_date) of iFiles entries which got removed or modified since file list creation
 show_camera = False
 camera_end_tm = 0.0
 monitor_status = "ON"
@@ -53,77 +64,85 @@ pcache = None
 start_date = None
 info_show_now = False
 pvmqtt = None
+edge_blur = None # blurred edges on the GPU (BLUR_MODE : "gpu")
+texture_pool = None # reused slide textures (TEXTURE_POOL)
 
 #####################################################
-def tex_load(pic_num, iFiles, size=None):
+# decode and prepare a picture (resize, rotation, blurred edges) - thread safe, used by the prefetcher as well
+# item: file list entry [file_path, orientation, mtime, dt, exif_info] or file name ie for missing file image
+def prepare_image(item, size=None):
   global pcache
-  if type(pic_num) is int:
-    fname =       iFiles[pic_num][0]
-    orientation = iFiles[pic_num][1]
-    dt =          iFiles[pic_num][3]
-    exif_info =   iFiles[pic_num][4] 
-  else: # allow file name to be passed to this function ie for missing file image
-    fname = pic_num
+  if isinstance(item, str):
+    fname = item
     orientation = 1
+    entry = None
+  else:
+    entry = item
+    fname =       entry[0]
+    orientation = entry[1]
+    dt =          entry[3]
+  image_cache = imagecache.get_image_cache() if entry is not None and size is not None else None
+  if image_cache is not None:
+    if cfg['DELAY_EXIF'] and dt is None: # exif info ot yet available - without decoding the picture, the key needs the orientation
+      (orientation, dt, entry[4]) = pcache.read_exif_info(fname)
+      (entry[1], entry[3]) = (orientation, dt)
+    key = imagecache.cache_key(fname, entry[2], size, orientation)
+    im = image_cache.get(key)
+    if im is not None:
+      return im
+  im = slideimage.open_image(fname)
+  if cfg['DELAY_EXIF'] and entry is not None: # don't do this if passed a file name
+    if dt is None: # exif info ot yet available
+      (orientation, dt, exif_info) = pcache.read_exif_info(fname, im)
+      entry[1] = orientation
+      entry[3] = dt
+      entry[4] = exif_info
+  im = slideimage.prepare(im, orientation, size)
+  if size is not None: # just the shown part - fits into the slide textures of the texture pool
+    im = slideimage.fit_display(im, size)
+  if image_cache is not None: # display sized - repeated shows just read this small local file
+    image_cache.put(key, im)
+  return im
+
+# prepare a picture with the worker processes (PREPARE_WORKERS) - EXIF info is read here, so that it gets cached
+def prepare_frame(image_pool, entry, size):
+  global pcache
+  fname = entry[0]
+  if cfg['DELAY_EXIF'] and entry[3] is None: # exif info ot yet available
+    (entry[1], entry[3], entry[4]) = pcache.read_exif_info(fname)
+  image_cache = imagecache.get_image_cache()
+  key = None
+  if image_cache is not None:
+    key = imagecache.cache_key(fname, entry[2], size, entry[1])
+    im = image_cache.get(key)
+    if im is not None:
+      return im
+  return image_pool.prepare(fname, entry[1], size, key)
+
+# free prepared pictures which don't get displayed
+def release_picture(im):
+  if isinstance(im, imageworkers.SharedFrame):
+    im.release()
+
+def tex_load(pic_num, iFiles, size=None, im=None):
+  fname = iFiles[pic_num][0] if type(pic_num) is int else pic_num
   try:
-    ext = os.path.splitext(fname)[1].lower()
-    if ext in ('.heif','.heic'):
-      im = convert_heif(fname)
+    if im is None: # not prefetched
+      im = prepare_image(iFiles[pic_num] if type(pic_num) is int else pic_num, size)
+    if isinstance(im, imageworkers.SharedFrame): # RGBA pixels in shared memory - uploaded right away, then freed
+      try:
+        if texture_pool is not None and size is not None:
+          tex = texture_pool.load(im.array)
+        else:
+          tex = texturepool.load_texture(im.array, automatic_resize=cfg['AUTO_RESIZE'])
+      finally:
+        im.release()
+    elif texture_pool is not None and size is not None:
+      tex = texture_pool.load(im)
     else:
-      im = Image.open(fname)      
-    if cfg['DELAY_EXIF'] and type(pic_num) is int: # don't do this if passed a file name
-      if dt is None: # exif info ot yet available
-        (orientation, dt, exif_info) = pcache.read_exif_info(fname, im)
-        iFiles[pic_num][1] = orientation
-        iFiles[pic_num][3] = dt
-        iFiles[pic_num][4] = exif_info
-    (w, h) = im.size
-    max_dimension = MAX_SIZE # TODO changing MAX_SIZE causes serious crash on linux laptop!
-    if not cfg['AUTO_RESIZE']: # turned off for 4K display - will cause issues on RPi before v4
-        max_dimension = 3840 # TODO check if mipmapping should be turned off with this setting.
-    if w > max_dimension:
-        im = im.resize((max_dimension, int(h * max_dimension / w)), resample=Image.LANCZOS)
-    elif h > max_dimension:
-        im = im.resize((int(w * max_dimension / h), max_dimension), resample=Image.LANCZOS)
-    if orientation == 2:
-        im = im.transpose(Image.FLIP_LEFT_RIGHT)
-    elif orientation == 3:
-        im = im.transpose(Image.ROTATE_180) # rotations are clockwise
-    elif orientation == 4:
-        im = im.transpose(Image.FLIP_TOP_BOTTOM)
-    elif orientation == 5:
-        im = im.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_270)
-    elif orientation == 6:
-        im = im.transpose(Image.ROTATE_270)
-    elif orientation == 7:
-        im = im.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_90)
-    elif orientation == 8:
-        im = im.transpose(Image.ROTATE_90)
-    if cfg['BLUR_EDGES'] and size is not None:
-      wh_rat = (size[0] * im.size[1]) / (size[1] * im.size[0])
-      if abs(wh_rat - 1.0) > 0.01: # make a blurred background
-        (sc_b, sc_f) = (size[1] / im.size[1], size[0] / im.size[0])
-        if wh_rat > 1.0:
-          (sc_b, sc_f) = (sc_f, sc_b) # swap round
-        (w, h) =  (round(size[0] / sc_b / cfg['BLUR_ZOOM']), round(size[1] / sc_b / cfg['BLUR_ZOOM']))
-        (x, y) = (round(0.5 * (im.size[0] - w)), round(0.5 * (im.size[1] - h)))
-        box = (x, y, x + w, y + h)
-        blr_sz = (int(x * 512 / size[0]) for x in size)
-        im_b = im.resize(size, resample=0, box=box).resize(blr_sz)
-        im_b = im_b.filter(ImageFilter.GaussianBlur(cfg['BLUR_AMOUNT']))
-        im_b = im_b.resize(size, resample=Image.LANCZOS)
-        im_b.putalpha(round(255 * cfg['EDGE_ALPHA']))  # to apply the same EDGE_ALPHA as the no blur method.
-        im = im.resize((int(x * sc_f) for x in im.size), resample=Image.LANCZOS)
-        """resize can use Image.LANCZOS (alias for Image.ANTIALIAS) for resampling
-        for better rendering of high-contranst diagonal lines. NB downscaled large
-        images are rescaled near the start of this try block if w or h > max_dimension
-        so those lines might need changing too.
-        """
-        im_b.paste(im, box=(round(0.5 * (im_b.size[0] - im.size[0])),
-                            round(0.5 * (im_b.size[1] - im.size[1]))))
-        im = im_b # have to do this as paste applies in place
-    tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=cfg['AUTO_RESIZE'],
-                        free_after_load=True)
+      tex = texturepool.load_texture(im, automatic_resize=cfg['AUTO_RESIZE'])
+    if edge_blur is not None and size is not None:
+      tex = edge_blur.compose(tex)
     #tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=cfg['AUTO_RESIZE'],
     #                    mipmap=cfg['AUTO_RESIZE, free_after_load=True) # poss try this if still some artifacts with full resolution
   except Exception as e:
@@ -132,23 +151,45 @@ def tex_load(pic_num, iFiles, size=None):
   return tex
 
 def get_files(dt_from=None, dt_to=None, refresh=True):
-  global pcache
+  global pcache, dropped_files
   mqtt_publish_status( fields=["status","pic_dir_refresh"], status="updating file_list" )
-  file_list = pcache.get_file_list( dt_from, dt_to, refresh=refresh )
+  if cfg['SHUFFLE'] and cfg.get('PLAYLIST_MODE', 'list') == 'sampler':
+    file_list = pcache.get_playlist( dt_from, dt_to, refresh=refresh )
+  else:
+    file_list = pcache.get_file_list( dt_from, dt_to, refresh=refresh )
+  dropped_files = set()
   mqtt_publish_status( fields="status", status="running" )
   logging.info('File list refreshed: {} images found'.format(len(file_list)) )
   return file_list, len(file_list) # tuple of file list, number of pictures
 
-
-def convert_heif(fname):
-  try:
-    import pyheif
-    from PIL import Image
-    heif_file = pyheif.read(fname)
-    image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw", heif_file.mode, heif_file.stride)
-    return image
-  except:
-    logging.warning("Could't convert HEIF. Have you installed pyheif?")
+# start of the RECENT_DAYS window: (year, month, day)
+def recent_date_from():
+  dt = datetime.datetime.now() - datetime.timedelta(cfg['RECENT_DAYS'])
+  return (dt.year, dt.month, dt.day)
+
+# splice changes of the directory cache into the current file list; returns False if a full rebuild is required instead 
+def patch_files(dt_from=None, dt_to=None):
+  global pcache, iFiles, nFi, next_pic_num, dropped_files
+  changes = pcache.get_changes()
+  count = sum( len(change['added']) + len(change['removed']) + len(change['modified']) for change in changes.values() )
+  if not cfg['SHUFFLE'] or count > max(100, nFi * cfg.get('PATCH_MAX_RATIO', 0.1)): # cheaper to rebuild file list
+    return False
+  for path, change in changes.items():
+    for item, mtime in list(change['removed'].items()) + list(change['modified'].items()):
+      dropped_files.add( (os.path.join(path, item), mtime) ) # entries get skipped - no need to search them
+  if isinstance(iFiles, playlist.Playlist): # just add new candidates to the sampler
+    candidates, weights = pcache.get_playlist_candidates(dt_from, dt_to, changes) # entries of removed/modified files get skipped via dropped_files
+    iFiles.add(candidates, weights)
+    nFi = len(iFiles)
+    logging.info('Playlist patched: {} changes, {} images added'.format(count, len(candidates)) )
+    return True
+  added = pcache.get_changed_file_list(changes, dt_from, dt_to)
+  for entry in added: # insert at random positions ahead of the current one
+    dropped_files.discard( (entry[0], entry[2]) )
+    iFiles.insert( random.randint(min(next_pic_num, len(iFiles)), len(iFiles)), entry )
+  nFi = len(iFiles)
+  logging.info('File list patched: {} changes, {} images added'.format(count, len(added)) )
+  return True
 
 def set_text_overlay(iFiles, pic_num, textlines):
   texts = displaymsg.format_text(iFiles, pic_num)
@@ -159,7 +200,7 @@ def set_text_overlay(iFiles, pic_num, textlines):
 
 # start the picture frame
 def start_picframe():
-  global date_from, date_to, quit, paused, nexttm, next_pic_num, iFiles, nFi, monitor_status, pcache, info_show_now
+  global date_from, date_to, quit, paused, nexttm, next_pic_num, iFiles, nFi, monitor_status, pcache, info_show_now, edge_blur, texture_pool
   if cfg['KENBURNS']:
     kb_up = True
     cfg['FIT'] = False
@@ -180,6 +221,16 @@ def start_picframe():
   slide.set_shader(shader)
   slide.unif[47] = cfg['EDGE_ALPHA']
   slide.unif[54] = cfg['BLEND_TYPE']
+  slide.unif[55:59] = 1.0 # part of the front / back texture with the picture (see texturepool.content_uv)
+  texture_pool = None
+  if cfg.get('TEXTURE_POOL', False):
+    if os.path.basename(cfg['SHADER']) in texturepool.SHADERS:
+      texture_pool = texturepool.TexturePool((DISPLAY.width, DISPLAY.height))
+    else: # the shader would show the padding of the pooled textures
+      logging.warning('TEXTURE_POOL ignored: SHADER {} does not handle padded textures, use one of {}'.format(cfg['SHADER'], ', '.join(texturepool.SHADERS)))
+  edge_blur = None
+  if cfg['BLUR_EDGES'] and cfg.get('BLUR_MODE', 'cpu') == 'gpu':
+    edge_blur = edgeblur.EdgeBlur(CAMERA, (DISPLAY.width, DISPLAY.height), cfg['BLUR_AMOUNT'], cfg['BLUR_ZOOM'], cfg['EDGE_ALPHA'])
 
   if cfg['KEYBOARD']:
     kbd = pi3d.Keyboard()
@@ -226,12 +277,35 @@ def start_picframe():
   next_check_tm = time.time() + cfg['CHECK_DIR_TM'] # check for new files or directory in image dir every n seconds
   next_monitor_check_tm = 0.0
   num_run_through = 0
+
+  image_cache = imagecache.get_image_cache()
+  if image_cache is not None: # for dircachemgr prewarm
+    image_cache.set_display_size((DISPLAY.width, DISPLAY.height))
+
+  # decode the next pictures in background - only the texture creation is left for the render loop
+  prefetcher = None
+  prefetch_pos = None
+  image_pool = None
+  if cfg.get('PREFETCH_N', 2) > 0:
+    size = (DISPLAY.width, DISPLAY.height)
+    if cfg.get('PREPARE_WORKERS', 0) > 0: # worker processes - all CPU cores instead of one thread under the GIL
+      image_pool = imageworkers.ImagePool(cfg['PREPARE_WORKERS'], image_cache)
+      prefetcher = prefetch.Prefetcher(lambda entry: prepare_frame(image_pool, entry, size), cfg.get('PREFETCH_N', 2), 
+        threads=cfg['PREPARE_WORKERS'], release=release_picture)
+    else:
+      prefetcher = prefetch.Prefetcher(lambda entry: prepare_image(entry, size), cfg.get('PREFETCH_N', 2))
+    prefetcher.start()
   
-  
+  frame_count = 0
+  start_tm = time.time()
   # here comes the main loop
   while DISPLAY.loop_running():
     tm = time.time()
     if (tm > nexttm and not paused) or (tm - nexttm) >= 86400.0: 
+      if pcache.cache_changed() and not patch_files(date_from, date_to): # cache changed in background -> pick up changes at slide boundary
+        iFiles, nFi = get_files(date_from, date_to, refresh=False)
+        num_run_through = 0
+        next_pic_num = 0
       if nFi > 0:
         nexttm = tm + cfg['TIME_DELAY']
         sbg = sfg
@@ -256,11 +330,15 @@ def start_picframe():
           start_pic_num = next_pic_num
           while sfg is None: # keep going through until a usable picture is found  
             pic_num = next_pic_num
-            sfg = tex_load(pic_num, iFiles, (DISPLAY.width, DISPLAY.height))
+            if (iFiles[pic_num][0], iFiles[pic_num][2]) not in dropped_files: # skip files which got removed or modified meanwhile
+              im = prefetcher.get(iFiles[pic_num]) if prefetcher is not None else None
+              sfg = tex_load(pic_num, iFiles, (DISPLAY.width, DISPLAY.height), im)
             next_pic_num += 1
             if next_pic_num >= nFi:
               num_run_through += 1
               next_pic_num = 0
+              if isinstance(iFiles, playlist.Playlist): # draw a new sequence
+                iFiles.new_run()
             if next_pic_num == start_pic_num:
               nFi = 0
               break
@@ -282,9 +360,15 @@ def start_picframe():
       if sbg is None: # first time through
         sbg = sfg
       slide.set_textures([sfg, sbg])
+      if texture_pool is not None:
+        texture_pool.shown(sfg)
+      logging.debug(texturepool.memory.summary())
       slide.unif[45:47] = slide.unif[42:44] # transfer front width and height factors to back
       slide.unif[51:53] = slide.unif[48:50] # transfer front width and height offsets
-      wh_rat = (DISPLAY.width * sfg.iy) / (DISPLAY.height * sfg.ix)
+      slide.unif[57:59] = slide.unif[55:57] # transfer front picture part of the texture
+      slide.unif[55:57] = texturepool.content_uv(sfg)
+      (ix, iy) = texturepool.content_size(sfg)
+      wh_rat = (DISPLAY.width * iy) / (DISPLAY.height * ix)
       if (wh_rat > 1.0 and cfg['FIT']) or (wh_rat <= 1.0 and not cfg['FIT']):
         sz1, sz2, os1, os2 = 42, 43, 48, 49
       else:
@@ -378,10 +462,19 @@ def start_picframe():
         next_monitor_check_tm = tm + 60 # check every minute
       if monitor_status.startswith("ON"):
         if tm > next_check_tm: # time to check picture directory
-          if pcache.refresh_cache() or (cfg['SHUFFLE'] and num_run_through >= cfg['RESHUFFLE_NUM']): # refresh file list required
+          sampler = isinstance(iFiles, playlist.Playlist)
+          rebuild = cfg['SHUFFLE'] and num_run_through >= cfg['RESHUFFLE_NUM'] and not sampler # playlist draws a new sequence per run anyway
+          if sampler and num_run_through >= cfg['RESHUFFLE_NUM']:
+            if cfg['RECENT_DAYS'] > 0 and not cfg['DATE_FROM'] and recent_date_from() != date_from: # RECENT_DAYS window moved
+              rebuild = True
+            num_run_through = 0
+          if pcache.refresh_cache() and not patch_files(date_from, date_to):
+            rebuild = True
+          if sampler and len(dropped_files) > nFi * cfg.get('PATCH_MAX_RATIO', 0.1): # removed/modified candidates are only skipped
+            rebuild = True
+          if rebuild: # refresh file list required
             if cfg['RECENT_DAYS'] > 0 and not cfg['DATE_FROM']: # reset data_from to reflect that time is proceeding
-              date_from = datetime.datetime.now() - datetime.timedelta(cfg['RECENT_DAYS'])
-              date_from = (date_from.year, date_from.month, date_from.day)
+              date_from = recent_date_from()
             iFiles, nFi = get_files(date_from, date_to)
             num_run_through = 0
             next_pic_num = 0
@@ -405,9 +498,36 @@ def start_picframe():
         next_pic_num -= 2
         if next_pic_num < -1:
           next_pic_num = -1      
+
+    if prefetcher is not None and nFi > 0 and prefetch_pos != (id(iFiles), next_pic_num, nFi): # next picture changed (slide change, back/next, new file list)
+      prefetch_pos = (id(iFiles), next_pic_num, nFi)
+      upcoming = [ iFiles[i] for i in range(next_pic_num, min(next_pic_num + prefetcher.depth, nFi)) ]
+      prefetcher.schedule([ entry for entry in upcoming if (entry[0], entry[2]) not in dropped_files ])
+    if cfg.get('ADAPTIVE_FPS', False): # full frame rate only while something moves
+      if transition_happening or cfg['KENBURNS']:
+        DISPLAY.frames_per_second = cfg['FPS']
+      else: # still picture - redraw seldom, but in time for the next slide change or text fade out
+        # the frame woken at nexttm / name_tm starts the transition and switches back to FPS, so the fade keeps its frame timing
+        wait = 1.0 / cfg.get('IDLE_FPS', 1.0)
+        if not paused:
+          wait = min(wait, nexttm - tm)
+        if tm < name_tm and info_interstitial != 'ON':
+          wait = min(wait, name_tm - tm)
+        DISPLAY.frames_per_second = 1.0 / max(wait, 1.0 / cfg['FPS'])
+      frame_count += 1
     if quit or show_camera: # set by MQTT
       break
 
+  if prefetcher is not None:
+    prefetcher.stop()
+  if image_pool is not None:
+    image_pool.shutdown()
+  if texture_pool is not None:
+    logging.info('Texture pool: {} uploads, {} one-off textures'.format(texture_pool.stats['uploads'], texture_pool.stats['one-off']))
+  logging.info(texturepool.memory.summary())
+  if frame_count > 0:
+    logging.info('Adaptive frame rate: {} frames in {:.0f}s - average {:.2f} fps (FPS : {})'.format(frame_count, time.time() - start_tm,
+                  frame_count / max(time.time() - start_tm, 1.0), cfg['FPS']))
   if cfg['KEYBOARD']:
     kbd.close()
   DISPLAY.destroy()
@@ -531,7 +651,7 @@ def mqtt_publish_status( fields=[], status="-", pic_num=-1 ):
   global iFiles, nFi, date_from, date_to, paused, monitor_status, start_date, pcache
   dfrom = datetime.datetime(*date_from).strftime("%d.%m.%Y %H:%M:%S") if date_from != None else "None" 
   dto = datetime.datetime(*date_to).strftime("%d.%m.%Y %H:%M:%S") if date_to != None else "None"
-  current_pic = iFiles[pic_num][0][len(cfg['PIC_DIR'])+1:] if pic_num>=0 else "None"
+  current_pic = dircacheshards.relative_path(iFiles[pic_num][0]) if pic_num>=0 else "None"
   cpu_temp = subprocess.check_output( ["vcgencmd", "measure_temp"] ) if os.name == 'posix' else "-"
   fcache_t = pcache.get_cache_check_date()
   fcache_t = fcache_t.strftime("%d.%m.%Y %H:%M:%S") if fcache_t != None else "-"  
@@ -594,22 +714,8 @@ def cam_show():
     switch_HDMI("OFF") # switch monitor OFF again 
 
 def check_monitor_status( tm=time.time() ):
-  if len(cfg['MONITOR_SCHEDULE']) == 0:
-    return "ON" # No schedule defined: Always ON
-  tm_now = datetime.datetime.fromtimestamp(tm)
-  schedules = cfg['MONITOR_SCHEDULE'].get(tm_now.weekday())
-  if schedules == None:
-    return "OFF" # No schedule for this weekday: OFF for the whole day
-  status = "OFF" 
-  for item in schedules:
-    start_t = datetime.time( item[0][0], item[0][1] )
-    stop_t = datetime.time( item[1][0], item[1][1] )
-    tm_start = datetime.datetime.combine( tm_now.date(), start_t )
-    tm_stop = datetime.datetime.combine( tm_now.date(), stop_t )
-    if tm_now >= tm_start and tm_now <= tm_stop:
-      status = "ON"
-      break
-  return status
+  # No schedule defined: Always ON; no schedule for this weekday: OFF for the whole day
+  return "ON" if iobudget.in_schedule( cfg['MONITOR_SCHEDULE'], tm ) else "OFF"
 
 def switch_HDMI( status ):
   if status.startswith("ON"):
@@ -631,7 +737,37 @@ def main():
   global nexttm, date_from, date_to, iFiles, nFi, quit, show_camera, pcache, start_date, shutdown, pvmqtt
   logging.info('Starting infotainment system...')
   start_date = datetime.datetime.now()
-  pcache = dircache.DirCache()
+  pcache = dircacheshards.create_cache()
+  sharded = isinstance(pcache, dircacheshards.ShardedDirCache)
+  if cfg.get('BACKGROUND_REFRESH', False) or sharded: # shards get refreshed independently - a slow root mustn't block the others
+    pcache.start_refresher()
+  watchers = []
+  def start_watcher(shard):
+    try:
+      watcher = dirwatcher.DirWatcher(shard)
+      watcher.start()
+      watchers.append(watcher)
+    except (OSError, AttributeError) as e: # e.g. inotify not available on this platform
+      logging.warning("Couldn't start directory watcher for {} - falling back to polling: {}".format(shard.pic_dir, e))
+  if cfg.get('WATCH_MODE', 'poll') == 'inotify':
+    if sharded: # shards which get ready later get their watcher as well
+      pcache.for_each_shard(start_watcher)
+    else:
+      start_watcher(pcache)
+  harvester = None
+  if cfg.get('EXIF_HARVEST', False):
+    harvester = exifharvester.ExifHarvester(pcache)
+    harvester.start()
+  hashers = []
+  def start_hasher(shard):
+    hasher = dupindex.DupHasher(shard)
+    hasher.start()
+    hashers.append(hasher)
+  if cfg.get('DEDUP', False):
+    if sharded:
+      pcache.for_each_shard(start_hasher)
+    else:
+      start_hasher(pcache)
   mqttclient = mqtt_start()
   mqtt_publish_status( status="initializing" )
 
@@ -649,8 +785,7 @@ def main():
   if cfg['DATE_TO'] and len(cfg['DATE_TO']) == 3:
     date_to = tuple(cfg['DATE_TO'])
   if cfg['RECENT_DAYS'] > 0:
-    dfrom = datetime.datetime.now() - datetime.timedelta(cfg['RECENT_DAYS'])  
-    date_from = (dfrom.year, dfrom.month, dfrom.day)
+    date_from = recent_date_from()
 
   logging.info('Initial scan of image directory...')
   iFiles, nFi = get_files(date_from, date_to, refresh=False)
@@ -669,6 +804,15 @@ def main():
       ret = 10 # Tell surrounding shell script to restart
     
   mqtt_stop(mqttclient)
+  pcache.stop_refresher()
+  for watcher in watchers:
+    watcher.stop()
+  if harvester:
+    harvester.stop()
+    harvester.join(30) # let it write its checkpoint
+  for hasher in hashers:
+    hasher.stop()
+    hasher.join(30)
   if ret==10:
     mqtt_publish_status( fields="status", status="stopped - awaiting restart" )
   else:  
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+''' Shared I/O budget for background work (directory scans, EXIF harvester, duplicate hasher)
+'''
+import time
+import datetime
+import threading
+import logging
+from config import cfg
+
+# True if tm is within one of the time windows of a schedule (same format as MONITOR_SCHEDULE)
+# empty schedule: always; weekday without entry: never
+def in_schedule(schedule, tm=None):
+  if not schedule:
+    return True
+  tm_now = datetime.datetime.fromtimestamp(tm if tm is not None else time.time())
+  for item in schedule.get(tm_now.weekday()) or []:
+    tm_start = datetime.datetime.combine( tm_now.date(), datetime.time( item[0][0], item[0][1] ) )
+    tm_stop = datetime.datetime.combine( tm_now.date(), datetime.time( item[1][0], item[1][1] ) )
+    if tm_now >= tm_start and tm_now <= tm_stop:
+      return True
+  return False
+
+class IOBudget:
+  ''' Token buckets for I/O operations (ops/s) and bytes (bytes/s) plus time windows in which background I/O is allowed.
+  A rate of 0 means unlimited. Requests larger than the bucket are granted as soon as the bucket isn't in debt,
+  so the long-term rate is kept. Foreground work (loading pictures) simply doesn't draw from the budget.
+  '''
+  def __init__(self, ops_per_sec=0, bytes_per_sec=0, schedule=None, burst=1.0):
+    self.lock = threading.Lock()
+    self.rates = (ops_per_sec or 0, bytes_per_sec or 0)
+    self.capacity = ( self.rates[0] * burst, self.rates[1] * burst )
+    self.tokens = list(self.capacity)
+    self.updated = time.monotonic()
+    self.schedule = schedule
+    self.stats = { 'ops': 0, 'bytes': 0, 'throttled': 0.0 }
+
+  def _refill(self):
+    now = time.monotonic()
+    elapsed, self.updated = now - self.updated, now
+    for i in range(2):
+      self.tokens[i] = min( self.capacity[i], self.tokens[i] + elapsed * self.rates[i] )
+
+  # take ops / bytes from the budget - blocks while the budget is exhausted; returns seconds waited
+  # abort: optional callable which stops waiting when it returns True
+  def acquire(self, ops=1, nbytes=0, abort=None):
+    waited = 0.0
+    while True:
+      with self.lock:
+        self._refill()
+        wait = max( [ -self.tokens[i] / self.rates[i] for i in range(2) if self.rates[i] > 0 ] + [0.0] )
+        if wait <= 0 or (abort and abort()):
+          for i, amount in enumerate( (ops, nbytes) ):
+            if self.rates[i] > 0:
+              self.tokens[i] -= amount
+          self.stats['ops'] += ops
+          self.stats['bytes'] += nbytes
+          self.stats['throttled'] += waited
+          return waited
+      wait = min(wait, 1.0)
+      time.sleep(wait)
+      waited += wait
+
+  def in_window(self, tm=None):
+    return in_schedule(self.schedule, tm)
+
+  # block until background I/O is allowed; returns False if aborted
+  def wait_window(self, abort=None):
+    logged = False
+    while not self.in_window():
+      if not logged:
+        logging.info('Background I/O paused until next IO_SCHEDULE window')
+        logged = True
+      if abort and abort():
+        return False
+      time.sleep(1.0 if abort else 60.0)
+    return True
+
+_budget = None
+_budget_lock = threading.Lock()
+
+# the I/O budget shared by all background workers of this process - None if no limits are configured
+def get_budget():
+  global _budget
+  with _budget_lock:
+    if _budget is None:
+      schedule = cfg.get('IO_SCHEDULE')
+      if schedule == 'monitor':
+        schedule = cfg.get('MONITOR_SCHEDULE')
+      ops, nbytes = cfg.get('IO_OPS_PER_SEC', 0), cfg.get('IO_BYTES_PER_SEC', 0)
+      if not (ops or nbytes or schedule):
+        return None
+      _budget = IOBudget(ops, nbytes, schedule, cfg.get('IO_BURST', 1.0))
+      logging.info('Background I/O budget: {} ops/s, {} bytes/s, schedule: {}'.format(ops or 'unlimited', nbytes or 'unlimited', 'yes' if schedule else 'always'))
+    return _budget
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+''' Weighted playlist: draws the next picture on demand instead of shuffling the whole file list
+'''
+import random
+import collections
+import logging
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+class AliasTable:
+  ''' Walker's alias method (Vose's variant): O(n) setup, O(1) per weighted random draw
+  '''
+  __slots__ = ('prob', 'alias', 'total')
+
+  def __init__(self, weights):
+    n = len(weights)
+    self.total = sum(weights)
+    self.prob = [0.0] * n
+    self.alias = list(range(n))
+    if n == 0 or self.total <= 0:
+      return
+    scaled = [ w * n / self.total for w in weights ]
+    small = [ i for i, p in enumerate(scaled) if p < 1.0 ]
+    large = [ i for i, p in enumerate(scaled) if p >= 1.0 ]
+    while small and large:
+      s = small.pop()
+      l = large[-1]
+      self.prob[s] = scaled[s]
+      self.alias[s] = l
+      scaled[l] -= 1.0 - scaled[s]
+      if scaled[l] < 1.0:
+        small.append( large.pop() )
+    for i in small + large: # remaining ones are (numerically) 1
+      self.prob[i] = 1.0
+
+  def __len__(self):
+    return len(self.prob)
+
+  def draw(self, rnd=random):
+    i = int( rnd.random() * len(self.prob) )
+    return i if rnd.random() < self.prob[i] else self.alias[i]
+
+class CumulativeTable:
+  ''' NumPy variant with the same interface as AliasTable: vectorized O(n) setup, O(log n) per draw.
+  Draws are created in batches, so per picture it's just a list pop. Used for big tables, where the Python based setup of the alias table is too slow.
+  '''
+  __slots__ = ('cumulative', 'total', 'batch', 'rng')
+
+  def __init__(self, weights):
+    self.cumulative = np.cumsum( np.asarray(weights, dtype=np.float64) )
+    self.total = float(self.cumulative[-1]) if len(self.cumulative) else 0.0
+    self.batch = []
+    self.rng = np.random.default_rng()
+
+  def __len__(self):
+    return len(self.cumulative)
+
+  def draw(self, rnd=random):
+    if not self.batch:
+      pos = np.searchsorted( self.cumulative, self.rng.random(256) * self.total, side='right' )
+      self.batch = np.minimum(pos, len(self.cumulative)-1).tolist()
+    return self.batch.pop()
+
+def make_table(weights):
+  if np is not None and len(weights) > 10000:
+    return CumulativeTable(weights)
+  return AliasTable( list(weights) )
+
+class Playlist:
+  ''' Behaves like the file list (iFiles) of the slideshow: len() is the number of candidates and
+  playlist[i] is the i-th picture of the current run, which gets drawn on first access.
+  Candidates are drawn with the given weights; a candidate isn't repeated until <no_repeat> other ones were shown.
+  Candidates added later (add()) are kept in a second, small alias table - so no full rebuild is required.
+  '''
+  def __init__(self, candidates, weights, make_entry, no_repeat=0):
+    self.make_entry = make_entry
+    self.candidates = [ candidates ]
+    self.tables = [ make_table(weights) ]
+    self.added_weights = []
+    self.drawn = []     # entries of the current run
+    self.recent = collections.deque()
+    self.recent_set = set()
+    self.no_repeat = min(no_repeat, len(self.candidates[0]) // 2) # rejection sampling needs enough choice
+    self.count = len(self.candidates[0])
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, i):
+    if i < 0: # e.g. going back from the first picture
+      i = max(0, i + len(self.drawn))
+    while len(self.drawn) <= i:
+      self.drawn.append( self._draw() )
+    return self.drawn[i]
+
+  def _draw_one(self):
+    total = sum( table.total for table in self.tables )
+    pick = random.random() * total
+    for t, table in enumerate(self.tables):
+      if pick < table.total or t == len(self.tables)-1:
+        return t, table.draw()
+      pick -= table.total
+
+  def _draw(self):
+    for _ in range(20): # no repeat until N others shown - gives up after some attempts
+      key = self._draw_one()
+      if key not in self.recent_set:
+        break
+    if self.no_repeat > 0:
+      self.recent.append(key)
+      self.recent_set.add(key)
+      while len(self.recent) > self.no_repeat:
+        self.recent_set.discard( self.recent.popleft() )
+    t, i = key
+    return self.make_entry( self.candidates[t][i] )
+
+  # start a new run through the playlist
+  def new_run(self):
+    self.drawn = []
+
+  # add candidates e.g. for new files
+  def add(self, candidates, weights):
+    if len(self.candidates) == 1:
+      self.candidates.append([])
+      self.tables.append( AliasTable([]) )
+    self.candidates[1].extend(candidates)
+    self.added_weights.extend(weights)
+    self.tables[1] = make_table(self.added_weights)
+    self.count += len(candidates)
+    logging.info("Playlist: {} candidates added".format(len(candidates)))
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+''' Background preparation (decode, resize, rotate, blur) of the upcoming slides
+'''
+import threading
+import collections
+import logging
+
+class Prefetcher:
+  ''' Prepares the next PREFETCH_N pictures of the file list in background, so that only the texture creation
+  happens within the render loop. Pictures are identified by (file_path, file_changed_date) of their file list entry,
+  so jumps (back / next / new file list) simply lead to misses - and prepared pictures which aren't upcoming any more get dropped.
+  With several threads (e.g. waiting for a process pool), pictures get prepared in parallel.
+  '''
+  def __init__(self, prepare, depth=2, threads=1, release=None):
+    self.prepare = prepare      # entry -> prepared picture
+    self.release = release      # called for prepared pictures which get dropped
+    self.depth = depth
+    self.threads = [ threading.Thread(target=self.run, name="Prefetcher-{}".format(i), daemon=True) for i in range(max(1, min(threads, depth))) ]
+    self.cond = threading.Condition()
+    self.queue = collections.OrderedDict() # key -> entry - waiting for preparation
+    self.wanted = set()         # keys of the upcoming entries
+    self.ready = {}             # key -> prepared picture
+    self.busy = set()           # keys of the entries in preparation
+    self.stopped = False
+    self.stats = { 'hits': 0, 'misses': 0, 'dropped': 0 }
+
+  @staticmethod
+  def key(entry):
+    return (entry[0], entry[2])
+
+  def start(self):
+    logging.info('Prefetcher started: {} pictures ahead, {} in parallel'.format(self.depth, len(self.threads)))
+    for thread in self.threads:
+      thread.start()
+
+  def stop(self):
+    with self.cond:
+      self.stopped = True
+      dropped = list(self.ready.values())
+      self.ready = {}
+      self.cond.notify_all()
+    self._release(dropped)
+    logging.info('Prefetcher stopped: {} hits, {} misses, {} dropped'.format(self.stats['hits'], self.stats['misses'], self.stats['dropped']))
+
+  def _release(self, pictures):
+    if self.release is not None:
+      for im in pictures:
+        self.release(im)
+
+  # set the upcoming file list entries (in display order) - everything else gets dropped
+  def schedule(self, entries):
+    wanted = [ (self.key(entry), entry) for entry in entries[:self.depth] ]
+    with self.cond:
+      self.wanted = set( key for key, _ in wanted )
+      dropped = [ self.ready.pop(key) for key in [ key for key in self.ready if key not in self.wanted ] ]
+      self.stats['dropped'] += len(dropped)
+      self.queue = collections.OrderedDict( (key, entry) for key, entry in wanted if key not in self.ready and key not in self.busy )
+      self.cond.notify_all()
+    self._release(dropped)
+
+  # returns the prepared picture of an entry - or None if it's not prepared (yet)
+  def get(self, entry):
+    key = self.key(entry)
+    with self.cond:
+      self.queue.pop(key, None) # not started yet - caller prepares it by itself
+      while key in self.busy and not self.stopped: # almost done - wait for it
+        self.cond.wait()
+      im = self.ready.pop(key, None)
+      self.wanted.discard(key)
+      self.stats['hits' if im is not None else 'misses'] += 1
+      return im
+
+  def run(self):
+    while True:
+      with self.cond:
+        while not self.queue and not self.stopped:
+          self.cond.wait()
+        if self.stopped:
+          break
+        key, entry = self.queue.popitem(last=False)
+        self.busy.add(key)
+      try:
+        im = self.prepare(entry)
+      except Exception as err:
+        logging.warning("Couldn't prefetch {}: {}".format(key[0], str(err)))
+        im = None
+      with self.cond:
+        self.busy.discard(key)
+        keep = im is not None and key in self.wanted and not self.stopped
+        if keep:
+          self.ready[key] = im
+        self.cond.notify_all()
+      if im is not None and not keep:
+        self._release([im])
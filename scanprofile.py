@@ -0,0 +1,68 @@
+#!/usr/bin/python
+''' Instrumentation of directory cache scans: per-phase timings plus per-directory durations and syscall counts
+'''
+import time
+import threading
+import contextlib
+
+PHASES = ('walk', 'stat', 'yaml', 'enumerate', 'throttle', 'cleanup', 'save', 'load')
+
+class ScanProfile:
+  ''' Collects timings of a DirCache scan. Phases:
+  walk:      reading directory listings (os.walk / os.scandir)
+  stat:      stat calls of directories and .INFOTAINMENT.yaml files
+  yaml:      parsing and compiling .INFOTAINMENT.yaml files
+  enumerate: filtering and stat'ing the files of changed directories
+  throttle:  waiting for the background I/O budget (IO_OPS_PER_SEC)
+  cleanup:   removing vanished directories from the cache
+  save/load: writing / reading the cache file or database
+  With SCAN_MODE "scandir" the phase timings are summed up over all scanner threads, so they can exceed the wall clock time.
+  '''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.phases = dict.fromkeys(PHASES, 0.0)
+    self.reset()
+
+  # start a new scan - the load time of the cache is kept
+  def reset(self):
+    with self.lock:
+      self.phases = dict( dict.fromkeys(PHASES, 0.0), load=self.phases['load'] )
+      self.dirs = {}       # path -> [seconds, syscalls]
+      self.started = time.time()
+      self.duration = 0.0  # wall clock time of the last scan
+
+  def add_time(self, phase, seconds):
+    with self.lock:
+      self.phases[phase] += seconds
+
+  def add_dir(self, path, seconds, syscalls):
+    with self.lock:
+      stats = self.dirs.setdefault(path, [0.0, 0])
+      stats[0] += seconds
+      stats[1] += syscalls
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    tm = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add_time(name, time.perf_counter() - tm)
+
+  # returns list of (path, seconds, syscalls) - slowest directories first
+  def slowest(self, count=10):
+    with self.lock:
+      dirs = sorted( self.dirs.items(), key=lambda item: item[1][0], reverse=True )[:count]
+    return [ (path, stats[0], stats[1]) for path, stats in dirs ]
+
+  def as_dict(self, count=10):
+    with self.lock:
+      result = {
+        'started': self.started,
+        'duration': self.duration,
+        'phases': dict(self.phases),
+        'dirs': len(self.dirs),
+        'syscalls': sum( stats[1] for stats in self.dirs.values() ),
+      }
+    result['slowest'] = self.slowest(count)
+    return result
@@ -3,13 +3,19 @@
 varying vec2 texcoordoutf;
 varying vec2 texcoordoutb;
 
+// unif[18].yz, unif[19].xy: part of the front / back texture with the picture (padded textures of the texture pool)
+// so the mirrored repeat outside of the picture is done here instead of GL_MIRRORED_REPEAT
+vec2 mirrored(vec2 coord) {
+  return 1.0 - abs(1.0 - mod(coord, 2.0));
+}
+
 void main(void) {
-  vec4 texf = texture2D(tex0, texcoordoutf);
+  vec4 texf = texture2D(tex0, mirrored(texcoordoutf) * unif[18].yz);
   if (texcoordoutf[0] < 0.0 || texcoordoutf[0] > 1.0 ||
       texcoordoutf[1] < 0.0 || texcoordoutf[1] > 1.0) {
     texf.a = unif[15][2];
   }
-  vec4 texb = texture2D(tex1, texcoordoutb);
+  vec4 texb = texture2D(tex1, mirrored(texcoordoutb) * unif[19].xy);
   if (texcoordoutb[0] < 0.0 || texcoordoutb[0] > 1.0 ||
       texcoordoutb[1] < 0.0 || texcoordoutf[1] > 1.0) {
     texb.a = unif[15][2];
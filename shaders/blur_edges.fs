@@ -0,0 +1,47 @@
+/////BLURRED EDGES/////
+// same taps as filter_blur.fs, but with a constant radius and sampling a lower mipmap level
+// unif[16].xy: radius (uv units), unif[16][2]: mipmap bias; radius 0 draws the picture unchanged
+#include std_head_fs.inc
+
+varying vec2 uv;
+
+#define factor 0.04
+
+void main(void){
+  vec2 f = unif[16].xy;
+  float bias = unif[16][2];
+
+  vec4 c = texture2D(tex0, uv, bias);
+  if (f.x > 0.0) {
+    c += texture2D(tex0, uv + vec2(-1.0, 0.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(-1.414, 1.414) * f, bias);
+    c += texture2D(tex0, uv + vec2(0.0, 1.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(1.414, 1.414) * f, bias);
+    c += texture2D(tex0, uv + vec2(1.0, 0.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(1.414, -1.414) * f, bias);
+    c += texture2D(tex0, uv + vec2(0.0, -1.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(-1.414, -1.414) * f, bias);
+
+    c += texture2D(tex0, uv + vec2(-3.0, 0.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(-2.121, 2.121) * f, bias);
+    c += texture2D(tex0, uv + vec2(0.0, 3.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(2.121, 2.121) * f, bias);
+    c += texture2D(tex0, uv + vec2(3.0, 0.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(2.121, -2.121) * f, bias);
+    c += texture2D(tex0, uv + vec2(0.0, -3.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(-2.121, -2.121) * f, bias);
+
+    c += texture2D(tex0, uv + vec2(-6.0, 0.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(-4.243, 4.243) * f, bias);
+    c += texture2D(tex0, uv + vec2(0.0, 6.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(4.243, 4.243) * f, bias);
+    c += texture2D(tex0, uv + vec2(6.0, 0.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(4.243, -4.243) * f, bias);
+    c += texture2D(tex0, uv + vec2(0.0, -6.0) * f, bias);
+    c += texture2D(tex0, uv + vec2(-4.243, -4.243) * f, bias);
+    c *= factor;
+  }
+
+  gl_FragColor = c;
+  gl_FragColor.a = unif[5][2];
+}
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+''' Preparation of pictures for the slideshow: decode, resize, rotation and blurred edges.
+Only needs PIL, so it can be used by the utilities (e.g. dircachemgr prewarm) as well.
+'''
+import os
+import sys
+import math
+import time
+import argparse
+import logging
+from PIL import Image, ImageFilter
+from config import cfg
+
+try:
+  from pi3d.Texture import MAX_SIZE
+except ImportError: # e.g. utilities on a headless system
+  MAX_SIZE = 1920
+
+VERSION = 3 # increase if the preparation changes - invalidates cached images
+REDUCING_GAP = 1.0 # draft/reduce only down to this multiple of the needed size - e.g. 2.0 leaves more of the downscaling to LANCZOS (quality vs. speed)
+
+def convert_heif(fname):
+  try:
+    import pyheif
+    heif_file = pyheif.read(fname)
+    image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw", heif_file.mode, heif_file.stride)
+    return image
+  except:
+    logging.warning("Could't convert HEIF. Have you installed pyheif?")
+
+def open_image(fname):
+  ext = os.path.splitext(fname)[1].lower()
+  if ext in ('.heif','.heic'):
+    return convert_heif(fname)
+  return Image.open(fname)
+
+# settings which change the prepared picture (part of the image cache key)
+def settings():
+  return ( VERSION, MAX_SIZE, cfg['AUTO_RESIZE'], cfg['BLUR_EDGES'], cfg['BLUR_ZOOM'], cfg['BLUR_AMOUNT'], cfg['EDGE_ALPHA'], cfg.get('DECODE_DRAFT', True), cfg.get('BLUR_MODE', 'cpu'), cfg['FIT'], cfg['KENBURNS'] )
+
+# size the decoded picture needs to cover the display - in the orientation of the stored picture (5-8: rotated by 90 degrees)
+def needed_size(orientation, size):
+  return (size[1], size[0]) if orientation in (5, 6, 7, 8) else tuple(size)
+
+# decode with the lowest resolution which still covers the display (with REDUCING_GAP): DCT scaling (1/2, 1/4, 1/8) for JPEGs, reduce() for others
+def reduced_load(im, orientation=1, size=None):
+  if size is None or not cfg.get('DECODE_DRAFT', True):
+    im.load()
+    return im
+  need = [ round(x * REDUCING_GAP) for x in needed_size(orientation, size) ]
+  if im.format == 'JPEG':
+    im.draft(im.mode, need) # keeps both dimensions >= need
+  im.load()
+  factor = min( im.size[0] // need[0], im.size[1] // need[1] )
+  if factor >= 2 and im.mode in ('RGB', 'RGBA', 'L', 'LA'):
+    im = im.reduce(factor)
+  return im
+
+# rotate / flip according to the EXIF orientation
+def transpose(im, orientation):
+  if orientation == 2:
+      im = im.transpose(Image.FLIP_LEFT_RIGHT)
+  elif orientation == 3:
+      im = im.transpose(Image.ROTATE_180) # rotations are clockwise
+  elif orientation == 4:
+      im = im.transpose(Image.FLIP_TOP_BOTTOM)
+  elif orientation == 5:
+      im = im.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_270)
+  elif orientation == 6:
+      im = im.transpose(Image.ROTATE_270)
+  elif orientation == 7:
+      im = im.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_90)
+  elif orientation == 8:
+      im = im.transpose(Image.ROTATE_90)
+  return im
+
+# resize, rotate and - if BLUR_EDGES - fill the edges of a picture with a blurred version of it
+def prepare(im, orientation=1, size=None):
+  im = reduced_load(im, orientation, size) # decode here - not lazily within the texture creation
+  (w, h) = im.size
+  max_dimension = MAX_SIZE # TODO changing MAX_SIZE causes serious crash on linux laptop!
+  if not cfg['AUTO_RESIZE']: # turned off for 4K display - will cause issues on RPi before v4
+      max_dimension = 3840 # TODO check if mipmapping should be turned off with this setting.
+  if w > max_dimension:
+      im = im.resize((max_dimension, int(h * max_dimension / w)), resample=Image.LANCZOS)
+  elif h > max_dimension:
+      im = im.resize((int(w * max_dimension / h), max_dimension), resample=Image.LANCZOS)
+  im = transpose(im, orientation)
+  if cfg['BLUR_EDGES'] and cfg.get('BLUR_MODE', 'cpu') != 'gpu' and size is not None: # "gpu": done by edgeblur.EdgeBlur
+    wh_rat = (size[0] * im.size[1]) / (size[1] * im.size[0])
+    if abs(wh_rat - 1.0) > 0.01: # make a blurred background
+      (sc_b, sc_f) = (size[1] / im.size[1], size[0] / im.size[0])
+      if wh_rat > 1.0:
+        (sc_b, sc_f) = (sc_f, sc_b) # swap round
+      (w, h) =  (round(size[0] / sc_b / cfg['BLUR_ZOOM']), round(size[1] / sc_b / cfg['BLUR_ZOOM']))
+      (x, y) = (round(0.5 * (im.size[0] - w)), round(0.5 * (im.size[1] - h)))
+      box = (x, y, x + w, y + h)
+      blr_sz = (int(x * 512 / size[0]) for x in size)
+      im_b = im.resize(size, resample=0, box=box).resize(blr_sz)
+      im_b = im_b.filter(ImageFilter.GaussianBlur(cfg['BLUR_AMOUNT']))
+      im_b = im_b.resize(size, resample=Image.LANCZOS)
+      im_b.putalpha(round(255 * cfg['EDGE_ALPHA']))  # to apply the same EDGE_ALPHA as the no blur method.
+      im = im.resize((int(x * sc_f) for x in im.size), resample=Image.LANCZOS)
+      """resize can use Image.LANCZOS (alias for Image.ANTIALIAS) for resampling
+      for better rendering of high-contranst diagonal lines. NB downscaled large
+      images are rescaled near the start of this function if w or h > max_dimension
+      so those lines might need changing too.
+      """
+      im_b.paste(im, box=(round(0.5 * (im_b.size[0] - im.size[0])),
+                          round(0.5 * (im_b.size[1] - im.size[1]))))
+      im = im_b # have to do this as paste applies in place
+  return im
+
+# shrink a prepared picture to the part which gets shown: fitted into the display (FIT : True or BLUR_EDGES),
+# cropped to the display (FIT : False) or covering the display (KENBURNS - it pans over the picture)
+def fit_display(im, size):
+  if cfg['KENBURNS']:
+    scale = max( size[0] / im.size[0], size[1] / im.size[1] )
+  elif cfg['FIT'] or cfg['BLUR_EDGES']:
+    scale = min( size[0] / im.size[0], size[1] / im.size[1] )
+  else:
+    (w, h) = ( min(im.size[0], round(im.size[1] * size[0] / size[1])), min(im.size[1], round(im.size[0] * size[1] / size[0])) )
+    if (w, h) != im.size: # centre part with the aspect ratio of the display
+      (x, y) = ( (im.size[0] - w) // 2, (im.size[1] - h) // 2 )
+      im = im.crop( (x, y, x + w, y + h) )
+    scale = size[0] / im.size[0]
+  if scale < 1.0:
+    im = im.resize( (max(1, round(im.size[0] * scale)), max(1, round(im.size[1] * scale))), resample=Image.LANCZOS )
+  return im
+
+#-----------------------------
+def _psnr(im, ref):
+  import numpy as np
+  if im.size != ref.size:
+    im = im.resize(ref.size, resample=Image.LANCZOS)
+  diff = np.asarray(im.convert('RGB'), dtype=np.float32) - np.asarray(ref.convert('RGB'), dtype=np.float32)
+  mse = float( (diff * diff).mean() )
+  return 99.0 if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+# compare full decode (DECODE_DRAFT : False) with draft/reduce decoding: ms per picture and PSNR against
+# a reference (full decode, one LANCZOS resize to the final size); returns dict of results
+def benchmark(files, size):
+  import dircache
+  draft = cfg.get('DECODE_DRAFT', True)
+  orientations = [ dircache.extract_exif(file_path_name)[0] or 1 for file_path_name in files ]
+  result = { 'files': len(files) }
+  outputs = {}
+  for name, enabled in (('full', False), ('draft', True)):
+    cfg['DECODE_DRAFT'] = enabled
+    tm = time.perf_counter()
+    outputs[name] = [ fit_display( prepare(open_image(file_path_name), orientation, size), size ) for file_path_name, orientation in zip(files, orientations) ]
+    result[name] = { 'ms': (time.perf_counter() - tm) * 1000 / len(files) }
+  cfg['DECODE_DRAFT'] = draft
+  psnr = { 'full': [], 'draft': [] }
+  for i, (file_path_name, orientation) in enumerate(zip(files, orientations)):
+    with open_image(file_path_name) as im:
+      ref = fit_display(transpose(im, orientation), size)
+    for name in psnr:
+      psnr[name].append( _psnr(outputs[name][i], ref) )
+  for name, values in psnr.items():
+    result[name]['psnr'] = sum(values) / len(values)
+    result[name]['psnr_min'] = min(values)
+  return result
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare full decoding with draft/reduce decoding of pictures')
+  parser.add_argument('path', nargs='?', default=cfg['PIC_DIR'], help='picture directory (default: PIC_DIR)')
+  parser.add_argument('--limit', type=int, default=20, help='max. number of files')
+  parser.add_argument('--size', default='1920x1080', help='display size <width>x<height>')
+  args = parser.parse_args()
+  size = tuple( int(x) for x in args.size.split('x') )
+  files = []
+  for root, dirs, fnames in os.walk(args.path):
+    files.extend( os.path.join(root, fname) for fname in sorted(fnames) if os.path.splitext(fname)[1].lower() in cfg['PIC_EXT'] )
+    if len(files) >= args.limit:
+      break
+  files = files[:args.limit]
+  if not files:
+    print( "No pictures found in {:s}".format(args.path) )
+    sys.exit(1)
+  result = benchmark(files, size)
+  print( "#Files: {:d}, display size: {:d}x{:d}".format( result['files'], size[0], size[1] ))
+  for name in ('full', 'draft'):
+    print( "{:8s} {:8.1f} ms/picture   PSNR {:5.1f} dB (min. {:5.1f} dB)".format( name, result[name]['ms'], result[name]['psnr'], result[name]['psnr_min'] ))
+
+#-------------------------------
+if __name__ == '__main__':
+  main()
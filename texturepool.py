@@ -0,0 +1,115 @@
+#!/usr/bin/python
+''' Reusable slide textures of display size plus accounting of the GPU memory used by the slideshow.
+New pictures get uploaded into the existing textures (Texture.update_ndarray) instead of creating and freeing
+a texture for each slide - the GPU memory (CMA on a Raspberry Pi) doesn't get fragmented by long runs.
+'''
+import weakref
+import logging
+import collections
+import numpy as np
+import pi3d
+
+LEAK_LIMIT = 4 # warn if more one-off slide textures than this are alive - the slide only references two
+SHADERS = ('blend_new',) # slide shaders which only sample the picture part of a texture (unif[18].yz, unif[19].xy)
+
+# estimated GPU memory of a texture - RGB textures usually get stored with 4 bytes per pixel as well; mipmaps add a third
+def texture_bytes(w, h, channels=4, mipmap=True):
+  return round(w * h * channels * (4.0 / 3.0 if mipmap else 1.0))
+
+class TextureMemory:
+  ''' Bytes and number of the textures alive per kind ('pool', 'texture', 'offscreen'). Textures get registered when they are
+  created and drop out automatically when python frees them (pi3d deletes the OpenGL texture at the next frame).
+  '''
+  def __init__(self):
+    self.bytes = collections.Counter()
+    self.count = collections.Counter()
+    self.peak = 0
+    self.warned = False
+
+  def add(self, obj, kind, nbytes):
+    self.bytes[kind] += nbytes
+    self.count[kind] += 1
+    self.peak = max(self.peak, self.total())
+    weakref.finalize(obj, self._remove, kind, nbytes)
+    if kind == 'texture' and self.count[kind] > LEAK_LIMIT and not self.warned:
+      logging.warning('{} slide textures alive - are textures leaking? {}'.format(self.count[kind], self.summary()))
+      self.warned = True
+
+  def _remove(self, kind, nbytes):
+    self.bytes[kind] -= nbytes
+    self.count[kind] -= 1
+
+  def total(self):
+    return sum(self.bytes.values())
+
+  def summary(self):
+    kinds = ', '.join( '{} {}: {:.1f} MB'.format(self.count[kind], kind, self.bytes[kind]/2**20) for kind in sorted(self.count) if self.count[kind] )
+    return 'GPU texture memory {:.1f} MB (peak {:.1f} MB) - {}'.format(self.total()/2**20, self.peak/2**20, kinds or 'none')
+
+memory = TextureMemory()
+
+# size of the picture within a texture - pooled textures are larger than their picture
+def content_size(tex):
+  return getattr(tex, 'content', None) or (tex.ix, tex.iy)
+
+# part of the texture (u, v) which holds the picture
+def content_uv(tex):
+  (w, h) = content_size(tex)
+  return (w / tex.ix, h / tex.iy)
+
+class TexturePool:
+  ''' Slide textures of display size. A picture which fits into it gets copied into the top left corner of a staging array
+  and uploaded into the texture which isn't shown at the moment; larger pictures (e.g. KENBURNS) get a one-off texture.
+  The remaining area is padding: use content_size() / content_uv() instead of ix, iy of the texture.
+  '''
+  def __init__(self, size, slots=2):
+    (self.w, self.h) = size
+    self.staging = np.zeros((self.h, self.w, 4), dtype=np.uint8)
+    self.slots = []
+    for i in range(slots):
+      tex = pi3d.Texture(self.staging, blend=True, m_repeat=True, free_after_load=True)
+      memory.add(tex, 'pool', texture_bytes(self.w, self.h))
+      self.slots.append(tex)
+    self.front = None # texture of the current slide - background of the next transition
+    self.stats = { 'uploads': 0, 'one-off': 0 }
+    logging.info('Texture pool: {} slide textures {}x{}'.format(slots, self.w, self.h))
+
+  # the texture which is shown now - it isn't reused by the next load()
+  def shown(self, tex):
+    self.front = tex
+
+  # returns a slide texture with the picture (PIL image or numpy array (h, w, 3|4))
+  def load(self, im):
+    if isinstance(im, np.ndarray):
+      (w, h) = (im.shape[1], im.shape[0])
+    else:
+      (w, h) = im.size
+    if w > self.w or h > self.h:
+      return self.load_one_off(im)
+    if not isinstance(im, np.ndarray):
+      if im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA')
+      im = np.asarray(im)
+    staging = self.staging
+    staging[:h, :w, :im.shape[2]] = im
+    if im.shape[2] == 3:
+      staging[:h, :w, 3] = 255
+    if w < self.w: # repeat the last column and row, so that the linear filtering doesn't blend in the padding
+      staging[:h, w] = staging[:h, w - 1]
+    if h < self.h:
+      staging[h, :min(w + 1, self.w)] = staging[h - 1, :min(w + 1, self.w)]
+    tex = self.slots[1] if self.slots[0] is self.front else self.slots[0]
+    tex.update_ndarray(staging)
+    tex.content = (w, h)
+    self.stats['uploads'] += 1
+    return tex
+
+  def load_one_off(self, im):
+    self.stats['one-off'] += 1
+    return load_texture(im)
+
+# a new slide texture (PIL image or numpy array), registered in the accounting
+def load_texture(im, automatic_resize=True):
+  tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=automatic_resize, free_after_load=True)
+  memory.add(tex, 'texture', texture_bytes(tex.ix, tex.iy))
+  return tex
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+''' Compiled include / exclude rules of .INFOTAINMENT.yaml files
+'''
+import os
+import re
+import fnmatch
+
+def _compile(patterns):
+  if not patterns:
+    return None
+  return re.compile( '|'.join( fnmatch.translate(os.path.normcase(str(p))) for p in patterns ) )
+
+class FileRules:
+  ''' include / exclude patterns of a single .INFOTAINMENT.yaml, compiled into one regex each
+  '''
+  __slots__ = ('exclude', 'include', 'recursive', 'exclude_all')
+
+  def __init__(self, yaml_cfg):
+    yaml_cfg = yaml_cfg if isinstance(yaml_cfg, dict) else {}
+    self.exclude = _compile(yaml_cfg.get("exclude"))
+    self.include = _compile(yaml_cfg.get("include"))
+    self.recursive = bool(yaml_cfg.get("recursive")) # rules apply to all subdirectories as well
+    self.exclude_all = "*" in (yaml_cfg.get("exclude") or []) and not yaml_cfg.get("include")
+
+  def permits(self, filename):
+    if self.exclude is None or not self.exclude.match(filename):
+      return True
+    return self.include is not None and self.include.match(filename) is not None
+
+class RuleMatcher:
+  ''' Effective rules of a directory: its own rules plus the recursive rules inherited from parent directories.
+  ytime is the latest modification time of all involved YAML files.
+  '''
+  __slots__ = ('rules', 'parent', 'ytime')
+
+  def __init__(self, rules, ytime, parent=None):
+    self.rules = rules
+    self.parent = parent
+    self.ytime = max(ytime, parent.ytime) if parent else ytime
+
+  def permits(self, filename):
+    filename = os.path.normcase(filename)
+    matcher = self
+    while matcher is not None:
+      if matcher.rules is not None and not matcher.rules.permits(filename):
+        return False
+      matcher = matcher.parent
+    return True
+
+  # rules which get passed on to subdirectories
+  def inherited(self):
+    if self.rules is not None and self.rules.recursive:
+      return self
+    return self.parent
+
+  # True if no file of this directory tree can be permitted -> subdirectories don't need to be scanned
+  def excludes_all(self):
+    matcher = self
+    while matcher is not None:
+      if matcher.rules is not None and matcher.rules.recursive and matcher.rules.exclude_all:
+        return True
+      matcher = matcher.parent
+    return False